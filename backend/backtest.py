@@ -0,0 +1,197 @@
+"""
+趋势评分回测：把 get_visual_indicators 的 trend_score 与诊断兜底引擎的本地评分，
+在日线上以 (K 线序号 × 股票) 二维数组一次性向量化计算，统计各信号档位的胜率与后续收益。
+
+默认样本取自 app_cache 中已缓存的日 K，只覆盖被浏览过的股票，偏向热门标的；
+需要全市场结论时应传入完整的 frames，报告中的 universe_source 标明样本来源。
+"""
+import json
+import time
+import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from database import get_db_connection
+
+DEFAULT_HORIZONS = [1, 5, 10, 20] # 持有 K 线根数
+MIN_SCORE_BARS = 30 # 与线上一致：不足 30 根 K 线时评分固定为 50
+SCORE_BUCKETS = [10, 20, 30, 40, 50, 60, 70, 80, 96] # trend_score 分档（左闭右开）
+UNIVERSE_SOURCES = {
+    "app_cache": "app_cache 中已缓存的日 K（仅含被浏览过的股票，偏向热门标的）",
+    "frames": "调用方传入的日 K"
+}
+
+
+def load_kline_frames() -> Dict[str, pd.DataFrame]:
+    """读取 app_cache 中已缓存的全部日 K（kline_{symbol}），同一代码保留最长的一份"""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT cache_key, result_json FROM app_cache WHERE cache_key LIKE 'kline\\_%' ESCAPE '\\'").fetchall()
+    conn.close()
+    frames = {}
+    for row in rows:
+        code = "".join(filter(str.isdigit, row['cache_key']))[-6:]
+        if len(code) != 6:
+            continue
+        try:
+            df = pd.DataFrame(json.loads(row['result_json']))
+        except Exception:
+            continue
+        if {"日期", "收盘", "成交量"} <= set(df.columns) and len(df) > len(frames.get(code, [])):
+            frames[code] = df
+    return frames
+
+
+def _parse_dates(series: pd.Series) -> pd.Series:
+    """缓存中的日期可能是字符串，也可能是 to_json 写出的毫秒时间戳"""
+    if pd.api.types.is_numeric_dtype(series):
+        return pd.to_datetime(series, unit='ms')
+    # 全市场日期取值有限，只解析去重后的字符串
+    codes, uniques = pd.factorize(series.astype(str))
+    parsed = pd.to_datetime(pd.Series(uniques).str[:10]).to_numpy()
+    return pd.Series(parsed[codes], index=series.index)
+
+
+def build_panel(frames: Dict[str, pd.DataFrame]) -> dict:
+    """按 K 线序号左对齐成二维数组（行为第 i 根 K 线，列为股票），停牌日天然跳过，与线上逐股计算一致"""
+    codes = sorted(code for code, df in frames.items() if len(df))
+    if not codes:
+        empty = np.empty((0, 0))
+        return {"codes": [], "close": empty, "volume": empty, "dates": empty.astype("datetime64[D]")}
+    # 各列拼成一维长数组后统一解析日期、排序，再按 (序号, 股票) 一次性散布进矩阵
+    lengths = np.array([len(frames[code]) for code in codes])
+    cols = np.repeat(np.arange(len(codes)), lengths)
+    stamps = _parse_dates(pd.Series(np.concatenate([frames[code]["日期"].to_numpy() for code in codes])).infer_objects())
+    stamps = stamps.to_numpy(dtype="datetime64[D]")
+    order = np.lexsort((stamps, cols))
+    cols = cols[order]
+    rows = np.arange(len(cols)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    shape = (int(rows.max()) + 1, len(codes))
+    close = np.full(shape, np.nan)
+    volume = np.full(shape, np.nan)
+    dates = np.full(shape, np.datetime64("NaT"), dtype="datetime64[D]")
+    for target, field in ((close, "收盘"), (volume, "成交量")):
+        values = np.concatenate([frames[code][field].to_numpy() for code in codes])
+        target[rows, cols] = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)[order]
+    dates[rows, cols] = stamps[order]
+    return {"codes": codes, "close": close, "volume": volume, "dates": dates}
+
+
+def compute_scores(close: np.ndarray, volume: np.ndarray) -> dict:
+    """复现线上两套评分规则（逐列向量化），返回 trend_score 与兜底评分矩阵"""
+    c, v = pd.DataFrame(close), pd.DataFrame(volume)
+    bars = np.cumsum(~np.isnan(close), axis=0)
+
+    # get_visual_indicators：MACD(12,26,9)、BOLL(20,2)、5 日量比与当日涨跌幅
+    dif = c.ewm(span=12, adjust=False).mean() - c.ewm(span=26, adjust=False).mean()
+    dea = dif.ewm(span=9, adjust=False).mean()
+    macd = ((dif - dea) * 2).to_numpy()
+    dif, dea = dif.to_numpy(), dea.to_numpy()
+    # 滚动统计用 pandas rolling 逐列增量计算（与线上同一实现），不展开 (K 线 × 股票 × 窗口) 的临时数组
+    rolling20 = c.rolling(20)
+    ma20 = rolling20.mean().to_numpy()
+    std20 = rolling20.std().to_numpy()
+    upper = ma20 + 2 * std20
+    lower = ma20 - 2 * std20
+    vol_ma5 = v.rolling(5).mean().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_ratio = np.where(vol_ma5 > 0, np.round(volume / vol_ma5, 2), 1.0)
+        prev = np.vstack([np.full((1, close.shape[1]), np.nan), close[:-1]])
+        change = np.where(prev > 0, np.round((close - prev) / prev * 100, 2), 0.0)
+
+    trend = (50 + 15 * (dif > dea) + 5 * (macd > 0) + 10 * (close > ma20)
+             + 10 * (vol_ratio > 1.2) - 5 * (vol_ratio < 0.8)
+             - 10 * (close > upper) + 10 * (close < lower)
+             + 10 * (change > 2) - 10 * (change < -2))
+    trend_score = np.where(bars >= MIN_SCORE_BARS, np.clip(trend, 10, 95), 50).astype(float)
+
+    # 诊断兜底引擎：站上 MA20 ±15，上涨 +10 / 否则 -5；不足 30 根时视为未站上
+    above_ma20 = (bars >= MIN_SCORE_BARS) & (close > ma20)
+    fallback_score = 50 + np.where(above_ma20, 15, -15) + np.where(change > 0, 10, -5)
+
+    valid = ~np.isnan(close)
+    trend_score[~valid] = np.nan
+    fallback_score = np.where(valid, fallback_score, np.nan)
+    return {"trend_score": trend_score, "fallback_score": fallback_score}
+
+
+def _bucket_stats(samples: Dict[int, dict], rule: str, predicate, hit_sign: int) -> dict:
+    """某个信号档位在各持有期的样本数、胜率与收益分布；hit_sign 为 1 看涨、-1 看跌、0 不计胜率"""
+    stats = {}
+    for h, sample in samples.items():
+        values = sample["returns"][predicate(sample[rule])]
+        if len(values) == 0:
+            stats[f"{h}d"] = None
+            continue
+        stats[f"{h}d"] = {
+            "samples": int(len(values)),
+            "hit_rate": round(float((np.sign(values) == hit_sign).mean()), 4) if hit_sign else None,
+            "up_rate": round(float((values > 0).mean()), 4),
+            "mean_return": round(float(values.mean()) * 100, 3),
+            "median_return": round(float(np.median(values)) * 100, 3)
+        }
+    return stats
+
+
+def run_backtest(frames: Optional[Dict[str, pd.DataFrame]] = None, start: Optional[str] = None,
+                 horizons: Optional[List[int]] = None) -> dict:
+    """回测：信号在当日收盘产生、按收盘价计收益，统计 start 之后的信号；未传 frames 时取 app_cache 中的日 K"""
+    began = time.time()
+    horizons = horizons or DEFAULT_HORIZONS
+    source = "frames" if frames is not None else "app_cache"
+    panel = build_panel(frames if frames is not None else load_kline_frames())
+    close = panel["close"]
+    if close.size == 0:
+        return {"universe": 0, "universe_source": source, "universe_note": UNIVERSE_SOURCES[source],
+                "signals": 0, "horizons": horizons, "rules": {}}
+
+    scores = compute_scores(close, panel["volume"])
+    evaluated = ~np.isnan(close)
+    if start:
+        evaluated &= panel["dates"] >= np.datetime64(start)
+    # 每个持有期只保留有后续收盘价的信号，压成一维样本后再分档统计
+    samples = {}
+    for h in horizons:
+        shifted = np.vstack([close[h:], np.full((min(h, len(close)), close.shape[1]), np.nan)])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = shifted / close - 1
+        keep = evaluated & np.isfinite(returns)
+        samples[h] = {"returns": returns[keep], "trend_score": scores["trend_score"][keep],
+                      "fallback_score": scores["fallback_score"][keep]}
+
+    trend_signals = {
+        "Buy": _bucket_stats(samples, "trend_score", lambda s: s > 60, 1),
+        "Neutral": _bucket_stats(samples, "trend_score", lambda s: (s >= 40) & (s <= 60), 0),
+        "Sell": _bucket_stats(samples, "trend_score", lambda s: s < 40, -1)
+    }
+    score_buckets = [
+        {"range": f"{lo}-{hi - 1}", **_bucket_stats(samples, "trend_score", lambda s, lo=lo, hi=hi: (s >= lo) & (s < hi), 0)}
+        for lo, hi in zip(SCORE_BUCKETS, SCORE_BUCKETS[1:])
+    ]
+    fallback_signals = {
+        "Buy": _bucket_stats(samples, "fallback_score", lambda s: s > 55, 1),
+        "Neutral": _bucket_stats(samples, "fallback_score", lambda s: s <= 55, 0)
+    }
+    valid_dates = panel["dates"][evaluated]
+    return {
+        "universe": len(panel["codes"]),
+        "universe_source": source,
+        "universe_note": UNIVERSE_SOURCES[source],
+        "signals": int(evaluated.sum()),
+        "start": str(valid_dates.min()) if len(valid_dates) else None,
+        "end": str(valid_dates.max()) if len(valid_dates) else None,
+        "horizons": horizons,
+        "baseline": _bucket_stats(samples, "trend_score", lambda s: np.ones(len(s), dtype=bool), 0),
+        "rules": {
+            "trend_score": {"signals": trend_signals, "score_buckets": score_buckets},
+            "local_fallback": {"signals": fallback_signals}
+        },
+        "elapsed": round(time.time() - began, 2),
+        "generated_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run_backtest(), ensure_ascii=False, indent=2))
@@ -127,11 +127,18 @@ def init_database():
         CREATE TABLE IF NOT EXISTS request_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
-            action_type TEXT NOT NULL, -- e.g., 'analysis'
+            action_type TEXT NOT NULL, -- e.g., 'analysis', 'view'
+            symbol TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    # 迁移：记录请求涉及的股票代码，用于热门标的统计
+    try:
+        cursor.execute("ALTER TABLE request_logs ADD COLUMN symbol TEXT")
+    except sqlite3.OperationalError:
+        pass # 列已存在
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_request_logs_created ON request_logs (created_at)')
 
     # 创建分析结果缓存表
     cursor.execute('''
@@ -143,28 +150,213 @@ def init_database():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_cache_symbol_date ON analysis_cache (symbol, date)')
+    # 迁移：(symbol, date) 改为唯一键。建立唯一索引前先清理重复记录，只保留最新一条
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_analysis_cache_symbol_date_unique'")
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            DELETE FROM analysis_cache WHERE id NOT IN (
+                SELECT MAX(id) FROM analysis_cache GROUP BY symbol, date
+            )
+        ''')
+        cursor.execute('DROP INDEX IF EXISTS idx_analysis_cache_symbol_date')
+        cursor.execute('CREATE UNIQUE INDEX idx_analysis_cache_symbol_date_unique ON analysis_cache (symbol, date)')
     
-    # 创建新闻缓存表
+    # 迁移：旧的按天新闻列表缓存已由 news_items 取代
+    cursor.execute('DROP TABLE IF EXISTS news_cache')
+
+    # 创建新闻条目表 (各来源增量采集后去重入库)
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS news_cache (
+        CREATE TABLE IF NOT EXISTS news_items (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             symbol TEXT NOT NULL,
-            date TEXT NOT NULL,
-            result_json TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            source TEXT NOT NULL,
+            url TEXT NOT NULL,
+            title TEXT NOT NULL,
+            published_at TEXT,
+            media TEXT,
+            is_direct INTEGER DEFAULT 1,
+            ingested_at REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(symbol, url)
+        )
+    ''')
+    # 迁移：入库时间戳（保留期按入库时间计算，发布时间可能为空）
+    try:
+        cursor.execute("ALTER TABLE news_items ADD COLUMN ingested_at REAL")
+        cursor.execute("UPDATE news_items SET ingested_at = CAST(strftime('%s', created_at) AS REAL) WHERE ingested_at IS NULL")
+    except sqlite3.OperationalError:
+        pass # 列已存在
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_news_items_symbol_time ON news_items (symbol, published_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_news_items_ingested ON news_items (ingested_at)')
+
+    # 创建新闻采集游标表 (每个来源、每只股票记录最新已入库时间)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS news_cursors (
+            source TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            last_seen TEXT,
+            last_fetched REAL,
+            PRIMARY KEY (source, symbol)
+        )
+    ''')
+
+    # 创建新闻解读表 (按 URL/标题哈希寻址，跨股票复用同一条新闻的解读)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS news_interpretations (
+            content_key TEXT PRIMARY KEY,
+            url TEXT,
+            title TEXT,
+            tag TEXT NOT NULL,
+            interpretation TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at REAL NOT NULL
         )
     ''')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_news_cache_symbol_date ON news_cache (symbol, date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_news_interpretations_expires ON news_interpretations (expires_at)')
 
     # 创建通用应用内存替代缓存表 (K线 / 大盘 / 板块热点)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS app_cache (
             cache_key TEXT PRIMARY KEY,
             result_json TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            revision INTEGER
+        )
+    ''')
+    # 迁移：纳秒级写入版本号，updated_at 只精确到秒，同一秒内的两次写入需靠它区分
+    try:
+        cursor.execute("ALTER TABLE app_cache ADD COLUMN revision INTEGER")
+    except sqlite3.OperationalError:
+        pass # 列已存在
+    
+    # 创建个股行业映射表 (由板块成分股批量构建)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_industry (
+            code TEXT PRIMARY KEY,
+            industry TEXT NOT NULL,
+            source TEXT,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_industry_industry ON stock_industry (industry)')
+
+    # 创建同业分位数表 (每晚全市场批量计算；_pct 为行业内分位，_mkt 为全市场分位，_ind 为行业中位的全市场分位)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS peer_percentiles (
+            code TEXT PRIMARY KEY,
+            industry TEXT NOT NULL,
+            peer_count INTEGER,
+            report_date TEXT,
+            valuation_pct REAL,
+            valuation_mkt REAL,
+            valuation_ind REAL,
+            profitability_pct REAL,
+            profitability_mkt REAL,
+            profitability_ind REAL,
+            growth_pct REAL,
+            growth_mkt REAL,
+            growth_ind REAL,
+            dividend_pct REAL,
+            dividend_mkt REAL,
+            dividend_ind REAL,
+            health_pct REAL,
+            health_mkt REAL,
+            health_ind REAL,
+            sentiment_pct REAL,
+            sentiment_mkt REAL,
+            sentiment_ind REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 创建个股资金流向表 (按交易日增量存储)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS money_flow (
+            code TEXT NOT NULL,
+            date TEXT NOT NULL,
+            main_net REAL, main_pct REAL,
+            super_net REAL, super_pct REAL,
+            large_net REAL, large_pct REAL,
+            medium_net REAL, medium_pct REAL,
+            small_net REAL, small_pct REAL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (code, date)
+        )
+    ''')
+
+    # 创建 5 分钟 K 线表 (分时采集器写入，30/60 分钟线由其聚合得到)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS minute_bars (
+            code TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (code, ts)
+        )
+    ''')
+
+    # 创建价格提醒表 (kind: price/change_pct/volume_ratio/rsi；direction: 1 向上突破，-1 向下跌破)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS price_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            stock_code TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            threshold REAL NOT NULL,
+            direction INTEGER NOT NULL,
+            active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            triggered_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_price_alerts_user ON price_alerts (user_id)')
+
+    # 创建提醒触发记录表 (推送通道按 user_id + id 增量读取)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alert_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            stock_code TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            threshold REAL NOT NULL,
+            direction INTEGER NOT NULL,
+            value REAL,
+            triggered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alert_events_user ON alert_events (user_id, id)')
+
+    # 创建盘中指标基准表 (前一交易日收盘后的 Wilder RSI 平均涨跌幅，用于实时 RSI)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_indicators (
+            code TEXT PRIMARY KEY,
+            trade_date TEXT NOT NULL,
+            prev_close REAL,
+            avg_gain REAL,
+            avg_loss REAL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+    # 创建跨进程任务锁表 (多 worker 部署时保证定时任务只执行一次)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_locks (
+            lock_key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+    # 创建跨进程计数器表 (多 worker 共享的每日调用预算等)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_counters (
+            counter_key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+    ''')
     
     # 插入默认管理员账号
     default_password = hashlib.sha256("Xinsiwei2026@".encode()).hexdigest()
@@ -5,24 +5,34 @@ import asyncio
 import sqlite3
 import akshare as ak
 import pandas as pd
+import numpy as np
 import httpx
 import uuid
 import random
 import datetime
 import re
 import json
+import gzip
+import bisect
+import math
+import hashlib
 import urllib.parse
+import contextvars
 from typing import List, Optional, Dict
 from functools import lru_cache
+from collections import OrderedDict
 from threading import Lock
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 import shutil
 from alipay import AliPay
 from alipay.utils import AliPayConfig
 from database import get_db_connection, hash_password, init_database
+from backtest import run_backtest, DEFAULT_HORIZONS
 
 # Explicitly disable proxies to prevent 'Unable to connect to proxy' errors in akshare/requests
 os.environ['HTTP_PROXY'] = ''
@@ -219,7 +229,7 @@ def is_view_allowed(identifier: str, symbol: str) -> bool:
         _last_view_cache[identifier] = (symbol, now)
         return True
 
-def check_vip_rate_limit(user_id: int) -> dict:
+def check_vip_rate_limit(user_id: int, symbol: Optional[str] = None) -> dict:
     """检查VIP会员分析频次 (每小时20次)"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -258,47 +268,185 @@ def check_vip_rate_limit(user_id: int) -> dict:
     
     # 记录本次请求
     cursor.execute(
-        "INSERT INTO request_logs (user_id, action_type) VALUES (?, 'analysis')",
-        (user_id,)
+        "INSERT INTO request_logs (user_id, action_type, symbol) VALUES (?, 'analysis', ?)",
+        (user_id, "".join(filter(str.isdigit, symbol)) if symbol else None)
     )
     conn.commit()
     conn.close()
     return {"allowed": True, "count": count + 1, "limit": limit}
 
+def log_symbol_view(user_id: int, symbol: str):
+    """记录登录用户的个股浏览，用于热门标的统计"""
+    try:
+        conn = get_db_connection()
+        conn.execute(
+            "INSERT INTO request_logs (user_id, action_type, symbol) VALUES (?, 'view', ?)",
+            (user_id, "".join(filter(str.isdigit, symbol)))
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"View log error for {symbol}: {e}")
+
+def _hot_symbol_scores(days: int = 3) -> Dict[str, int]:
+    """近期浏览/分析次数与自选人数的综合热度分"""
+    scores = {}
+    try:
+        since = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT symbol, COUNT(*) AS cnt FROM request_logs WHERE symbol IS NOT NULL AND created_at > ? GROUP BY symbol",
+            (since,)
+        )
+        for row in cursor.fetchall():
+            scores[row['symbol']] = scores.get(row['symbol'], 0) + row['cnt']
+        # 自选人数代表持续关注度，权重高于单次浏览
+        cursor.execute("SELECT stock_code, COUNT(*) AS cnt FROM watchlist GROUP BY stock_code")
+        for row in cursor.fetchall():
+            code = "".join(filter(str.isdigit, row['stock_code']))
+            scores[code] = scores.get(code, 0) + row['cnt'] * 3
+        conn.close()
+    except Exception as e:
+        logger.error(f"Hot symbols query error: {e}")
+    return scores
+
+def get_hot_symbols(limit: int = 50, days: int = 3) -> List[str]:
+    """按近期浏览/分析次数与自选人数综合排序，返回热门股票代码"""
+    ranked = sorted(_hot_symbol_scores(days).items(), key=lambda x: x[1], reverse=True)
+    return [code for code, _ in ranked if code][:limit]
+
+_JOB_LOCK_OWNER = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+def try_acquire_job_lock(lock_key: str, ttl: float) -> bool:
+    """获取跨进程任务锁（基于 SQLite 主键），成功返回 True；锁在 ttl 秒后自动失效"""
+    now = time.time()
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM job_locks WHERE expires_at < ?", (now,))
+        cursor.execute(
+            "INSERT OR IGNORE INTO job_locks (lock_key, owner, expires_at) VALUES (?, ?, ?)",
+            (lock_key, _JOB_LOCK_OWNER, now + ttl)
+        )
+        acquired = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return acquired
+    except Exception as e:
+        logger.error(f"Job lock error for {lock_key}: {e}")
+        return False
+
+def release_job_lock(lock_key: str):
+    """提前释放本进程持有的任务锁"""
+    try:
+        conn = get_db_connection()
+        conn.execute("DELETE FROM job_locks WHERE lock_key = ? AND owner = ?", (lock_key, _JOB_LOCK_OWNER))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Job lock release error for {lock_key}: {e}")
+
+def try_consume_job_budget(counter_key: str, limit: int) -> bool:
+    """在跨进程计数器上占用一次额度（条件 UPDATE 保证原子性），额度用尽返回 False"""
+    now = time.time()
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # 顺带清理两天前的计数器
+        cursor.execute("DELETE FROM job_counters WHERE updated_at < ?", (now - 2 * 86400,))
+        cursor.execute("INSERT OR IGNORE INTO job_counters (counter_key, value, updated_at) VALUES (?, 0, ?)", (counter_key, now))
+        cursor.execute(
+            "UPDATE job_counters SET value = value + 1, updated_at = ? WHERE counter_key = ? AND value < ?",
+            (now, counter_key, limit)
+        )
+        consumed = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return consumed
+    except Exception as e:
+        logger.error(f"Job counter error for {counter_key}: {e}")
+        return False
+
+# 诊断结果的进程内 LRU，位于 SQLite 缓存之前
+ANALYSIS_LRU_SIZE = 256
+ANALYSIS_CACHE_RETENTION_DAYS = 7
+_analysis_lru = OrderedDict()
+_analysis_lru_lock = Lock()
+
+def _analysis_lru_put(key: tuple, result: dict):
+    with _analysis_lru_lock:
+        _analysis_lru[key] = result
+        _analysis_lru.move_to_end(key)
+        while len(_analysis_lru) > ANALYSIS_LRU_SIZE:
+            _analysis_lru.popitem(last=False)
+
 def get_cached_analysis(symbol: str, date_tag: str) -> Optional[dict]:
-    """快捷获取缓存的分析结果"""
+    """快捷获取缓存的分析结果（先查内存 LRU，再按唯一键查 SQLite）"""
+    key = (symbol, date_tag)
+    with _analysis_lru_lock:
+        if key in _analysis_lru:
+            _analysis_lru.move_to_end(key)
+            return _analysis_lru[key]
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT result_json FROM analysis_cache WHERE symbol = ? AND date = ? ORDER BY created_at DESC LIMIT 1",
+            "SELECT result_json FROM analysis_cache WHERE symbol = ? AND date = ?",
             (symbol, date_tag)
         )
         row = cursor.fetchone()
         conn.close()
         if row:
-            import json
-            return json.loads(row['result_json'])
+            result = json.loads(row['result_json'])
+            _analysis_lru_put(key, result)
+            return result
     except Exception as e:
         logger.error(f"Cache fetch error for {symbol}: {e}")
     return None
 
 def save_analysis_to_cache(symbol: str, date_tag: str, result: dict):
-    """保存分析结果到持久化缓存"""
+    """保存分析结果到持久化缓存（同一 symbol + date_tag 只保留一行）"""
     try:
-        import json
         result_json = json.dumps(result)
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO analysis_cache (symbol, date, result_json) VALUES (?, ?, ?)",
+            """INSERT INTO analysis_cache (symbol, date, result_json) VALUES (?, ?, ?)
+               ON CONFLICT(symbol, date) DO UPDATE SET result_json = excluded.result_json, created_at = CURRENT_TIMESTAMP""",
             (symbol, date_tag, result_json)
         )
         conn.commit()
         conn.close()
+        _analysis_lru_put((symbol, date_tag), result)
     except Exception as e:
         logger.error(f"Cache save error for {symbol}: {e}")
 
+def compact_analysis_cache(retention_days: int = ANALYSIS_CACHE_RETENTION_DAYS):
+    """诊断缓存的保留与压缩：
+    1. 往日的盘中分桶记录合并为当日最后一条日级记录；
+    2. 删除超过保留天数的记录（释放的页由 SQLite 复用；不做 VACUUM，避免整库排他锁阻塞各 worker）。
+    """
+    today = datetime.date.today().isoformat()
+    cutoff = (datetime.date.today() - datetime.timedelta(days=retention_days)).isoformat()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # SQLite 的 MAX() 聚合会让其余裸列取自 created_at 最大的那一行
+    cursor.execute(
+        """INSERT OR IGNORE INTO analysis_cache (symbol, date, result_json, created_at)
+           SELECT symbol, substr(date, 1, 10), result_json, MAX(created_at) FROM analysis_cache
+           WHERE length(date) > 10 AND substr(date, 1, 10) < ?
+           GROUP BY symbol, substr(date, 1, 10)""",
+        (today,)
+    )
+    cursor.execute("DELETE FROM analysis_cache WHERE length(date) > 10 AND substr(date, 1, 10) < ?", (today,))
+    compacted = cursor.rowcount
+    cursor.execute("DELETE FROM analysis_cache WHERE substr(date, 1, 10) < ?", (cutoff,))
+    expired = cursor.rowcount
+    conn.commit()
+    conn.close()
+    logger.info(f"Analysis cache compacted: {compacted} intraday rows merged, {expired} expired rows removed.")
+
 def generate_captcha_svg(code: str):
     width = 100
     height = 40
@@ -333,6 +481,186 @@ def verify_captcha(captcha_id: str, code: str):
         del captcha_store[captcha_id] # Use once
     return is_valid
 
+# ==================== 行业映射索引 ====================
+# INDUSTRY_CACHE 以内置蓝筹映射为种子，启动时合并 stock_industry 表；
+# 全量映射由板块成分股每日批量重建，增量来源（实时行情、个股详情）只写入有变化的代码
+INDUSTRY_REBUILD_CONCURRENCY = 2
+_industry_lock = Lock()
+
+def load_industry_index():
+    """从 stock_industry 表加载行业映射到内存"""
+    try:
+        conn = get_db_connection()
+        rows = conn.execute("SELECT code, industry FROM stock_industry").fetchall()
+        conn.close()
+        with _industry_lock:
+            INDUSTRY_CACHE.update({row['code']: row['industry'] for row in rows})
+        logger.info(f"Industry index loaded: {len(rows)} codes.")
+    except Exception as e:
+        logger.error(f"Industry index load error: {e}")
+
+def apply_industry_updates(mapping: pd.Series, source: str) -> int:
+    """以 代码 -> 行业 的 Series 批量更新映射，仅持久化与当前索引不同的条目，返回变更数"""
+    mapping = mapping.astype(str)
+    mapping = mapping[(mapping != "") & (mapping != "0") & (mapping != "nan")]
+    mapping = mapping[~mapping.index.duplicated(keep="last")]
+    with _industry_lock:
+        current = pd.Series(INDUSTRY_CACHE, dtype=object).reindex(mapping.index)
+        changed = mapping[current.ne(mapping)]
+        if changed.empty:
+            return 0
+        INDUSTRY_CACHE.update(changed.to_dict())
+    try:
+        conn = get_db_connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO stock_industry (code, industry, source, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            [(code, industry, source) for code, industry in changed.items()]
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Industry index save error: {e}")
+    return len(changed)
+
+def get_stock_industry(code: str) -> Optional[str]:
+    return INDUSTRY_CACHE.get(code)
+
+async def rebuild_industry_index():
+    """遍历全部行业板块的成分股，批量重建 代码 -> 行业 映射"""
+    board = data_manager.get_board_snapshot(BackgroundTasks())
+    if board.empty:
+        await data_manager.update_sector_data()
+        board = data_manager.get_board_snapshot(BackgroundTasks())
+    semaphore = asyncio.Semaphore(INDUSTRY_REBUILD_CONCURRENCY)
+    frames = []
+
+    async def load_board(name: str):
+        async with semaphore:
+            try:
+                # 只取成分股建映射，不把全部行业板块登记进展示用的内存缓存
+                members = await _fetch_sector_members(name)
+                if members:
+                    frames.append(pd.DataFrame({"代码": [m["代码"] for m in members], "行业": name}))
+            except Exception as e:
+                logger.warning(f"Industry rebuild failed for board {name}: {e}")
+
+    await asyncio.gather(*(load_board(n) for n in board["name"].tolist()))
+    if not frames:
+        return
+    df = pd.concat(frames, ignore_index=True)
+    changed = await asyncio.to_thread(apply_industry_updates, pd.Series(df["行业"].values, index=df["代码"].values), "board")
+    logger.info(f"Industry index rebuilt from {len(frames)} boards: {len(df)} codes, {changed} changed.")
+
+async def ensure_industry_index():
+    """启动时加载映射；表为空（首次部署）时由一个 worker 立即全量构建"""
+    await asyncio.to_thread(load_industry_index)
+    conn = get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM stock_industry").fetchone()[0]
+    conn.close()
+    if count == 0 and try_acquire_job_lock("industry_index_bootstrap", 3600):
+        await rebuild_industry_index()
+
+# ==================== 预编码 JSON 响应 ====================
+# 行情快照类接口只在快照刷新时变化：每个快照版本编码一次，之后直接返回字节
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库 json
+    orjson = None
+
+ENCODED_RESPONSE_MAX = 512 # 预编码结果的 LRU 容量（K 线按代码各占一项）
+GZIP_MIN_SIZE = 1024 # 小于该字节数的响应不压缩
+_encoded_responses: "OrderedDict[str, dict]" = OrderedDict() # name -> {version, body, etag, gzip}
+
+class PreEncodedJSONResponse(Response):
+    media_type = "application/json"
+
+def _finite(obj):
+    """递归将 NaN/Inf 置 0，保证输出为合法 JSON；numpy 数组与标量转为 Python 原生类型"""
+    if isinstance(obj, np.ndarray):
+        obj = obj.tolist()
+    elif isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else 0.0
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+def encode_json(obj) -> bytes:
+    """快速 JSON 编码：NaN/Inf 输出为 0，非 ASCII 原样输出"""
+    obj = _finite(obj)
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+def get_encoded_response(name: str, version: Optional[str]) -> Optional[dict]:
+    """取 name 在快照版本 version 下的预编码结果，版本不符视为未命中"""
+    if version is None:
+        return None
+    entry = _encoded_responses.get(name)
+    if entry is None or entry["version"] != version:
+        return None
+    _encoded_responses.move_to_end(name)
+    return entry
+
+def put_encoded_response(name: str, version: Optional[str], obj) -> dict:
+    body = encode_json(obj)
+    # ETag 取内容摘要：多 worker 之间一致，快照重建但内容未变时客户端缓存依然有效
+    entry = {"version": version, "body": body, "etag": f'"{hashlib.sha1(body).hexdigest()[:20]}"', "gzip": None}
+    if version is not None:
+        _encoded_responses[name] = entry
+        _encoded_responses.move_to_end(name)
+        while len(_encoded_responses) > ENCODED_RESPONSE_MAX:
+            _encoded_responses.popitem(last=False)
+    return entry
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """按 q 值判断客户端是否接受 gzip（gzip;q=0 表示拒绝，未列出时参考 *）"""
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+def snapshot_response(request: Optional[Request], entry: dict) -> Response:
+    """按条件请求与压缩协商返回预编码结果；压缩结果挂在条目上，同一版本只压缩一次"""
+    if request is None:
+        return PreEncodedJSONResponse(entry["body"])
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry["etag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    body = entry["body"]
+    if len(body) >= GZIP_MIN_SIZE and _accepts_gzip(request.headers.get("accept-encoding", "")):
+        if entry["gzip"] is None:
+            entry["gzip"] = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+        body = entry["gzip"]
+    return PreEncodedJSONResponse(body, headers=headers)
+
+# 行业板块快照的统一列名
+BOARD_COLUMNS = ["name", "code", "price", "change", "change_amount", "amount", "turnover", "total_mv",
+                 "up_count", "down_count", "leader", "leader_change"]
+BOARD_COLUMNS_EM = {
+    "板块名称": "name", "板块代码": "code", "最新价": "price", "涨跌幅": "change", "涨跌额": "change_amount",
+    "成交额": "amount", "换手率": "turnover", "总市值": "total_mv", "上涨家数": "up_count",
+    "下跌家数": "down_count", "领涨股票": "leader", "领涨股票-涨跌幅": "leader_change"
+}
+BOARD_COLUMNS_SINA = {"label": "code", "trade": "price", "changepercent": "change", "pricechange": "change_amount"}
+
 class StockDataManager:
     def __init__(self):
         self._stock_list = None
@@ -350,6 +678,12 @@ class StockDataManager:
         self._is_updating_index = False
         self.sector_expiry = 300 # 5 minutes
         self._is_updating_sector = False
+        self.board_timeout = 15.0
+        self._board_df = None # 全部行业板块的列式快照
+        self._last_board_update = 0
+        self._name_index: Dict[str, str] = {} # 代码 -> 名称，由股票列表与实时行情维护
+        self._spot_index = None # 按代码索引的全市场行情，缓存版本变化时才重新解析
+        self._spot_index_version = None
 
     def _get_db_cache(self, key: str, max_age: int):
         try:
@@ -368,6 +702,20 @@ class StockDataManager:
             logger.error(f"sqlite db cache fetch error {key}: {e}")
         return None
 
+    def _get_db_cache_version(self, key: str, max_age: int) -> Optional[str]:
+        """缓存条目的版本（写入时间#纳秒版本号），过期或不存在返回 None；不读取也不解析数据本体"""
+        try:
+            conn = get_db_connection()
+            row = conn.execute("SELECT updated_at, revision FROM app_cache WHERE cache_key = ?", (key,)).fetchone()
+            conn.close()
+            if row:
+                updated_at = datetime.datetime.strptime(row['updated_at'], "%Y-%m-%d %H:%M:%S").timestamp()
+                if time.time() - updated_at < max_age:
+                    return f"{row['updated_at']}#{row['revision'] or 0}"
+        except Exception as e:
+            logger.error(f"sqlite db cache version error {key}: {e}")
+        return None
+
     def _set_db_cache(self, key: str, data):
         try:
             import json, datetime
@@ -378,14 +726,30 @@ class StockDataManager:
             conn = get_db_connection()
             cursor = conn.cursor()
             cursor.execute(
-                "INSERT OR REPLACE INTO app_cache (cache_key, result_json, updated_at) VALUES (?, ?, ?)",
-                (key, result_json, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                "INSERT OR REPLACE INTO app_cache (cache_key, result_json, updated_at, revision) VALUES (?, ?, ?, ?)",
+                (key, result_json, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), time.time_ns())
             )
             conn.commit()
             conn.close()
         except Exception as e:
             logger.error(f"sqlite db cache save error {key}: {e}")
 
+    def _update_name_index(self, df: pd.DataFrame):
+        """用含 代码/名称 列的行情表刷新名称索引"""
+        if df is None or df.empty or "代码" not in df.columns or "名称" not in df.columns:
+            return
+        codes = df["代码"].astype(str).str.zfill(6)
+        names = df["名称"].astype(str)
+        self._name_index.update(zip(codes, names))
+
+    def get_stock_name(self, code: str) -> Optional[str]:
+        """代码转名称，纯内存查找；索引为空时先从本地缓存的股票列表加载"""
+        if not self._name_index:
+            cached = self._get_db_cache('stock_list', 999999)
+            if cached:
+                self._update_name_index(pd.DataFrame(cached))
+        return self._name_index.get(code)
+
     async def update_stock_list(self):
         if self._is_updating_list: return
         self._is_updating_list = True
@@ -397,6 +761,7 @@ class StockDataManager:
                 if data is not None and not data.empty:
                     df = data[['代码', '名称']].copy()
                     self._set_db_cache('stock_list', df)
+                    self._update_name_index(df)
                     logger.info(f"Stock list updated via EM: {len(df)} stocks.")
                     return
             except Exception as e:
@@ -428,6 +793,7 @@ class StockDataManager:
             if all_stocks:
                 df = pd.DataFrame(all_stocks).drop_duplicates(subset=['代码'])
                 self._set_db_cache('stock_list', df)
+                self._update_name_index(df)
                 logger.info(f"Stock list fully updated via Sina: {len(df)} stocks.")
                 return
         except Exception as e:
@@ -448,6 +814,7 @@ class StockDataManager:
         
         data = None
         source = ""
+        full_market = True # 直连新浪接口每个节点只取前 100 只，不是全市场快照
         
         # 1. Try EastMoney (EM) via akshare (Timeout 5s)
         try:
@@ -502,6 +869,7 @@ class StockDataManager:
                 if all_stocks:
                     data = pd.DataFrame(all_stocks).drop_duplicates(subset=['代码'])
                     source = "Multi-node Sina API"
+                    full_market = False
             except Exception as e:
                 logger.error(f"Spot data update via Direct Sina API failed: {e}")
 
@@ -531,17 +899,32 @@ class StockDataManager:
             
             cleaned_data = data.fillna(0).replace([float('inf'), float('-inf')], 0)
             
-            # 动态更新全局行业映射池 (如果有板块列)
+            # 动态更新全局行业映射池 (如果有板块列)，只写入变化的代码
             if "板块" in cleaned_data.columns:
                 try:
-                    for _, row in cleaned_data.iterrows():
-                        c_code = str(row['代码']).zfill(6)
-                        c_sector = str(row['板块'])
-                        if c_sector and c_sector != '0' and c_sector != 'nan':
-                            INDUSTRY_CACHE[c_code] = c_sector
-                except: pass
+                    apply_industry_updates(
+                        pd.Series(cleaned_data['板块'].values, index=cleaned_data['代码'].astype(str).str.zfill(6).values),
+                        "spot"
+                    )
+                except Exception as e:
+                    logger.warning(f"Industry index update from spot failed: {e}")
 
             self._set_db_cache('spot_data', cleaned_data)
+            self._update_name_index(cleaned_data)
+            if full_market:
+                try:
+                    breadth = compute_market_breadth(cleaned_data)
+                    if breadth:
+                        self._set_db_cache('market_breadth', breadth)
+                except Exception as e:
+                    logger.warning(f"Market breadth compute failed: {e}")
+            else:
+                # 部分快照算出的涨跌家数会严重失真，保留上一次的全市场结果
+                logger.info(f"Skip market breadth update: {source} is not a full-market snapshot")
+            try:
+                await asyncio.to_thread(evaluate_price_alerts, cleaned_data)
+            except Exception as e:
+                logger.error(f"Price alert evaluation failed: {e}")
             logger.info(f"Spot data successfully updated via {source}: {len(cleaned_data)} records.")
         
         self._is_updating_spot = False
@@ -588,66 +971,85 @@ class StockDataManager:
         finally:
             self._is_updating_index = False
 
-    async def update_sector_data(self):
-        if self._is_updating_sector: return
-        self._is_updating_sector = True
+    async def _fetch_board_snapshot(self) -> Optional[pd.DataFrame]:
+        """拉取全部行业板块行情，统一为列式 DataFrame（按涨跌幅降序）"""
+        board = None
+        source = ""
         try:
             logger.info("Updating sector data via AkShare (EM)...")
-            # Get industry board rankings
-            data = await asyncio.to_thread(ak.stock_board_industry_name_em)
+            data = await asyncio.wait_for(asyncio.to_thread(ak.stock_board_industry_name_em), timeout=self.board_timeout)
             if data is not None and not data.empty:
-                sectors = []
-                # Take top 15 sectors
-                for _, row in data.head(15).iterrows():
-                    sectors.append({
-                        "name": row['板块名称'],
-                        "change": float(row['涨跌幅']),
-                        "leaders": [row['领涨股票']],
-                        "code": row['板块代码']
-                    })
-                self._set_db_cache('sector_data', sectors)
-                logger.info(f"Sector data updated: {len(sectors)} sectors.")
-                return
+                board = data.rename(columns=BOARD_COLUMNS_EM)
+                source = "EM"
         except Exception as e:
             logger.error(f"Sector data update error (AkShare): {e}")
 
-        # Fallback to a simpler, faster method if AkShare fails or is too slow
+        # Fallback to Sina industry ranking if AkShare fails or is too slow
+        if board is None:
+            try:
+                logger.info("Falling back to Sina for sector update...")
+                url = "http://vip.stock.finance.sina.com.cn/quotes_service/api/json_v2.php/Market_Center.getHQNodeData?page=1&num=200&sort=changepercent&asc=0&node=hangye"
+                async with httpx.AsyncClient(timeout=5.0) as client:
+                    resp = await client.get(url)
+                    if resp.status_code == 200 and resp.json():
+                        # Sina doesn't provide leader name in this API, use code as fallback
+                        board = pd.DataFrame(resp.json()).rename(columns=BOARD_COLUMNS_SINA)
+                        board["leader"] = board["code"]
+                        source = "Sina"
+            except Exception as e:
+                logger.error(f"Sector data fallback error: {e}")
+
+        if board is None or board.empty:
+            return None
+        board = board.reindex(columns=BOARD_COLUMNS)
+        numeric = [c for c in BOARD_COLUMNS if c not in ("name", "code", "leader")]
+        board[numeric] = board[numeric].apply(pd.to_numeric, errors='coerce').fillna(0.0)
+        board[["name", "code", "leader"]] = board[["name", "code", "leader"]].fillna("").astype(str)
+        board = board.sort_values("change", ascending=False, kind="stable").reset_index(drop=True)
+        logger.info(f"Board snapshot updated via {source}: {len(board)} boards.")
+        return board
+
+    async def update_sector_data(self):
+        if self._is_updating_sector: return
+        self._is_updating_sector = True
         try:
-            logger.info("Falling back to Sina for fast sector update...")
-            # Use Sina Industry ranking API
-            url = "http://vip.stock.finance.sina.com.cn/quotes_service/api/json_v2.php/Market_Center.getHQNodeData?page=1&num=15&sort=changepercent&asc=0&node=hangye"
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                resp = await client.get(url)
-                if resp.status_code == 200:
-                    import json
-                    data = resp.json()
-                    sectors = []
-                    for item in data:
-                        sectors.append({
-                            "name": item['name'],
-                            "change": float(item['changepercent']),
-                            "leaders": [item['label']], # Sina doesn't always provide leader name in this API, use code as fallback
-                            "code": item['label']
-                        })
-                    if sectors:
-                        self._set_db_cache('sector_data', sectors)
-                        logger.info("Sector data updated via Sina fallback.")
-                        return
-        except Exception as e:
-            logger.error(f"Sector data fallback error: {e}")
-
-        # Ultimate fallback: hardcoded sectors so the UI is never empty
-        logger.warning("All sector data sources failed. Using hardcoded fallback.")
-        mock_sectors = [
-            {"name": "半导体", "change": 2.45, "leaders": ["北方华创"], "code": "bk0447"},
-            {"name": "新能源汽车", "change": 1.28, "leaders": ["比亚迪"], "code": "bk1029"},
-            {"name": "人工智能", "change": 3.12, "leaders": ["科大讯飞"], "code": "bk1036"},
-            {"name": "软件开发", "change": 1.85, "leaders": ["金山办公"], "code": "bk0448"},
-            {"name": "医药生物", "change": -0.45, "leaders": ["恒瑞医药"], "code": "bk0465"}
-        ]
-        self._set_db_cache('sector_data', mock_sectors)
-        
-        self._is_updating_sector = False
+            board = await self._fetch_board_snapshot()
+            if board is not None:
+                self._board_df = board
+                self._last_board_update = time.time()
+                self._set_db_cache('board_snapshot', board.to_dict(orient="list"))
+                # 首页热点板块沿用前 15 名
+                top = board.head(15)
+                sectors = [
+                    {"name": n, "change": float(c), "leaders": [l], "code": code}
+                    for n, c, l, code in zip(top["name"], top["change"], top["leader"], top["code"])
+                ]
+                self._set_db_cache('sector_data', sectors)
+                asyncio.create_task(precompute_sector_reasons(sectors))
+                return
+
+            # Ultimate fallback: hardcoded sectors so the UI is never empty
+            logger.warning("All sector data sources failed. Using hardcoded fallback.")
+            mock_sectors = [
+                {"name": "半导体", "change": 2.45, "leaders": ["北方华创"], "code": "bk0447"},
+                {"name": "新能源汽车", "change": 1.28, "leaders": ["比亚迪"], "code": "bk1029"},
+                {"name": "人工智能", "change": 3.12, "leaders": ["科大讯飞"], "code": "bk1036"},
+                {"name": "软件开发", "change": 1.85, "leaders": ["金山办公"], "code": "bk0448"},
+                {"name": "医药生物", "change": -0.45, "leaders": ["恒瑞医药"], "code": "bk0465"}
+            ]
+            self._set_db_cache('sector_data', mock_sectors)
+        finally:
+            self._is_updating_sector = False
+
+    def get_board_snapshot(self, background_tasks: BackgroundTasks) -> pd.DataFrame:
+        """全部行业板块的列式快照：内存优先，过期时后台刷新并先返回旧数据"""
+        if self._board_df is None:
+            data = self._get_db_cache('board_snapshot', 999999)
+            if data:
+                self._board_df = pd.DataFrame(data)
+        if self._board_df is None or time.time() - self._last_board_update > self.sector_expiry:
+            background_tasks.add_task(self.update_sector_data)
+        return self._board_df if self._board_df is not None else pd.DataFrame(columns=BOARD_COLUMNS)
 
     def get_sector_data_fast(self, background_tasks: BackgroundTasks):
         data = self._get_db_cache('sector_data', self.sector_expiry)
@@ -679,8 +1081,50 @@ class StockDataManager:
         return df
 
 
+    def get_spot_index(self, background_tasks: BackgroundTasks) -> pd.DataFrame:
+        """全市场行情的内存副本（以代码为索引）：过期时后台刷新并先返回旧数据"""
+        version = self._get_db_cache_version('spot_data', 999999)
+        if version is None:
+            background_tasks.add_task(self.update_spot_data)
+            return pd.DataFrame(columns=["名称", "最新价", "涨跌幅"])
+        if version != self._spot_index_version:
+            df = pd.DataFrame(self._get_db_cache('spot_data', 999999) or [])
+            if "代码" in df.columns:
+                df["代码"] = df["代码"].astype(str).str.zfill(6)
+                df = df.drop_duplicates("代码", keep="last").set_index("代码")
+            self._spot_index, self._spot_index_version = df, version
+        if time.time() - datetime.datetime.strptime(version.split("#")[0], "%Y-%m-%d %H:%M:%S").timestamp() > self.spot_expiry:
+            background_tasks.add_task(self.update_spot_data)
+        return self._spot_index
+
 data_manager = StockDataManager()
 
+STOCK_NAME_MISS_TTL = 600 # 上游也查不到的代码，10 分钟内不再重复请求
+_stock_name_misses: Dict[str, float] = {}
+
+async def resolve_stock_name(code: str, market: str = "") -> str:
+    """代码转名称：优先命中内存索引，未命中时异步查询东方财富并回填"""
+    name = data_manager.get_stock_name(code)
+    if name:
+        return name
+    if time.time() - _stock_name_misses.get(code, 0) < STOCK_NAME_MISS_TTL:
+        return ""
+    if not market:
+        market = "sh" if code.startswith('6') else "sz"
+    try:
+        url = f"https://push2.eastmoney.com/api/qt/stock/get?secid={'1' if market == 'sh' else '0'}.{code}&fields=f58"
+        async with httpx.AsyncClient(timeout=3.0, trust_env=False) as client:
+            resp = await client.get(url)
+            if resp.status_code == 200:
+                name = ((resp.json() or {}).get('data') or {}).get('f58', '')
+    except Exception as e:
+        logger.warning(f"Stock name lookup failed for {code}: {e}")
+    if name:
+        data_manager._name_index[code] = name
+    else:
+        _stock_name_misses[code] = time.time()
+    return name or ""
+
 async def get_tencent_kline(symbol: str):
     clean_symbol = "".join(filter(str.isdigit, symbol))
     if symbol.startswith('6'): prefix = "sh"
@@ -733,7 +1177,28 @@ async def get_tencent_kline(symbol: str):
         logger.error(f"Tencent K-line fallback error for {symbol}: {e}")
     return None
 
-async def get_cached_kline(symbol: str):
+KLINE_CACHE_TTL = 300 # 日 K 缓存有效期（秒）
+
+# 组合接口的请求级共享输入：同一次请求的各分区只获取一次行情与 K 线
+_request_shared: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_shared", default=None)
+
+async def _shared_fetch(key: tuple, factory):
+    shared = _request_shared.get()
+    if shared is None:
+        return await factory()
+    task = shared.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        shared[key] = task
+    return await asyncio.shield(task)
+
+async def get_cached_kline(symbol: str, refresh: bool = False):
+    """读取日 K（优先 SQLite 缓存）；refresh=True 时跳过缓存直接从上游重取"""
+    df = await _shared_fetch(("kline", symbol, refresh), lambda: _load_kline(symbol, refresh))
+    # 调用方会在 DataFrame 上追加指标列，共享时各自持有副本
+    return df.copy() if df is not None and _request_shared.get() is not None else df
+
+async def _load_kline(symbol: str, refresh: bool = False):
     now = time.time()
     cache_key = f"kline_{symbol}"
     
@@ -744,11 +1209,11 @@ async def get_cached_kline(symbol: str):
         cursor.execute("SELECT result_json, updated_at FROM app_cache WHERE cache_key = ?", (cache_key,))
         row = cursor.fetchone()
         
-        if row:
+        if row and not refresh:
             import json, datetime
             updated_at_str = row['updated_at']
             updated_at = datetime.datetime.strptime(updated_at_str, "%Y-%m-%d %H:%M:%S").timestamp()
-            if now - updated_at < 300: # 5 minutes cache
+            if now - updated_at < KLINE_CACHE_TTL:
                 conn.close()
                 data = pd.DataFrame(json.loads(row['result_json']))
                 # Ensure all columns present and datatypes
@@ -765,8 +1230,8 @@ async def get_cached_kline(symbol: str):
             conn = get_db_connection()
             cursor = conn.cursor()
             cursor.execute(
-                "INSERT OR REPLACE INTO app_cache (cache_key, result_json, updated_at) VALUES (?, ?, ?)",
-                (key, result_json, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                "INSERT OR REPLACE INTO app_cache (cache_key, result_json, updated_at, revision) VALUES (?, ?, ?, ?)",
+                (key, result_json, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), time.time_ns())
             )
             conn.commit()
             conn.close()
@@ -801,16 +1266,61 @@ async def get_cached_kline(symbol: str):
     
     return None
 
+async def run_daily_job(hour: int, minute: int, job, name: str, exclusive: bool = True):
+    """每日定时任务循环：在本地时间 hour:minute 执行一次 job；exclusive=False 时每个 worker 各自执行"""
+    while True:
+        now = datetime.datetime.now()
+        target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target <= now:
+            target += datetime.timedelta(days=1)
+        await asyncio.sleep((target - now).total_seconds())
+        # 多 worker 部署时同一天只由一个进程执行
+        if exclusive and not try_acquire_job_lock(f"daily_{name}_{target.date().isoformat()}", ttl=3600):
+            continue
+        try:
+            logger.info(f"Running scheduled job: {name}")
+            await job()
+        except Exception as e:
+            logger.error(f"Scheduled job {name} failed: {e}")
+
 @app.on_event("startup")
 async def startup_event():
     asyncio.create_task(data_manager.update_stock_list())
     asyncio.create_task(data_manager.update_spot_data())
     asyncio.create_task(data_manager.update_index_data())
+    # 行业映射与同业分位数（首次部署时立即构建）
+    asyncio.create_task(ensure_peer_percentiles())
+    # 凌晨批量预取热门标的机构评级（可选，默认关闭；开启后当日诊断直接命中缓存）
+    if INST_PREFETCH_ENABLED:
+        asyncio.create_task(run_daily_job(6, 0, prefetch_inst_consensus, "inst_consensus_prefetch"))
+    asyncio.create_task(analysis_warmup_loop())
+    asyncio.create_task(news_ingest_loop())
+    asyncio.create_task(sector_quote_loop())
+    asyncio.create_task(run_daily_job(8, 30, refresh_sector_members, "sector_members_refresh"))
+    asyncio.create_task(run_daily_job(2, 0, rebuild_industry_index, "industry_index_rebuild"))
+    asyncio.create_task(run_daily_job(2, 30, build_peer_percentiles, "peer_percentiles"))
+    asyncio.create_task(run_daily_job(3, 0, lambda: asyncio.to_thread(compact_analysis_cache), "analysis_cache_compaction"))
+    asyncio.create_task(run_daily_job(3, 10, lambda: asyncio.to_thread(cleanup_news_cache), "news_cache_cleanup"))
+    asyncio.create_task(minute_bar_loop())
+    asyncio.create_task(run_daily_job(15, 40, refresh_alert_indicators, "alert_indicators"))
+    asyncio.create_task(spot_refresh_loop())
+    asyncio.create_task(asyncio.to_thread(intraday_tape.load_latest))
+    asyncio.create_task(intraday_tape_loop())
+    asyncio.create_task(run_daily_job(15, 5, lambda: asyncio.to_thread(intraday_tape.persist), "intraday_tape_persist", exclusive=False))
+    asyncio.create_task(run_daily_job(3, 20, lambda: asyncio.to_thread(cleanup_minute_bars), "minute_bar_cleanup"))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_llm_client()
 
 @app.get("/api/market/indices")
-async def get_market_indices(background_tasks: BackgroundTasks):
+async def get_market_indices(request: Request, background_tasks: BackgroundTasks):
+    version = data_manager._get_db_cache_version('index_data', data_manager.index_expiry)
+    entry = get_encoded_response("indices", version)
+    if entry is not None:
+        return snapshot_response(request, entry)
     data = data_manager.get_index_data_fast(background_tasks)
-    if data: return data
+    if data: return snapshot_response(request, put_encoded_response("indices", version, data))
     
     # Fallback to Sina direct if cache empty
     try:
@@ -859,12 +1369,20 @@ async def get_market_indices(background_tasks: BackgroundTasks):
     }
 
 @app.get("/api/market/rankings")
-async def get_market_rankings(background_tasks: BackgroundTasks):
+async def get_market_rankings(request: Request, background_tasks: BackgroundTasks):
     """从 data_manager 的全量行情中提取排行榜，确保数据一致性且极其抗封锁"""
+    # 快照未变化时直接返回上次编码好的结果
+    version = data_manager._get_db_cache_version('spot_data', data_manager.spot_expiry)
+    entry = get_encoded_response("rankings", version)
+    if entry is not None:
+        return snapshot_response(request, entry)
+
     df = None
     try:
         # 1. 优先尝试快照数据 (只要>50条我们就能抽出前20)
         df = data_manager.get_spot_data_fast(background_tasks)
+        if df is None or len(df) < 50:
+            version = None # 直连兜底的结果不属于任何快照版本，不缓存
         
         # 2. 如果快照仍为空或深度有限，尝试直接抓取全市场涨幅榜
         if df is None or len(df) < 50:
@@ -944,7 +1462,7 @@ async def get_market_rankings(background_tasks: BackgroundTasks):
                     })
                 
                 if gainers or losers:
-                    return {"gainers": gainers, "losers": losers}
+                    return snapshot_response(request, put_encoded_response("rankings", version, {"gainers": gainers, "losers": losers}))
             except Exception as inner_e:
                 logger.error(f"DataFrame rankings parse error: {inner_e}")
     except Exception as e:
@@ -968,6 +1486,89 @@ async def get_market_rankings(background_tasks: BackgroundTasks):
     ]
     return {"gainers": mock_gainers, "losers": mock_losers}
 
+# ==================== 市场宽度 ====================
+# 每次全市场行情刷新时一次向量化计算涨跌家数、涨跌停与换手分布，客户端直接取结果
+TURNOVER_BUCKETS = [0, 1, 3, 5, 10, 20, float('inf')] # 换手率分档（%）
+TURNOVER_BUCKET_LABELS = ["<1%", "1-3%", "3-5%", "5-10%", "10-20%", ">=20%"]
+
+def _price_limit_ratio(codes: pd.Series) -> np.ndarray:
+    """按板块给出涨跌停幅度：主板 10%、创业板/科创板 20%、北交所 30%
+
+    自 2025-07-07 起沪深主板 ST、*ST 股票的涨跌幅限制由 5% 调整为 10%，与普通主板股票一致，不再单独区分。
+    """
+    ratio = np.full(len(codes), 0.10)
+    growth = codes.str.startswith(("300", "301", "688", "689")).to_numpy()
+    bj = codes.str.startswith(("4", "8", "92")).to_numpy()
+    ratio[growth] = 0.20
+    ratio[bj] = 0.30
+    return ratio
+
+def compute_market_breadth(df: pd.DataFrame) -> Optional[dict]:
+    """由全市场行情快照计算市场宽度；停牌（最新价为 0）的股票不计入"""
+    if df is None or df.empty or "代码" not in df.columns:
+        return None
+    price = pd.to_numeric(df["最新价"], errors='coerce').fillna(0.0).to_numpy()
+    change = pd.to_numeric(df["涨跌幅"], errors='coerce').fillna(0.0).to_numpy()
+    trading = price > 0
+    codes = df["代码"].astype(str).str.zfill(6)
+    names = df["名称"].astype(str) if "名称" in df.columns else pd.Series([""] * len(df))
+    ratio = _price_limit_ratio(codes)
+    # N（上市首日）/ C（注册制上市前 5 日）开头的新股不设涨跌幅限制，不计入涨跌停
+    no_limit = names.str.upper().str.match(r"^[NC]").to_numpy(dtype=bool)
+    board = np.where(ratio == 0.30, "bj", np.where(ratio == 0.20, "growth", "main"))
+
+    # 有昨收时按交易所规则（四舍五入到分）算出涨跌停价比较，否则按涨跌幅近似
+    if "昨收" in df.columns:
+        prev = pd.to_numeric(df["昨收"], errors='coerce').fillna(0.0).to_numpy()
+    else:
+        prev = np.zeros(len(df))
+    has_prev = prev > 0
+    up_price = np.round(prev * (1 + ratio) + 1e-9, 2)
+    down_price = np.round(prev * (1 - ratio) + 1e-9, 2)
+    limit_up = trading & ~no_limit & np.where(has_prev, price >= up_price - 1e-6, change >= ratio * 100 - 0.05)
+    limit_down = trading & ~no_limit & np.where(has_prev, price <= down_price + 1e-6, change <= -ratio * 100 + 0.05)
+
+    result = {
+        "total": int(trading.sum()),
+        "advancers": int((trading & (change > 0)).sum()),
+        "decliners": int((trading & (change < 0)).sum()),
+        "unchanged": int((trading & (change == 0)).sum()),
+        "suspended": int((~trading).sum()),
+        "limit_up": int(limit_up.sum()),
+        "limit_down": int(limit_down.sum()),
+        "no_limit": int((trading & no_limit).sum()),
+        "limit_by_board": {
+            b: {"limit_up": int((limit_up & (board == b)).sum()), "limit_down": int((limit_down & (board == b)).sum())}
+            for b in ("main", "growth", "bj")
+        },
+        "total_amount": float(pd.to_numeric(df["成交额"], errors='coerce').fillna(0.0).to_numpy()[trading].sum()) if "成交额" in df.columns else 0.0,
+        "turnover_buckets": [],
+        "updated_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    if "换手率" in df.columns:
+        turnover = pd.to_numeric(df["换手率"], errors='coerce').to_numpy()[trading]
+        counts, _ = np.histogram(turnover[np.isfinite(turnover)], bins=TURNOVER_BUCKETS)
+        result["turnover_buckets"] = [{"range": label, "count": int(c)} for label, c in zip(TURNOVER_BUCKET_LABELS, counts)]
+    return result
+
+@app.get("/api/market/breadth")
+async def get_market_breadth(request: Request, background_tasks: BackgroundTasks):
+    """市场宽度：涨跌家数、分板块涨跌停、换手率分布与总成交额（随全市场行情刷新）"""
+    if data_manager._get_db_cache_version('spot_data', data_manager.spot_expiry) is None:
+        background_tasks.add_task(data_manager.update_spot_data)
+    # 行情刷新期间先返回上一次的结果
+    version = data_manager._get_db_cache_version('market_breadth', 999999)
+    if version is None and not data_manager._is_updating_spot:
+        await data_manager.update_spot_data()
+        version = data_manager._get_db_cache_version('market_breadth', 999999)
+    entry = get_encoded_response("breadth", version)
+    if entry is None:
+        breadth = data_manager._get_db_cache('market_breadth', 999999)
+        if breadth is None:
+            raise HTTPException(status_code=503, detail="市场宽度数据暂不可用，请稍后再试")
+        entry = put_encoded_response("breadth", version, breadth)
+    return snapshot_response(request, entry)
+
 @app.get("/api/stock/search")
 async def search_stock(keyword: str, background_tasks: BackgroundTasks):
     # 统一处理关键字：去除空格，转大写
@@ -1062,22 +1663,103 @@ def get_real_fundamentals(code: str):
         
         if not industry:
             # 如果接口没获取到，检查全局缓存
-            industry = INDUSTRY_CACHE.get(clean_code)
+            industry = get_stock_industry(clean_code)
+        elif industry != get_stock_industry(clean_code):
+            # 反向同步到映射索引以备后用
+            apply_industry_updates(pd.Series({clean_code: industry}), "fundamentals")
             
         if industry:
             res["行业"] = industry
-            # 反向同步到缓存以备后用
-            INDUSTRY_CACHE[clean_code] = industry
         else:
             res["行业"] = "行业" # 最终兜底名词，避免出现 "未知" 这种负面词汇
             
         return res
     except Exception as e:
         logger.error(f"Error fetching fundamentals for {code}: {e}")
-        return {"行业": INDUSTRY_CACHE.get(clean_code, "行业")}
+        return {"行业": get_stock_industry(clean_code) or "行业"}
+
+# ==================== 机构评级一致性服务 ====================
+# 机构评级每天最多变化一次，按 (代码, 日期) 缓存统计结果，避免每次诊断都重新抓取
+INST_CONSENSUS_TIMEOUT = 4.0
+INST_CONSENSUS_LOOKBACK_DAYS = 60
+INST_PREFETCH_ENABLED = os.getenv("INST_PREFETCH_ENABLED", "0") == "1" # 可选：设为 1 开启每日盘前预取
+INST_PREFETCH_TOP_N = 50
+
+def _summarize_inst_ratings(inst_df: Optional[pd.DataFrame]) -> dict:
+    """向量化统计近 60 天机构评级（家数、买入/增持占比、平均目标价）"""
+    stats = {"total_count": 0, "buy_ratio": 0.0, "avg_target": 0.0}
+    if inst_df is None or inst_df.empty or '日期' not in inst_df.columns:
+        return stats
+
+    dates = pd.to_datetime(inst_df['日期'].astype(str), format="%Y-%m-%d", errors='coerce')
+    recent = inst_df[(pd.Timestamp.now() - dates).dt.days <= INST_CONSENSUS_LOOKBACK_DAYS]
+    total_count = len(recent)
+    if total_count == 0:
+        return stats
+
+    ratings = recent['评级'].astype(str) if '评级' in recent.columns else pd.Series("", index=recent.index)
+    buy_count = int(ratings.str.contains('买入|增持', regex=True).sum())
+    targets = pd.to_numeric(recent['目标价'], errors='coerce') if '目标价' in recent.columns else pd.Series(dtype=float)
+    targets = targets[targets > 0]
+
+    stats["total_count"] = total_count
+    stats["buy_ratio"] = round(buy_count / total_count * 100, 1)
+    stats["avg_target"] = round(float(targets.mean()), 2) if not targets.empty else 0.0
+    return stats
+
+async def get_inst_consensus(code: str) -> Optional[dict]:
+    """获取个股机构评级统计（按日缓存 + 严格超时），失败返回 None 且不写缓存"""
+    clean_code = "".join(filter(str.isdigit, code))
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    cache_key = f"inst_consensus_{clean_code}"
+
+    cached = data_manager._get_db_cache(cache_key, 86400)
+    if cached is not None and cached.get("date") == today:
+        return cached
+
+    try:
+        inst_df = await asyncio.wait_for(
+            asyncio.to_thread(ak.stock_institute_recommend_detail, symbol=clean_code),
+            timeout=INST_CONSENSUS_TIMEOUT
+        )
+    except Exception as e:
+        logger.warning(f"Inst consensus fetch failed or timed out for {clean_code}: {e}")
+        return None
+
+    stats = _summarize_inst_ratings(inst_df)
+    stats["date"] = today
+    data_manager._set_db_cache(cache_key, stats)
+    return stats
+
+def format_inst_consensus(stats: Optional[dict], price: float) -> str:
+    """将机构评级统计转换为 AI 提示词中的一致性描述"""
+    if not stats or not stats.get("total_count"):
+        return "暂无近期机构评级数据"
+    total_count = stats["total_count"]
+    buy_ratio = stats["buy_ratio"]
+    avg_target = stats["avg_target"]
+    if avg_target > 0:
+        space_pct = round((avg_target - price) / price * 100, 1) if price > 0 else 0
+        return f"近60天共有 {total_count} 家机构给出评级（买入/增持占比 {buy_ratio}%），机构平均目标价为 {avg_target} 元，距离现价空间约为 {space_pct}%。"
+    return f"近60天共有 {total_count} 家机构给出评级（买入/增持占比 {buy_ratio}%），暂无明确目标价共识。"
+
+async def prefetch_inst_consensus(limit: int = INST_PREFETCH_TOP_N):
+    """盘前批量预取热门标的的机构评级，使白天的诊断请求直接命中缓存"""
+    symbols = get_hot_symbols(limit)
+    logger.info(f"Prefetching inst consensus for {len(symbols)} hot symbols...")
+    fetched = 0
+    for code in symbols:
+        if await get_inst_consensus(code) is not None:
+            fetched += 1
+        await asyncio.sleep(0.5) # 控制对上游的请求节奏
+    logger.info(f"Inst consensus prefetch finished: {fetched}/{len(symbols)}.")
 
 async def _get_stock_quote_core(symbol: str, background_tasks: BackgroundTasks):
     """获取股票实时行情的核心逻辑（不含限流）"""
+    quote = await _shared_fetch(("quote", symbol), lambda: _fetch_stock_quote(symbol, background_tasks))
+    return dict(quote) if _request_shared.get() is not None else quote
+
+async def _fetch_stock_quote(symbol: str, background_tasks: BackgroundTasks):
     quote = data_manager.get_spot_data_fast(background_tasks)
     clean_symbol = "".join(filter(str.isdigit, symbol))
     # Basic market prefix logic for A-shares
@@ -1151,55 +1833,575 @@ async def get_stock_quote(symbol: str, request: Request, background_tasks: Backg
     identifier = str(user_id) if user_id else (request.client.host if request.client else "unknown")
     if not is_view_allowed(identifier, symbol):
         raise HTTPException(status_code=429, detail=f"您查询股票详情页太频繁了(识别码:{identifier})，请一小时后再试。")
+    if user_id:
+        background_tasks.add_task(log_symbol_view, user_id, symbol)
     return await _get_stock_quote_core(symbol, background_tasks)
 
+KLINE_FIELDS = {"开盘": "open", "最高": "high", "最低": "low", "收盘": "close", "成交量": "volume"}
+KLINE_FORMATS = ("records", "columnar")
+KLINE_DAILY_PERIODS = ("daily", "weekly", "monthly") # 周/月线由日线聚合
+KLINE_MINUTE_PERIODS = ("5", "30", "60") # 分钟线由 5 分钟线聚合
+KLINE_EPOCH = pd.Timestamp("1970-01-01")
+
+def _kline_columns(df: pd.DataFrame, unit: str = "day") -> dict:
+    """K 线 DataFrame 转为按字段的并行数组，时间另存纪元序号（日线按天、分钟线按分钟）便于增量切片"""
+    stamps = pd.to_datetime(df["日期"].astype(str))
+    labels = stamps.dt.strftime("%Y-%m-%d" if unit == "day" else "%Y-%m-%d %H:%M")
+    step = pd.Timedelta(days=1) if unit == "day" else pd.Timedelta(minutes=1)
+    columns = {"date": labels.tolist(), "t": ((stamps - KLINE_EPOCH) // step).tolist()}
+    for cn, en in KLINE_FIELDS.items():
+        columns[en] = pd.to_numeric(df[cn], errors='coerce').tolist() if cn in df.columns else [0.0] * len(df)
+    return {"unit": unit, "columns": columns}
+
+def _slice_kline(series: dict, since: Optional[str], limit: Optional[int]) -> dict:
+    """取 since 之后（不含）的 K 线，再保留最后 limit 根"""
+    t = series["columns"]["t"]
+    lo = 0
+    if since:
+        step = pd.Timedelta(days=1) if series["unit"] == "day" else pd.Timedelta(minutes=1)
+        lo = bisect.bisect_right(t, (pd.Timestamp(since) - KLINE_EPOCH) // step)
+    if limit is not None:
+        lo = max(lo, len(t) - max(limit, 0))
+    return {"unit": series["unit"], "columns": {k: v[lo:] for k, v in series["columns"].items()}}
+
+def _kline_payload(symbol: str, series: dict, fmt: str):
+    columns = series["columns"]
+    if fmt == "records":
+        keys = ["日期"] + list(KLINE_FIELDS)
+        return [dict(zip(keys, row)) for row in zip(columns["date"], *(columns[en] for en in KLINE_FIELDS.values()))]
+    t = columns["t"]
+    return {
+        "symbol": symbol,
+        "format": "columnar",
+        "unit": series["unit"],
+        "start": columns["date"][0] if t else None,
+        # 相邻 K 线相隔的天数（分钟线为分钟数），首项为 0；时间 = start + 累加和
+        "dt": [0] + [b - a for a, b in zip(t, t[1:])] if t else [],
+        **{en: columns[en] for en in KLINE_FIELDS.values()}
+    }
+
+def _aggregate_bars(df: pd.DataFrame, keys) -> pd.DataFrame:
+    """按分组键向量化聚合 OHLCV，时间取组内最后一根"""
+    frame = df.copy()
+    for cn in KLINE_FIELDS:
+        frame[cn] = pd.to_numeric(frame[cn], errors='coerce')
+    agg = frame.groupby(keys, sort=True).agg(
+        日期=("日期", "last"), 开盘=("开盘", "first"), 最高=("最高", "max"),
+        最低=("最低", "min"), 收盘=("收盘", "last"), 成交量=("成交量", "sum")
+    )
+    return agg.reset_index(drop=True)
+
+def _resample_daily(df: pd.DataFrame, period: str) -> pd.DataFrame:
+    """日线聚合为周线（周五结束）或月线"""
+    stamps = pd.to_datetime(df["日期"].astype(str).str[:10])
+    return _aggregate_bars(df, stamps.dt.to_period("W-FRI" if period == "weekly" else "M").values)
+
+def _resample_minutes(df: pd.DataFrame, period: str) -> pd.DataFrame:
+    """5 分钟线按结束时刻归入上午 9:30-11:30、下午 13:00-15:00 的 30/60 分钟时段后合并，时间取时段结束时刻
+
+    按时钟而非日内序号分桶，个别 5 分钟线缺失（停牌、采集中断）时后续时段不会错位。
+    """
+    step = int(period)
+    if step <= 5 or df.empty:
+        return df
+    stamps = df["日期"].astype(str)
+    clock = (stamps.str[11:13].astype(int) * 60 + stamps.str[14:16].astype(int)).to_numpy()
+    # 交易分钟序号 (0, 240]，9:30 的集合竞价归入首个时段
+    minute = np.where(clock <= 11 * 60 + 30, clock - (9 * 60 + 30), clock - 13 * 60 + 120)
+    end = ((np.clip(minute, 1, 240) - 1) // step + 1) * step
+    end_clock = np.where(end <= 120, 9 * 60 + 30 + end, 13 * 60 + end - 120)
+    frame = df.copy()
+    frame["日期"] = (stamps.str[:11].to_numpy() + pd.Series(end_clock // 60).astype(str).str.zfill(2).to_numpy()
+                   + ":" + pd.Series(end_clock % 60).astype(str).str.zfill(2).to_numpy())
+    return _aggregate_bars(frame, frame["日期"].to_numpy())
+
 @app.get("/api/stock/kline/{symbol}")
-async def get_stock_kline(symbol: str):
-    df = await get_cached_kline(symbol)
-    if df is not None:
-        # 关键修复：处理 NaN 值，否则 JSON 序列化会崩溃
-        clean_df = df.fillna(0).replace([float('inf'), float('-inf')], 0)
-        return clean_df.to_dict(orient="records")
-    
-    # Mock data fallback
-    base = datetime.date.today()
-    return [{"日期": (base - datetime.timedelta(days=(100-i))).strftime("%Y-%m-%d"), "开盘": 10.0 + i/20, "收盘": 10.3 + i/20, "最高": 10.6 + i/20, "最低": 9.8 + i/20, "成交量": 100000} for i in range(100)]
+async def get_stock_kline(symbol: str, request: Request, format: str = "records", since: Optional[str] = None, limit: Optional[int] = None, period: str = "daily"):
+    """K 线。period 支持 daily/weekly/monthly/5/30/60；format=columnar 返回按字段的并行数组与差分时间；since/limit 只取增量或最近 N 根
+
+    周/月线由缓存的日线聚合、30/60 分钟线由采集的 5 分钟线聚合，均按数据版本缓存，不额外请求上游。
+    """
+    if format not in KLINE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    if period not in KLINE_DAILY_PERIODS and period not in KLINE_MINUTE_PERIODS:
+        raise HTTPException(status_code=400, detail=f"不支持的周期: {period}")
+    if since:
+        try:
+            datetime.datetime.fromisoformat(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since 需为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM 格式")
+
+    name = f"kline_{symbol}"
+    entry_name = name if (period, format) == ("daily", "records") else f"{name}:{period}:{format}"
+    if period in KLINE_MINUTE_PERIODS:
+        version = await ensure_minute_bars(symbol)
+    else:
+        version = data_manager._get_db_cache_version(name, KLINE_CACHE_TTL)
+    entry = get_encoded_response(entry_name, version)
+    if entry is None:
+        if period in KLINE_MINUTE_PERIODS:
+            df = await asyncio.to_thread(load_minute_bars, _split_symbol(symbol)[1])
+            series = _kline_columns(_resample_minutes(df, period), unit="minute")
+        else:
+            df = await get_cached_kline(symbol)
+            if df is not None:
+                # 版本在加载之后读取，确保与刚写入的缓存一致；NaN/Inf 由编码器置 0
+                version = data_manager._get_db_cache_version(name, KLINE_CACHE_TTL)
+            else:
+                # Mock data fallback
+                base = datetime.date.today()
+                df = pd.DataFrame([{"日期": (base - datetime.timedelta(days=(100-i))).strftime("%Y-%m-%d"), "开盘": 10.0 + i/20, "收盘": 10.3 + i/20, "最高": 10.6 + i/20, "最低": 9.8 + i/20, "成交量": 100000} for i in range(100)])
+                version = None
+            series = _kline_columns(df if period == "daily" else _resample_daily(df, period))
+        entry = put_encoded_response(entry_name, version, _kline_payload(symbol, series, format))
+        entry["series"] = series
+
+    if since is None and limit is None:
+        return snapshot_response(request, entry)
+    # 增量请求体量小，按需切片编码，不进缓存
+    return PreEncodedJSONResponse(encode_json(_kline_payload(symbol, _slice_kline(entry["series"], since, limit), format)))
+
+# ==================== 分钟线采集 ====================
+# 只采集不复权的 5 分钟线并增量入库（复权会改写历史，不适合增量），30/60 分钟线由其聚合
+MINUTE_BAR_TTL = 60 # 盘中刷新间隔（秒）
+MINUTE_BAR_TIMEOUT = 8.0
+MINUTE_BAR_RETENTION_DAYS = 30
+MINUTE_COLLECT_INTERVAL = 300 # 后台采集热门标的的间隔（秒）
+MINUTE_COLLECT_TOP_N = 30
+MINUTE_BAR_COLUMNS = {"时间": "ts", "开盘": "open", "最高": "high", "最低": "low", "收盘": "close", "成交量": "volume"}
+_minute_bar_tasks: Dict[str, asyncio.Task] = {}
+
+def load_minute_bars(code: str) -> pd.DataFrame:
+    """读取某只股票的全部 5 分钟线（按时间升序），列名与日线一致"""
+    conn = get_db_connection()
+    df = pd.read_sql_query(
+        "SELECT ts AS 日期, open AS 开盘, high AS 最高, low AS 最低, close AS 收盘, volume AS 成交量 FROM minute_bars WHERE code = ? ORDER BY ts",
+        conn, params=(code,)
+    )
+    conn.close()
+    return df
+
+def _minute_bars_updated_at(code: str) -> float:
+    conn = get_db_connection()
+    row = conn.execute("SELECT MAX(updated_at) FROM minute_bars WHERE code = ?", (code,)).fetchone()
+    conn.close()
+    return row[0] or 0.0
+
+def _store_minute_bars(code: str, df: pd.DataFrame):
+    """只写入不早于已存最新时间的记录（最后一根盘中会变化，需覆盖）"""
+    frame = df.rename(columns=MINUTE_BAR_COLUMNS).reindex(columns=list(MINUTE_BAR_COLUMNS.values()))
+    frame["ts"] = frame["ts"].astype(str).str[:16]
+    values = frame[["open", "high", "low", "close", "volume"]].apply(pd.to_numeric, errors='coerce')
+    frame[values.columns] = values.replace([float('inf'), float('-inf')], float('nan')).fillna(0.0)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    last_ts = cursor.execute("SELECT MAX(ts) FROM minute_bars WHERE code = ?", (code,)).fetchone()[0]
+    if last_ts:
+        frame = frame[frame["ts"] >= last_ts]
+    now = time.time()
+    cursor.executemany(
+        "INSERT OR REPLACE INTO minute_bars (code, ts, open, high, low, close, volume, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(code, *row, now) for row in frame.itertuples(index=False, name=None)]
+    )
+    # 没有新记录时也刷新时间戳，表示本轮已拉取
+    cursor.execute("UPDATE minute_bars SET updated_at = ? WHERE code = ? AND ts = (SELECT MAX(ts) FROM minute_bars WHERE code = ?)", (now, code, code))
+    conn.commit()
+    conn.close()
+
+async def _collect_minute_bars(code: str):
+    logger.info(f"Fetching 5-minute bars for {code}")
+    df = await asyncio.wait_for(
+        asyncio.to_thread(ak.stock_zh_a_hist_min_em, symbol=code, period="5", adjust=""),
+        timeout=MINUTE_BAR_TIMEOUT
+    )
+    if df is not None and not df.empty:
+        await asyncio.to_thread(_store_minute_bars, code, df)
+
+async def ensure_minute_bars(symbol: str) -> Optional[str]:
+    """保证分钟线足够新（同一股票的并发请求共享一次采集），返回数据版本；表中无数据时返回 None"""
+    _, code = _split_symbol(symbol)
+    updated_at = await asyncio.to_thread(_minute_bars_updated_at, code)
+    if not _is_session_fresh(updated_at, MINUTE_BAR_TTL):
+        task = _minute_bar_tasks.get(code)
+        if task is None or task.done():
+            task = asyncio.create_task(_collect_minute_bars(code))
+            _minute_bar_tasks[code] = task
+            task.add_done_callback(lambda t: _minute_bar_tasks.pop(code, None) if _minute_bar_tasks.get(code) is t else None)
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            # 上游失败时退回表中已有数据
+            logger.error(f"Minute bar collection failed for {symbol}: {e}")
+        updated_at = await asyncio.to_thread(_minute_bars_updated_at, code)
+    return f"{updated_at:.3f}" if updated_at else None
+
+async def minute_bar_loop():
+    """交易时段内定时为热门标的采集 5 分钟线"""
+    while True:
+        await asyncio.sleep(MINUTE_COLLECT_INTERVAL)
+        try:
+            now_ts = datetime.datetime.now()
+            if now_ts.weekday() >= 5 or not (datetime.time(9, 30) <= now_ts.time() <= datetime.time(15, 5)):
+                continue
+            # 多 worker 部署时同一时间窗只由一个进程执行
+            window = int(time.time() // MINUTE_COLLECT_INTERVAL)
+            if not try_acquire_job_lock(f"minute_bars_{window}", ttl=MINUTE_COLLECT_INTERVAL):
+                continue
+            symbols = await asyncio.to_thread(get_hot_symbols, MINUTE_COLLECT_TOP_N)
+            semaphore = asyncio.Semaphore(3)
+            async def collect_one(code: str):
+                async with semaphore:
+                    await ensure_minute_bars(code)
+            await asyncio.gather(*(collect_one(c) for c in symbols), return_exceptions=True)
+        except Exception as e:
+            logger.error(f"Minute bar loop error: {e}")
+
+def cleanup_minute_bars():
+    """定时清理超出保留期的分钟线"""
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=MINUTE_BAR_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM minute_bars WHERE ts < ?", (cutoff,))
+    removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    logger.info(f"Minute bar cleanup: {removed} bars removed.")
+
+# ==================== 全市场分时磁带 ====================
+# 盘中由 spot_refresh_loop 定时刷新共享的全市场行情快照，各 worker 从 app_cache 同步后按"代码 × 交易分钟"写入定长数组，
+# 盘中分时、均价与涨速排行都从内存计算，不额外请求上游
+INTRADAY_SLOTS = 240 # 9:30-11:30 与 13:00-15:00 各 120 分钟
+INTRADAY_INITIAL_ROWS = 6000
+INTRADAY_DIR = os.path.join(os.path.dirname(__file__), "intraday")
+INTRADAY_SYNC_INTERVAL = 10 # 各 worker 检查共享行情快照版本的间隔（秒）
+INTRADAY_RETENTION_DAYS = 30
+
+def _intraday_slot(now: datetime.datetime) -> Optional[int]:
+    """当前时刻对应的交易分钟序号；集合竞价归入首分钟，收盘集合竞价归入末分钟，午休与盘外返回 None"""
+    if now.weekday() >= 5:
+        return None
+    t = now.hour * 60 + now.minute
+    if 9 * 60 + 25 <= t <= 11 * 60 + 30:
+        return min(max(t - (9 * 60 + 30), 0), 119)
+    if 13 * 60 <= t <= 15 * 60 + 5:
+        return min(120 + t - 13 * 60, INTRADAY_SLOTS - 1)
+    return None
+
+def _intraday_label(slot: int) -> str:
+    minutes = 9 * 60 + 30 + slot if slot < 120 else 13 * 60 + slot - 120
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def _ffill_rows(a: np.ndarray) -> np.ndarray:
+    """按行向前填充 NaN（向量化）"""
+    idx = np.where(np.isnan(a), 0, np.arange(a.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return a[np.arange(a.shape[0])[:, None], idx]
+
+class IntradayTape:
+    """全市场分时环形存储：每只股票一行、每个交易分钟一列，记录最新价、累计成交量与成交额
+
+    同一分钟内多次采样以最后一次为准；新交易日的首次采样清空全部数据。
+    容量按行成倍扩展，约 5000 只 × 240 分钟，内存占用约 25MB。
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.date: Optional[str] = None
+        self.codes: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self.last_slot = -1
+        self._alloc(INTRADAY_INITIAL_ROWS)
+
+    def _alloc(self, rows: int):
+        self.price = np.full((rows, INTRADAY_SLOTS), np.nan, dtype=np.float32)
+        self.volume = np.full((rows, INTRADAY_SLOTS), np.nan, dtype=np.float64)
+        self.amount = np.full((rows, INTRADAY_SLOTS), np.nan, dtype=np.float64)
+
+    def _grow(self, needed: int):
+        rows = self.price.shape[0]
+        if needed <= rows:
+            return
+        while rows < needed:
+            rows *= 2
+        old = (self.price, self.volume, self.amount)
+        self._alloc(rows)
+        for new, prev in zip((self.price, self.volume, self.amount), old):
+            new[:prev.shape[0]] = prev
+
+    def _reset(self, date: str):
+        self.date = date
+        self.codes = []
+        self._rows = {}
+        self.last_slot = -1
+        self._alloc(INTRADAY_INITIAL_ROWS)
+
+    def _row_indices(self, codes: List[str]) -> np.ndarray:
+        for code in codes:
+            if code not in self._rows:
+                self._rows[code] = len(self.codes)
+                self.codes.append(code)
+        self._grow(len(self.codes))
+        return np.fromiter((self._rows[c] for c in codes), dtype=np.int64, count=len(codes))
+
+    def record(self, df: pd.DataFrame, now: Optional[datetime.datetime] = None):
+        """写入一次全市场行情快照（需含 代码/最新价，成交量/成交额可缺省）"""
+        now = now or datetime.datetime.now()
+        slot = _intraday_slot(now)
+        if slot is None or df is None or df.empty or "代码" not in df.columns or "最新价" not in df.columns:
+            return
+        price = pd.to_numeric(df["最新价"], errors='coerce').to_numpy(dtype=np.float64)
+        valid = price > 0 # 停牌或未开盘的 0 价不记录
+        if not valid.any():
+            return
+        codes = df["代码"].astype(str).str.zfill(6).to_numpy()[valid]
+        columns = {}
+        for cn in ("成交量", "成交额"):
+            columns[cn] = pd.to_numeric(df[cn], errors='coerce').to_numpy(dtype=np.float64)[valid] if cn in df.columns else np.nan
+        with self._lock:
+            date = now.strftime("%Y%m%d")
+            if self.date != date:
+                self._reset(date)
+            rows = self._row_indices(codes.tolist())
+            self.price[rows, slot] = price[valid]
+            self.volume[rows, slot] = columns["成交量"]
+            self.amount[rows, slot] = columns["成交额"]
+            self.last_slot = max(self.last_slot, slot)
+
+    def series(self, code: str) -> Optional[dict]:
+        """单只股票的分时：每分钟价格、分钟成交量与累计均价（VWAP）"""
+        with self._lock:
+            row = self._rows.get(code)
+            if row is None or self.last_slot < 0:
+                return None
+            n = self.last_slot + 1
+            block = _ffill_rows(np.vstack([self.price[row, :n], self.volume[row, :n], self.amount[row, :n]]).astype(np.float64))
+            date = self.date
+        price, volume, amount = block
+        first = int(np.argmax(~np.isnan(price))) if not np.isnan(price).all() else n
+        price, volume, amount = price[first:], volume[first:], amount[first:]
+        minute_volume = np.diff(volume, prepend=0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vwap = np.where(volume > 0, amount / volume, price)
+        return {
+            "date": date,
+            "times": [_intraday_label(i) for i in range(first, n)],
+            "price": price.tolist(),
+            "volume": minute_volume.tolist(),
+            "vwap": vwap.tolist()
+        }
+
+    def movers(self, window: int, limit: int) -> dict:
+        """最近 window 分钟涨幅（涨速）排行，全市场向量化计算"""
+        with self._lock:
+            if self.last_slot < 0:
+                return {"date": self.date, "time": None, "gainers": [], "losers": []}
+            n = len(self.codes)
+            end = self.last_slot
+            start = max(end - window, 0)
+            filled = _ffill_rows(self.price[:n, :end + 1].astype(np.float64))
+            codes = list(self.codes)
+            date = self.date
+        now_price, then_price = filled[:, end], filled[:, start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = (now_price - then_price) / then_price * 100
+        ok = np.flatnonzero(np.isfinite(speed))
+        order = ok[np.argsort(speed[ok], kind="stable")]
+
+        def pack(idx):
+            return [{
+                "代码": codes[i], "名称": data_manager.get_stock_name(codes[i]) or codes[i],
+                "最新价": round(float(now_price[i]), 2), "涨速": round(float(speed[i]), 2)
+            } for i in idx]
+        return {"date": date, "time": _intraday_label(end), "window": end - start,
+                "gainers": pack(order[::-1][:limit]), "losers": pack(order[:limit])}
+
+    def persist(self):
+        """收盘后落盘。多 worker 各自写一份，加载时合并"""
+        with self._lock:
+            if self.date is None or not self.codes:
+                return
+            n = len(self.codes)
+            payload = {"codes": np.array(self.codes), "price": self.price[:n].copy(),
+                       "volume": self.volume[:n].copy(), "amount": self.amount[:n].copy()}
+            date = self.date
+        os.makedirs(INTRADAY_DIR, exist_ok=True)
+        np.savez_compressed(os.path.join(INTRADAY_DIR, f"{date}-{_JOB_LOCK_OWNER}.npz"), **payload)
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=INTRADAY_RETENTION_DAYS)).strftime("%Y%m%d")
+        for fname in os.listdir(INTRADAY_DIR):
+            if fname.endswith(".npz") and fname[:8] < cutoff:
+                os.remove(os.path.join(INTRADAY_DIR, fname))
+        logger.info(f"Intraday tape persisted for {date}: {n} symbols.")
+
+    def load_latest(self):
+        """启动时载入最近一个交易日的落盘数据（合并各 worker 的文件，同格取有值者）"""
+        if not os.path.isdir(INTRADAY_DIR):
+            return
+        files = sorted(f for f in os.listdir(INTRADAY_DIR) if f.endswith(".npz"))
+        if not files:
+            return
+        date = files[-1][:8]
+        with self._lock:
+            if self.date is not None:
+                return # 已有当日实时数据
+            self._reset(date)
+            for fname in (f for f in files if f.startswith(date)):
+                with np.load(os.path.join(INTRADAY_DIR, fname)) as data:
+                    rows = self._row_indices(data["codes"].tolist())
+                    for name in ("price", "volume", "amount"):
+                        target = getattr(self, name)
+                        target[rows] = np.where(np.isnan(data[name]), target[rows], data[name])
+            filled = np.flatnonzero(~np.isnan(self.price[:len(self.codes)]).all(axis=0))
+            self.last_slot = int(filled[-1]) if len(filled) else -1
+        logger.info(f"Intraday tape loaded for {date}: {len(self.codes)} symbols.")
+
+intraday_tape = IntradayTape()
+
+async def intraday_tape_loop():
+    """交易时段内同步共享的全市场行情快照：版本变化时按快照的写入时间记入分时，各 worker 的磁带因此一致且不依赖访问流量"""
+    last_version = None
+    while True:
+        await asyncio.sleep(INTRADAY_SYNC_INTERVAL)
+        try:
+            if _intraday_slot(datetime.datetime.now()) is None:
+                continue
+            version = data_manager._get_db_cache_version('spot_data', 999999)
+            if version is None or version == last_version:
+                continue
+            data = await asyncio.to_thread(data_manager._get_db_cache, 'spot_data', 999999)
+            # 读取期间快照又被改写时留到下一轮，保证数据与写入时间对应
+            if data is None or data_manager._get_db_cache_version('spot_data', 999999) != version:
+                continue
+            stamp = datetime.datetime.strptime(version.split("#")[0], "%Y-%m-%d %H:%M:%S")
+            await asyncio.to_thread(intraday_tape.record, pd.DataFrame(data), stamp)
+            last_version = version
+        except Exception as e:
+            logger.error(f"Intraday tape loop error: {e}")
+
+@app.get("/api/stock/intraday/{symbol}")
+async def get_stock_intraday(symbol: str):
+    """个股分时（来自全市场行情轮询）：每分钟价格、成交量与均价线"""
+    series = intraday_tape.series(_split_symbol(symbol)[1])
+    if series is None:
+        raise HTTPException(status_code=404, detail="暂无该股票的分时数据")
+    return PreEncodedJSONResponse(encode_json(series))
+
+@app.get("/api/market/intraday_movers")
+async def get_intraday_movers(window: int = 5, limit: int = 20):
+    """全市场涨速排行：最近 window 分钟的涨跌幅"""
+    window = min(max(window, 1), 60)
+    limit = min(max(limit, 1), 100)
+    return PreEncodedJSONResponse(encode_json(intraday_tape.movers(window, limit)))
+
+# ==================== 个股资金流向 ====================
+# fund_flow 与 capital_flow 共用一份按 (代码, 日期) 存储的资金流向序列，每只股票只拉取一次上游
+MONEY_FLOW_TTL = 300 # 盘中数据的刷新间隔（秒）
+MONEY_FLOW_TIMEOUT = 8.0
+MONEY_FLOW_COLUMNS = {
+    "主力净流入-净额": "main_net", "主力净流入-净占比": "main_pct",
+    "超大单净流入-净额": "super_net", "超大单净流入-净占比": "super_pct",
+    "大单净流入-净额": "large_net", "大单净流入-净占比": "large_pct",
+    "中单净流入-净额": "medium_net", "中单净流入-净占比": "medium_pct",
+    "小单净流入-净额": "small_net", "小单净流入-净占比": "small_pct"
+}
+_money_flow_tasks: Dict[str, asyncio.Task] = {}
+
+def _last_session_close(now: datetime.datetime) -> datetime.datetime:
+    """最近一个已收盘交易日的 15:30（不考虑节假日）"""
+    close = now.replace(hour=15, minute=30, second=0, microsecond=0)
+    if now < close:
+        close -= datetime.timedelta(days=1)
+    while close.weekday() >= 5:
+        close -= datetime.timedelta(days=1)
+    return close
+
+def _is_session_fresh(updated_at: float, ttl: float) -> bool:
+    """盘中按 TTL 刷新；收盘后拿到的数据即为终值，下个交易日前不再请求"""
+    if time.time() - updated_at < ttl:
+        return True
+    now = datetime.datetime.now()
+    in_session = now.weekday() < 5 and datetime.time(9, 15) <= now.time() < datetime.time(15, 30)
+    return not in_session and updated_at >= _last_session_close(now).timestamp()
+
+def load_money_flow(code: str, limit: int = 10) -> List[dict]:
+    """从资金流向表读取最近 limit 个交易日，按日期升序"""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT * FROM money_flow WHERE code = ? ORDER BY date DESC LIMIT ?", (code, limit)).fetchall()
+    conn.close()
+    return [dict(row) for row in reversed(rows)]
+
+def _money_flow_updated_at(code: str) -> float:
+    conn = get_db_connection()
+    row = conn.execute("SELECT MAX(updated_at) FROM money_flow WHERE code = ?", (code,)).fetchone()
+    conn.close()
+    return row[0] or 0.0
+
+def _store_money_flow(code: str, df: pd.DataFrame):
+    """只写入不早于已存最新日期的记录（最新一日盘中会变化，需覆盖）"""
+    frame = df.rename(columns=MONEY_FLOW_COLUMNS).reindex(columns=["日期"] + list(MONEY_FLOW_COLUMNS.values()))
+    frame["日期"] = frame["日期"].astype(str).str[:10]
+    values = frame[list(MONEY_FLOW_COLUMNS.values())].apply(pd.to_numeric, errors='coerce')
+    frame[values.columns] = values.replace([float('inf'), float('-inf')], float('nan')).fillna(0.0)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    last_date = cursor.execute("SELECT MAX(date) FROM money_flow WHERE code = ?", (code,)).fetchone()[0]
+    if last_date:
+        frame = frame[frame["日期"] >= last_date]
+    now = time.time()
+    cols = list(MONEY_FLOW_COLUMNS.values())
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO money_flow (code, date, {', '.join(cols)}, updated_at) VALUES ({', '.join('?' * (len(cols) + 3))})",
+        [(code, *row, now) for row in frame[["日期"] + cols].itertuples(index=False, name=None)]
+    )
+    # 没有新记录时也刷新时间戳，表示本轮已拉取
+    cursor.execute("UPDATE money_flow SET updated_at = ? WHERE code = ? AND date = (SELECT MAX(date) FROM money_flow WHERE code = ?)", (now, code, code))
+    conn.commit()
+    conn.close()
+
+async def _refresh_money_flow(market: str, code: str):
+    logger.info(f"Fetching money flow for {market}{code}")
+    df = await asyncio.wait_for(
+        asyncio.to_thread(ak.stock_individual_fund_flow, stock=code, market=market),
+        timeout=MONEY_FLOW_TIMEOUT
+    )
+    if df is not None and not df.empty:
+        await asyncio.to_thread(_store_money_flow, code, df)
+
+async def get_money_flow(symbol: str, limit: int = 10) -> List[dict]:
+    """个股资金流向序列：表中数据足够新时直接返回，否则刷新一次（同一股票的并发请求共享）"""
+    market, code = _split_symbol(symbol)
+    if not _is_session_fresh(await asyncio.to_thread(_money_flow_updated_at, code), MONEY_FLOW_TTL):
+        task = _money_flow_tasks.get(code)
+        if task is None or task.done():
+            task = asyncio.create_task(_refresh_money_flow(market, code))
+            _money_flow_tasks[code] = task
+            task.add_done_callback(lambda t: _money_flow_tasks.pop(code, None) if _money_flow_tasks.get(code) is t else None)
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            # 上游失败时退回表中已有数据
+            logger.error(f"Money flow refresh failed for {symbol}: {e}")
+    return await asyncio.to_thread(load_money_flow, code, limit)
 
 @app.get("/api/stock/fund_flow/{symbol}")
 async def get_stock_fund_flow(symbol: str):
     """获取个股资金流向数据（超大/大/中/小单）"""
-    clean_symbol = "".join(filter(str.isdigit, symbol))
-    market = "sh"
-    if clean_symbol.startswith('6'): market = "sh"
-    elif clean_symbol.startswith(('0', '3')): market = "sz"
-    elif clean_symbol.startswith(('4', '8', '9')): market = "bj"
-    
     try:
-        # 获取近几日资金流向，取最新的一条（设置4秒超时防止网络波动造成挂起）
-        df = await asyncio.wait_for(
-            asyncio.to_thread(ak.stock_individual_fund_flow, stock=clean_symbol, market=market),
-            timeout=4.0
-        )
-        if df is not None and not df.empty:
-            latest = df.tail(1).to_dict('records')[0]
-            
-            def clean_val(v, default=0.0):
-                try:
-                    f = float(v)
-                    return f if not pd.isna(f) and f != float('inf') and f != float('-inf') else default
-                except: return default
-
+        rows = await get_money_flow(symbol, limit=1)
+        if rows:
+            latest = rows[-1]
             return {
-                "date": str(latest.get('日期', '')),
+                "date": latest["date"],
                 "items": [
-                    {"type": "超大单", "net_amount": clean_val(latest.get('超大单净流入-净额')), "net_pct": clean_val(latest.get('超大单净流入-净占比'))},
-                    {"type": "大单", "net_amount": clean_val(latest.get('大单净流入-净额')), "net_pct": clean_val(latest.get('大单净流入-净占比'))},
-                    {"type": "中单", "net_amount": clean_val(latest.get('中单净流入-净额')), "net_pct": clean_val(latest.get('中单净流入-净占比'))},
-                    {"type": "小单", "net_amount": clean_val(latest.get('小单净流入-净额')), "net_pct": clean_val(latest.get('小单净流入-净占比'))},
+                    {"type": "超大单", "net_amount": latest["super_net"], "net_pct": latest["super_pct"]},
+                    {"type": "大单", "net_amount": latest["large_net"], "net_pct": latest["large_pct"]},
+                    {"type": "中单", "net_amount": latest["medium_net"], "net_pct": latest["medium_pct"]},
+                    {"type": "小单", "net_amount": latest["small_net"], "net_pct": latest["small_pct"]},
                 ],
                 "main_force": {
-                    "net_amount": clean_val(latest.get('主力净流入-净额')),
-                    "net_pct": clean_val(latest.get('主力净流入-净占比'))
+                    "net_amount": latest["main_net"],
+                    "net_pct": latest["main_pct"]
                 }
             }
     except Exception as e:
@@ -1207,6 +2409,25 @@ async def get_stock_fund_flow(symbol: str):
     
     return {"date": "", "items": [], "main_force": {"net_amount": 0, "net_pct": 0}}
 
+@app.get("/api/stock/capital_flow/{symbol}")
+async def get_capital_flow(symbol: str):
+    """获取主力资金流向和历史净流入占比（近 10 个交易日）"""
+    try:
+        rows = await get_money_flow(symbol, limit=10)
+        return [{
+            "date": r["date"],
+            "main_net_inflow": r["main_net"],
+            "main_net_pct": r["main_pct"],
+            "super_net_inflow": r["super_net"],
+            "super_net_pct": r["super_pct"],
+            "large_net_inflow": r["large_net"],
+            "large_net_pct": r["large_pct"]
+        } for r in rows]
+    except Exception as e:
+        logger.error(f"API capital flow error for {symbol}: {e}")
+    
+    return []
+
 DEFAULT_SYSTEM_PROMPT = """你是一名专业的A股人工智能投资顾问。你的分析必须基于数据，遵循‘讲人话、用逻辑代替情绪、条件触发建议、充分风险提示’的原则。
 
 【特别要求：分析结论（short_summary）必须使用股市新手、普通股民能秒懂的直白语言，避免生涩的金融术语。】
@@ -1221,7 +2442,18 @@ DEFAULT_SYSTEM_PROMPT = """你是一名专业的A股人工智能投资顾问。
 
 请直接输出合法的JSON格式结果。"""
 
-async def get_deepseek_analysis(prompt: str, system_prompt: Optional[str] = None):
+# 模型配置短时缓存，避免每次调用都读库；管理员修改配置时主动失效
+DEEPSEEK_CONFIG_TTL = 60
+_deepseek_config_cache = {"data": None, "ts": 0.0}
+_llm_client_state = {"client": None, "loop": None}
+_llm_client_closing = set() # 正在关闭的旧客户端任务，持有引用防止被回收
+
+def _load_deepseek_config() -> dict:
+    """读取 DeepSeek 配置 (api_key, model_id, base_url)，数据库优先，环境变量兜底"""
+    cached = _deepseek_config_cache["data"]
+    if cached is not None and time.time() - _deepseek_config_cache["ts"] < DEEPSEEK_CONFIG_TTL:
+        return cached
+
     # Try getting config from database first
     api_key = None
     model_id = "deepseek-chat"
@@ -1230,23 +2462,72 @@ async def get_deepseek_analysis(prompt: str, system_prompt: Optional[str] = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT config_key, config_value FROM system_config")
+        cursor.execute("SELECT config_key, config_value FROM system_config WHERE config_key IN ('deepseek_api_key', 'model_id', 'base_url')")
         configs = {row['config_key']: row['config_value'] for row in cursor.fetchall()}
         conn.close()
         
         api_key = configs.get("deepseek_api_key")
-        model_id = configs.get("model_id", model_id)
-        base_url = configs.get("base_url", base_url)
+        model_id = configs.get("model_id") or model_id
+        base_url = configs.get("base_url") or base_url
     except Exception as e:
         logger.error(f"Database config fetch error: {e}")
 
     # Fallback to environment variables if DB is empty
     if not api_key:
         api_key = os.getenv("DEEPSEEK_API_KEY")
-    
-    if not api_key: 
-        raise ValueError("DeepSeek API Key 未配置")
-    
+
+    config = {"api_key": api_key, "model_id": model_id, "base_url": base_url}
+    _deepseek_config_cache.update({"data": config, "ts": time.time()})
+    return config
+
+def invalidate_deepseek_config():
+    _deepseek_config_cache.update({"data": None, "ts": 0.0})
+
+async def _close_quietly(client: httpx.AsyncClient):
+    try:
+        await client.aclose()
+    except Exception as e:
+        logger.warning(f"LLM client close error: {e}")
+
+def _retire_llm_client(client: Optional[httpx.AsyncClient], loop: Optional[asyncio.AbstractEventLoop]):
+    """关闭被替换的旧客户端：旧事件循环仍在运行时投递回该循环，否则在当前循环关闭"""
+    if client is None or client.is_closed:
+        return
+    if loop is not None and not loop.is_closed() and loop.is_running() and loop is not asyncio.get_running_loop():
+        asyncio.run_coroutine_threadsafe(_close_quietly(client), loop)
+        return
+    task = asyncio.get_running_loop().create_task(_close_quietly(client))
+    _llm_client_closing.add(task)
+    task.add_done_callback(_llm_client_closing.discard)
+
+async def close_llm_client():
+    """进程退出时关闭共享客户端"""
+    client = _llm_client_state["client"]
+    _llm_client_state.update({"client": None, "loop": None})
+    if client is not None and not client.is_closed:
+        await _close_quietly(client)
+
+def _get_llm_client() -> httpx.AsyncClient:
+    """进程内共享的模型 HTTP 客户端（复用连接池），按事件循环创建"""
+    loop = asyncio.get_running_loop()
+    client = _llm_client_state["client"]
+    if client is None or client.is_closed or _llm_client_state["loop"] is not loop:
+        _retire_llm_client(client, _llm_client_state["loop"])
+        # Increase timeout to 60s for more stable analysis
+        client = httpx.AsyncClient(timeout=60.0, limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+        _llm_client_state.update({"client": client, "loop": loop})
+    return client
+
+def _build_deepseek_request(prompt: str, system_prompt: Optional[str] = None, stream: bool = False, max_tokens: Optional[int] = None):
+    """构建 DeepSeek 请求 (url, headers, payload)"""
+    config = _load_deepseek_config()
+    api_key = config["api_key"]
+    model_id = config["model_id"]
+    base_url = config["base_url"]
+    
+    if not api_key: 
+        raise ValueError("DeepSeek API Key 未配置")
+    
     # Ensure URL is correctly formatted
     if not base_url.endswith("/"): base_url += "/"
     url = f"{base_url}v1/chat/completions" if "deepseek.com" not in base_url else f"{base_url}chat/completions"
@@ -1266,41 +2547,254 @@ async def get_deepseek_analysis(prompt: str, system_prompt: Optional[str] = None
         ],
         "response_format": {"type": "json_object"},
         "temperature": 0.0,
-        "stream": False
+        "stream": stream
     }
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+    return url, headers, payload
+
+def _parse_llm_json(content: str) -> dict:
+    """解析模型输出的 JSON（兼容 ```json 代码块包裹）"""
+    if "```json" in content:
+        content = content.split("```json")[-1].split("```")[0]
+    return json.loads(content)
+
+class LLMOutputTruncated(RuntimeError):
+    """模型输出因 max_tokens 被截断"""
+
+async def get_deepseek_analysis(prompt: str, system_prompt: Optional[str] = None, max_tokens: Optional[int] = None):
+    url, headers, payload = _build_deepseek_request(prompt, system_prompt, max_tokens=max_tokens)
     
     try:
-        # Increase timeout to 60s for more stable analysis
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(url, json=payload, headers=headers)
-            if resp.status_code == 200:
-                content = resp.json()['choices'][0]['message']['content']
-                import json
-                if "```json" in content:
-                    content = content.split("```json")[-1].split("```")[0]
-                return json.loads(content)
-            else:
-                error_msg = f"DeepSeek API Error: {resp.status_code}"
-                logger.error(f"{error_msg} - {resp.text}")
-                raise RuntimeError(error_msg)
+        resp = await _get_llm_client().post(url, json=payload, headers=headers)
+        if resp.status_code == 200:
+            choice = resp.json()['choices'][0]
+            if choice.get('finish_reason') == 'length':
+                raise LLMOutputTruncated("DeepSeek output truncated")
+            return _parse_llm_json(choice['message']['content'])
+        else:
+            error_msg = f"DeepSeek API Error: {resp.status_code}"
+            logger.error(f"{error_msg} - {resp.text}")
+            raise RuntimeError(error_msg)
     except httpx.TimeoutException:
         raise TimeoutError("AI 接口响应超时")
     except Exception as e:
         logger.error(f"DeepSeek call error: {e}")
         raise e
 
+async def stream_deepseek_analysis(prompt: str, system_prompt: Optional[str] = None):
+    """流式调用 DeepSeek，逐段产出模型生成的文本增量"""
+    url, headers, payload = _build_deepseek_request(prompt, system_prompt, stream=True)
+    
+    try:
+        # 首字节通常 1 秒内返回，read 超时限制的是两个数据块之间的间隔
+        timeout = httpx.Timeout(60.0, read=30.0)
+        async with _get_llm_client().stream("POST", url, json=payload, headers=headers, timeout=timeout) as resp:
+            if resp.status_code != 200:
+                body = await resp.aread()
+                error_msg = f"DeepSeek API Error: {resp.status_code}"
+                logger.error(f"{error_msg} - {body[:500]}")
+                raise RuntimeError(error_msg)
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta:
+                    yield delta
+    except httpx.TimeoutException:
+        raise TimeoutError("AI 接口响应超时")
+
+class StreamingJSONFieldParser:
+    """增量扫描流式输出的 JSON 文本，字段值一旦完整即可取出。
+
+    只跟踪对象内的字段，返回 (路径, 值)，路径深度不超过 max_depth，
+    例如 ("signal",)、("structured_analysis", "short_summary")。
+    """
+
+    def __init__(self, max_depth: int = 2):
+        self.max_depth = max_depth
+        self.buf = ""
+        self.pos = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.stack = [] # 每层: {"type": "{"|"[", "path": tuple, "key": str, "state": str, "start": int}
+
+    def _complete(self, frame: dict, end: int, fields: list):
+        path = frame["path"] + (frame["key"],)
+        frame["state"] = "comma"
+        if len(path) > self.max_depth:
+            return
+        raw = self.buf[frame["start"]:end].strip()
+        try:
+            fields.append((path, json.loads(raw)))
+        except ValueError:
+            pass
+
+    def feed(self, text: str) -> list:
+        self.buf += text
+        fields = []
+        buf = self.buf
+        for i in range(self.pos, len(buf)):
+            c = buf[i]
+            top = self.stack[-1] if self.stack else None
+            is_obj = top is not None and top["type"] == "{"
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if is_obj and top["state"] == "key":
+                        top["key"] = json.loads(buf[self.string_start:i + 1])
+                        top["state"] = "colon"
+                    elif is_obj and top["state"] == "value" and top["start"] == self.string_start:
+                        self._complete(top, i + 1, fields)
+                continue
+            if c == '"':
+                self.in_string = True
+                self.string_start = i
+                if is_obj and top["state"] == "value_pending":
+                    top["start"] = i
+                    top["state"] = "value"
+            elif c in "{[":
+                if is_obj and top["state"] == "value_pending":
+                    top["start"] = i
+                    top["state"] = "value"
+                if top is None:
+                    path = ()
+                elif is_obj:
+                    path = top["path"] + (top["key"],)
+                else:
+                    path = top["path"] + ("[]",)
+                self.stack.append({"type": c, "path": path, "key": None, "state": "key" if c == "{" else None, "start": None})
+            elif c in "}]":
+                if is_obj and top["state"] == "value":
+                    # 对象末尾的标量值（如 "intensity": 80}）
+                    self._complete(top, i, fields)
+                if self.stack:
+                    self.stack.pop()
+                parent = self.stack[-1] if self.stack else None
+                if parent is not None and parent["type"] == "{" and parent["state"] == "value":
+                    self._complete(parent, i + 1, fields)
+            elif c == ":":
+                if is_obj and top["state"] == "colon":
+                    top["state"] = "value_pending"
+            elif c == ",":
+                if is_obj:
+                    if top["state"] == "value":
+                        self._complete(top, i, fields)
+                    top["state"] = "key"
+            elif not c.isspace():
+                if is_obj and top["state"] == "value_pending":
+                    top["start"] = i
+                    top["state"] = "value"
+        self.pos = len(buf)
+        return fields
+
 # Sector recommendations cache
-sector_ai_cache = {}
-sector_ai_cache_lock = Lock()
+# 板块推荐理由按 (板块, 日期) 持久化在 app_cache（代码 -> 理由），进程内 LRU 挡在前面；
+# 生成通过 job_locks 跨 worker 单飞，其余进程等待写入结果
+SECTOR_REASON_LRU_SIZE = 64
+SECTOR_REASON_LOCK_TTL = 120
+SECTOR_REASON_WAIT = 60 # 其他 worker 正在生成时的最长等待（秒）
+SECTOR_REASON_PRECOMPUTE_TOP_N = 5
+_sector_reason_lru: "OrderedDict[str, dict]" = OrderedDict()
+_sector_reason_lru_lock = Lock() # 事件循环与 to_thread 工作线程都会访问
+_sector_reason_tasks: Dict[str, asyncio.Task] = {}
+
+def _sector_reason_key(sector_name: str) -> str:
+    return f"sector_reasons_{sector_name}_{datetime.datetime.now().strftime('%Y%m%d')}"
+
+def _get_cached_sector_reasons(cache_key: str, codes: List[str] = ()) -> Dict[str, str]:
+    """代码 -> 推荐理由；内存 LRU 未覆盖所需代码时回源 SQLite（其他 worker 可能已补齐）"""
+    with _sector_reason_lru_lock:
+        reasons = _sector_reason_lru.get(cache_key)
+        if reasons is not None and all(c in reasons for c in codes):
+            _sector_reason_lru.move_to_end(cache_key)
+            return reasons
+    reasons = data_manager._get_db_cache(cache_key, 86400)
+    if not isinstance(reasons, dict):
+        return {}
+    _sector_reason_lru_put(cache_key, reasons)
+    return reasons
+
+def _sector_reason_lru_put(cache_key: str, reasons: dict):
+    with _sector_reason_lru_lock:
+        _sector_reason_lru[cache_key] = reasons
+        _sector_reason_lru.move_to_end(cache_key)
+        while len(_sector_reason_lru) > SECTOR_REASON_LRU_SIZE:
+            _sector_reason_lru.popitem(last=False)
+
+def _sector_reason_fallback(sector_name: str, stocks: List[dict]) -> Dict[str, str]:
+    # 紧急兜底：生成差异化理由
+    return {s['code']: f"【核心分析】{s['name']}作为{sector_name}板块优质标的，经营韧性强劲，当前估值具备极高的安全边际。 ▪ 【操作建议】技术面显示已进入底部蓄势阶段，建议关注近期大资金流入动向。 ▪ 【展望】随着行业景气度持续回暖，公司有望凭借核心优势跑出超额收益。" for s in stocks}
+
+async def get_ai_sector_reasons(sector_name: str, stocks: List[dict]) -> Dict[str, str]:
+    """使用 AI 为板块成分股生成智能化推荐理由，按代码缓存；盘中排名变化时只为新上榜的股票补生成"""
+    cache_key = _sector_reason_key(sector_name)
+    codes = [s["code"] for s in stocks]
+    reasons = await asyncio.to_thread(_get_cached_sector_reasons, cache_key, codes)
+    missing = [s for s in stocks if s["code"] not in reasons]
+    if not missing:
+        return reasons
 
-async def get_ai_sector_reasons(sector_name: str, stocks: List[dict]):
-    """使用 AI 为板块成分股生成智能化推荐理由"""
-    cache_key = f"{sector_name}_{datetime.datetime.now().strftime('%Y%m%d')}"
-    
-    with sector_ai_cache_lock:
-        if cache_key in sector_ai_cache:
-            return sector_ai_cache[cache_key]
+    task = _sector_reason_tasks.get(cache_key)
+    if task is None or task.done():
+        task = asyncio.create_task(_generate_sector_reasons_shared(sector_name, missing, cache_key))
+        _sector_reason_tasks[cache_key] = task
+        task.add_done_callback(lambda t: _sector_reason_tasks.pop(cache_key, None) if _sector_reason_tasks.get(cache_key) is t else None)
+    # 正在进行的生成可能针对另一批股票，未覆盖的由调用方兜底，下次请求再补
+    return {**reasons, **await asyncio.shield(task)}
+
+async def _generate_sector_reasons_shared(sector_name: str, stocks: List[dict], cache_key: str) -> Dict[str, str]:
+    codes = [s["code"] for s in stocks]
+    lock_key = f"gen_{cache_key}"
+    if not await asyncio.to_thread(try_acquire_job_lock, lock_key, SECTOR_REASON_LOCK_TTL):
+        # 其他 worker 正在生成，轮询共享缓存等待结果
+        deadline = time.time() + SECTOR_REASON_WAIT
+        while time.time() < deadline:
+            await asyncio.sleep(1)
+            reasons = await asyncio.to_thread(_get_cached_sector_reasons, cache_key, codes)
+            if all(c in reasons for c in codes):
+                return reasons
+        return _sector_reason_fallback(sector_name, stocks)
+
+    try:
+        generated = await _generate_sector_reasons(sector_name, stocks)
+        if generated is None:
+            return _sector_reason_fallback(sector_name, stocks)
+        # 与其他 worker 已写入的理由合并后整体回写
+        reasons = {**await asyncio.to_thread(_get_cached_sector_reasons, cache_key, codes), **dict(zip(codes, generated))}
+        _sector_reason_lru_put(cache_key, reasons)
+        await asyncio.to_thread(data_manager._set_db_cache, cache_key, reasons)
+        return reasons
+    finally:
+        await asyncio.to_thread(release_job_lock, lock_key)
+
+async def precompute_sector_reasons(sectors: List[dict], top_n: int = SECTOR_REASON_PRECOMPUTE_TOP_N):
+    """板块数据更新后为排名靠前的板块预生成推荐理由，开盘冷启动时直接命中缓存"""
+    for sector in sectors[:top_n]:
+        name = sector.get("name")
+        if not name:
+            continue
+        try:
+            members = await get_sector_members(name)
+            if members:
+                ranked, _ = _rank_sector_members(members, BackgroundTasks())
+                await get_ai_sector_reasons(name, [{"code": m["代码"], "name": m["名称"]} for m in ranked[:SECTOR_DISPLAY_SIZE]])
+        except Exception as e:
+            logger.warning(f"Sector reasons precompute failed for {name}: {e}")
 
+async def _generate_sector_reasons(sector_name: str, stocks: List[dict]) -> Optional[List[str]]:
+    """调用 DeepSeek 生成推荐理由；失败时返回 None"""
     stock_list_str = "\n".join([f"{i+1}. {s['code']} {s['name']}" for i, s in enumerate(stocks)])
     
     # 定义专有的系统提示词，确保输出格式和逻辑
@@ -1338,13 +2832,28 @@ async def get_ai_sector_reasons(sector_name: str, stocks: List[dict]):
                     diverse_reasons.append(templates[i % len(templates)])
             reasons = diverse_reasons
         
-        with sector_ai_cache_lock:
-            sector_ai_cache[cache_key] = reasons
         return reasons
     except Exception as e:
         logger.error(f"AI sector reasons generation failed: {e}")
-        # 紧急兜底：生成差异化理由
-        return [f"【核心分析】{s['name']}作为{sector_name}板块优质标的，经营韧性强劲，当前估值具备极高的安全边际。 ▪ 【操作建议】技术面显示已进入底部蓄势阶段，建议关注近期大资金流入动向。 ▪ 【展望】随着行业景气度持续回暖，公司有望凭借核心优势跑出超额收益。" for s in stocks]
+        return None
+
+# ==================== 技术指标 ====================
+RSI_PERIOD = 14 # 页面展示、AI 诊断与 RSI 提醒共用同一口径：涨幅/跌幅的 14 日简单平均
+
+def _rsi_from_averages(avg_gain, avg_loss) -> np.ndarray:
+    """由平均涨幅与平均跌幅计算 RSI：无跌幅为 100，无涨跌为 50，均值缺失为 NaN（向量化）"""
+    avg_gain, avg_loss = np.asarray(avg_gain, dtype=float), np.asarray(avg_loss, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.where(avg_loss > 0, 100 - 100 / (1 + avg_gain / avg_loss), np.where(avg_gain > 0, 100.0, 50.0))
+    rsi[np.isnan(avg_gain) | np.isnan(avg_loss)] = np.nan
+    return rsi
+
+def compute_rsi(closes: pd.Series, period: int = RSI_PERIOD) -> pd.Series:
+    """收盘价序列的 RSI 序列（涨跌幅按 period 日简单平均），不足 period 根的位置为 NaN"""
+    delta = pd.to_numeric(closes, errors='coerce').diff()
+    gain = delta.where(delta > 0, 0).rolling(window=period).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
+    return pd.Series(_rsi_from_averages(gain.to_numpy(), loss.to_numpy()), index=closes.index)
 
 @app.get("/api/stock/visual_indicators/{symbol}")
 async def get_visual_indicators(symbol: str, background_tasks: BackgroundTasks):
@@ -1395,11 +2904,7 @@ async def get_visual_indicators(symbol: str, background_tasks: BackgroundTasks):
     rsi_val = 50.0 
     if df is not None and len(df) >= 15:
         # RSI 14
-        delta = df['收盘'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        rsi_series = 100 - (100 / (1 + rs))
+        rsi_series = compute_rsi(df['收盘'])
         rsi_val = round(float(rsi_series.iloc[-1]), 2) if not pd.isna(rsi_series.iloc[-1]) else 50.0
 
         df['vol_ma5'] = df['成交量'].rolling(5).mean()
@@ -1461,9 +2966,54 @@ async def get_visual_indicators(symbol: str, background_tasks: BackgroundTasks):
         "internal_score": score # 传递给内部逻辑
     }
 
-@app.get("/api/stock/analysis/{symbol}")
-async def analyze_stock(symbol: str, request: Request, background_tasks: BackgroundTasks, user_id: Optional[int] = None):
-    """AI 深层诊断（计入详情页查询限额 + VIP频次限制）"""
+def _analysis_date_tag(now_ts: Optional[datetime.datetime] = None) -> str:
+    """诊断缓存的时间标签：交易与清算时段按 10 分钟分桶，其余时间按天"""
+    now_ts = now_ts or datetime.datetime.now()
+    current_minutes = now_ts.hour * 60 + now_ts.minute
+    # A股交易与清算期：9:15-11:35(555-695), 12:55-15:15(775-915)
+    is_jitter_time = (555 <= current_minutes <= 695) or (775 <= current_minutes <= 915)
+    if is_jitter_time:
+        return now_ts.strftime(f"%Y-%m-%d_%H_{(now_ts.minute // 10) * 10:02d}")
+    return now_ts.strftime("%Y-%m-%d")
+
+# ==================== 诊断生成 Single-flight ====================
+# 同一 (symbol, date_tag) 同时只发起一次 AI 生成，其余并发请求等待同一结果
+ANALYSIS_INFLIGHT_TIMEOUT = 120
+_analysis_inflight: Dict[tuple, tuple] = {} # (symbol, date_tag) -> (Future, 登记时间)
+
+def _get_inflight_analysis(key: tuple) -> Optional[asyncio.Future]:
+    """返回仍在进行中的生成任务；超时未完成的视为失效并移除"""
+    entry = _analysis_inflight.get(key)
+    if entry is None:
+        return None
+    future, started_at = entry
+    if future.done() or time.time() - started_at > ANALYSIS_INFLIGHT_TIMEOUT:
+        _analysis_inflight.pop(key, None)
+        return None
+    return future
+
+def _claim_analysis_generation(key: tuple) -> asyncio.Future:
+    """登记为该分桶的生成者；完成后必须调用 _finish_analysis_generation"""
+    future = asyncio.get_running_loop().create_future()
+    _analysis_inflight[key] = (future, time.time())
+    return future
+
+def _finish_analysis_generation(key: tuple, future: asyncio.Future, analysis: Optional[dict], error: Optional[Exception] = None):
+    """发布生成结果 (analysis, error) 给所有等待者"""
+    if _analysis_inflight.get(key, (None,))[0] is future:
+        _analysis_inflight.pop(key, None)
+    if not future.done():
+        future.set_result((analysis, error))
+
+async def _wait_inflight_analysis(future: asyncio.Future):
+    """等待其他请求发起的生成，返回 (analysis, error)"""
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout=ANALYSIS_INFLIGHT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None, TimeoutError("AI 接口响应超时")
+
+def _check_analysis_access(symbol: str, request: Request, user_id: Optional[int]) -> dict:
+    """诊断前置校验：详情页限流、登录、VIP 有效期与频次扣减，并返回缓存命中情况"""
     identifier = str(user_id) if user_id else (request.client.host if request.client else "unknown")
     if not is_view_allowed(identifier, symbol):
         raise HTTPException(status_code=429, detail=f"您查询股票详情页太频繁了，请一小时后再试。")
@@ -1476,14 +3026,7 @@ async def analyze_stock(symbol: str, request: Request, background_tasks: Backgro
     
     # === 分析结果持久化缓存检测 ===
     now_ts = datetime.datetime.now()
-    current_minutes = now_ts.hour * 60 + now_ts.minute
-    # A股交易与清算期：9:15-11:35(555-695), 12:55-15:15(775-915)
-    is_jitter_time = (555 <= current_minutes <= 695) or (775 <= current_minutes <= 915)
-    
-    if is_jitter_time:
-        date_tag = now_ts.strftime(f"%Y-%m-%d_%H_{(now_ts.minute // 10) * 10:02d}")
-    else:
-        date_tag = now_ts.strftime("%Y-%m-%d")
+    date_tag = _analysis_date_tag(now_ts)
 
     cached_analysis = get_cached_analysis(symbol, date_tag)
     is_cache_hit = True if cached_analysis else False
@@ -1510,17 +3053,27 @@ async def analyze_stock(symbol: str, request: Request, background_tasks: Backgro
         
     is_vip = True if expiry_dt > now_ts else False
     
+    inflight = None
+    is_leader = False
     if is_vip and not is_cache_hit:
-        # 仅在非缓存命中的情况下检查并扣除 VIP 频次
-        status = check_vip_rate_limit(user_id)
-        if not status["allowed"]:
-            msg_tpl = config_dict.get('rate_limit_msg', "您已达到每小时 {limit} 次分析的限制。请于 {resume_at} 后继续。")
-            detail_msg = msg_tpl.replace("{limit}", str(status["limit"])).replace("{resume_at}", status["resume_at"])
-            conn.close()
-            raise HTTPException(status_code=429, detail=detail_msg)
+        # 同一分桶已有生成任务时直接等待其结果，不重复扣除频次
+        inflight = _get_inflight_analysis((symbol, date_tag))
+        if inflight is None:
+            # 仅在非缓存命中的情况下检查并扣除 VIP 频次
+            status = check_vip_rate_limit(user_id, symbol)
+            if not status["allowed"]:
+                msg_tpl = config_dict.get('rate_limit_msg', "您已达到每小时 {limit} 次分析的限制。请于 {resume_at} 后继续。")
+                detail_msg = msg_tpl.replace("{limit}", str(status["limit"])).replace("{resume_at}", status["resume_at"])
+                conn.close()
+                raise HTTPException(status_code=429, detail=detail_msg)
+            inflight = _claim_analysis_generation((symbol, date_tag))
+            is_leader = True
     
     conn.close()
+    return {"date_tag": date_tag, "cached_analysis": cached_analysis, "is_vip": is_vip, "inflight": inflight, "is_leader": is_leader}
 
+async def _prepare_analysis_inputs(symbol: str, background_tasks: BackgroundTasks, need_prompt: bool) -> dict:
+    """准备诊断所需的行情与指标；仅在需要调用 AI 时才抓取新闻、机构评级并构建 Prompt"""
     # 1. 获取基础数据
     quote = await _get_stock_quote_core(symbol, background_tasks)
     df = await get_cached_kline(symbol)
@@ -1537,44 +3090,6 @@ async def analyze_stock(symbol: str, request: Request, background_tasks: Backgro
     price = quote.get("最新价") or quote.get("price", 0.0)
     prev_close = quote.get("昨收") or quote.get("prev_close", 0.0)
     
-    # 3. 获取机构评级与一致性目标价 (Feature 2)
-    inst_consensus = "暂无近期机构评级数据"
-    try:
-        clean_code_inst = "".join(filter(str.isdigit, symbol))
-        inst_df = await asyncio.to_thread(ak.stock_institute_recommend_detail, symbol=clean_code_inst)
-        if inst_df is not None and not inst_df.empty:
-            # 过滤近 60 天的数据
-            now_time = datetime.datetime.now()
-            recent_inst = []
-            for _, row in inst_df.iterrows():
-                try:
-                    rdt = datetime.datetime.strptime(str(row.get('日期', '')), "%Y-%m-%d")
-                    if (now_time - rdt).days <= 60:
-                        recent_inst.append(row)
-                except:
-                    pass
-            
-            if recent_inst:
-                buy_count = sum(1 for r in recent_inst if '买入' in str(r.get('评级', '')) or '增持' in str(r.get('评级', '')))
-                total_count = len(recent_inst)
-                buy_ratio = round(buy_count / total_count * 100, 1) if total_count > 0 else 0
-                
-                targets = []
-                for r in recent_inst:
-                    try:
-                        t = float(r.get('目标价', 0) or 0)
-                        if t > 0: targets.append(t)
-                    except: pass
-                    
-                avg_target = round(sum(targets) / len(targets), 2) if targets else 0
-                if avg_target > 0:
-                    space_pct = round((avg_target - float(price)) / float(price) * 100, 1) if float(price) > 0 else 0
-                    inst_consensus = f"近60天共有 {total_count} 家机构给出评级（买入/增持占比 {buy_ratio}%），机构平均目标价为 {avg_target} 元，距离现价空间约为 {space_pct}%。"
-                else:
-                    inst_consensus = f"近60天共有 {total_count} 家机构给出评级（买入/增持占比 {buy_ratio}%），暂无明确目标价共识。"
-    except Exception as e:
-        logger.error(f"Error fetching inst consensus: {e}")
-
     # 校准 PE/PB 异常值
     try:
         def clean_val(v, default=0.0):
@@ -1592,7 +3107,7 @@ async def analyze_stock(symbol: str, request: Request, background_tasks: Backgro
 
     # 计算涨跌幅
     quote_change = round((price - prev_close) / prev_close * 100, 2) if prev_close > 0 else 0.0
-    
+
     # 获取个股底层静态指标 (行业, 基础负债率等)
     clean_code = "".join(filter(str.isdigit, symbol))
     base_info = get_real_fundamentals(clean_code)
@@ -1609,6 +3124,31 @@ async def analyze_stock(symbol: str, request: Request, background_tasks: Backgro
         random.seed(None)
     industry = base_info.get("板块", "科技制造")
     
+    # 技术指标计算补充 (用于兜底引擎和 Prompt)
+    rsi_val = 50.0
+    vol_ratio = 1.0
+    last = None
+    if df is not None and len(df) >= 30:
+        df_calc = df.copy()
+        df_calc['ma20'] = df_calc['收盘'].rolling(20).mean()
+        df_calc['vol_ma5'] = df_calc['成交量'].rolling(5).mean()
+        last = df_calc.iloc[-1]
+        vol_ratio = last['成交量'] / last['vol_ma5'] if last['vol_ma5'] > 0 else 1
+        rsi_series = compute_rsi(df_calc['收盘'])
+        rsi_val = float(rsi_series.iloc[-1]) if not pd.isna(rsi_series.iloc[-1]) else 50.0
+
+    ctx = {
+        "quote": quote, "price": price, "prev_close": prev_close, "quote_change": quote_change,
+        "pe": pe, "pb": pb, "roe": roe, "eps": eps, "debt_ratio": debt_ratio, "industry": industry,
+        "rsi_val": rsi_val, "vol_ratio": vol_ratio, "last": last, "prompt": None
+    }
+    if not need_prompt:
+        return ctx
+
+    # 3. 获取机构评级与一致性目标价 (Feature 2，按日缓存)
+    inst_stats = await get_inst_consensus(symbol)
+    inst_consensus = format_inst_consensus(inst_stats, price)
+
     # 2. 获取实时新闻作为 AI 预测的真实来源
     news_context_list = await _get_real_news_for_ai(symbol, quote.get('名称', symbol), industry)
     news_prompt_segment = "【可用的参考新闻源（请从中挑选最相关的事件，并严格使用其 URL）】:\n"
@@ -1634,30 +3174,8 @@ async def analyze_stock(symbol: str, request: Request, background_tasks: Backgro
         f"实时关键位：支撑 {ind_data.get('support_price', round(price*0.96, 2))}，压力 {ind_data.get('resistance_price', round(price*1.05, 2))}"
     )
 
-    # 技术指标计算补充 (用于兜底引擎和 Prompt)
-    rsi_val = 50.0
-    vol_ratio = 1.0
-    last = None
-    if df is not None and len(df) >= 30:
-        df_calc = df.copy()
-        df_calc['ma20'] = df_calc['收盘'].rolling(20).mean()
-        df_calc['vol_ma5'] = df_calc['成交量'].rolling(5).mean()
-        last = df_calc.iloc[-1]
-        vol_ratio = last['成交量'] / last['vol_ma5'] if last['vol_ma5'] > 0 else 1
-        delta = df_calc['收盘'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        rsi_series = 100 - (100 / (1 + rs))
-        rsi_val = float(rsi_series.iloc[-1]) if not pd.isna(rsi_series.iloc[-1]) else 50.0
-
-    # ================= AI Diagnostic Header =================
-    analysis = cached_analysis if is_cache_hit else None
-    analysis_error = "AI 分析服务暂不可用"
-    
-    if not is_cache_hit and is_vip:
-        # 仅在非缓存命中的情况下构建 Prompt 并请求 AI
-        prompt = f"""
+    # 仅在非缓存命中的情况下构建 Prompt 并请求 AI
+    prompt = f"""
 分析标的: {quote.get('名称', symbol)} ({symbol})
 当前价格: {price}，昨收价: {prev_close}，今日涨跌幅: {quote_change}%
 核心指标: PE={pe}, PB={pb}, ROE={roe}%, EPS={eps}, 负债率={debt_ratio}%, RSI={round(float(rsi_val), 2) if 'rsi_val' in locals() else 50.0}
@@ -1725,19 +3243,14 @@ JSON 格式要求：
     ]
 }}
 """
-        try:
-            analysis = await get_deepseek_analysis(prompt)
-            # 存入缓存
-            if analysis:
-                save_analysis_to_cache(symbol, date_tag, analysis)
-        except ValueError as e:
-            analysis_error = str(e)
-        except TimeoutError as e:
-            analysis_error = str(e)
-        except Exception as e:
-            analysis_error = "AI 诊断引擎故障"
-    elif not is_vip:
-        analysis_error = "VIP 体验已到期"
+    ctx["prompt"] = prompt
+    return ctx
+
+def _build_analysis_result(symbol: str, ctx: dict, analysis: Optional[dict], analysis_error: str) -> dict:
+    """组装诊断结果：优先使用 AI 输出，缺失部分由本地规则引擎兜底"""
+    quote, price, quote_change = ctx["quote"], ctx["price"], ctx["quote_change"]
+    pe, pb, roe, eps, debt_ratio = ctx["pe"], ctx["pb"], ctx["roe"], ctx["eps"], ctx["debt_ratio"]
+    rsi_val, vol_ratio, last, industry = ctx["rsi_val"], ctx["vol_ratio"], ctx["last"], ctx["industry"]
 
     # ================= Fallback to Local Engine =================
     is_above_ma20 = (price > last['ma20']) if last is not None and 'ma20' in last else False
@@ -1857,6 +3370,289 @@ JSON 格式要求：
 
     return sanitize(result)
 
+@app.get("/api/stock/analysis/{symbol}")
+async def analyze_stock(symbol: str, request: Request, background_tasks: BackgroundTasks, user_id: Optional[int] = None):
+    """AI 深层诊断（计入详情页查询限额 + VIP频次限制）"""
+    access = _check_analysis_access(symbol, request, user_id)
+    analysis = access["cached_analysis"]
+    is_vip = access["is_vip"]
+    key = (symbol, access["date_tag"])
+
+    # ================= AI Diagnostic Header =================
+    analysis_error = "AI 分析服务暂不可用"
+    if access["is_leader"]:
+        # 行情准备阶段的异常照常抛出，并先释放单飞占位，避免等待者挂起
+        try:
+            ctx = await _prepare_analysis_inputs(symbol, background_tasks, need_prompt=True)
+        except BaseException as e:
+            _finish_analysis_generation(key, access["inflight"], None, e if isinstance(e, Exception) else None)
+            raise
+        # AI 调用异常走本地引擎兜底
+        error = None
+        try:
+            analysis = await get_deepseek_analysis(ctx["prompt"])
+            # 存入缓存
+            if analysis:
+                save_analysis_to_cache(symbol, access["date_tag"], analysis)
+        except Exception as e:
+            error = e
+            analysis_error = _analysis_error_message(e)
+        finally:
+            _finish_analysis_generation(key, access["inflight"], analysis, error)
+    else:
+        ctx = await _prepare_analysis_inputs(symbol, background_tasks, need_prompt=False)
+        if access["inflight"] is not None:
+            analysis, error = await _wait_inflight_analysis(access["inflight"])
+            if error is not None:
+                analysis_error = _analysis_error_message(error)
+        elif not is_vip:
+            analysis_error = "VIP 体验已到期"
+
+    return _build_analysis_result(symbol, ctx, analysis, analysis_error)
+
+def _analysis_error_message(e: Exception) -> str:
+    """将 AI 调用异常转换为前端展示的提示"""
+    if isinstance(e, (ValueError, TimeoutError)):
+        return str(e)
+    return "AI 诊断引擎故障"
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+# 持有流式生成任务的引用，防止客户端断开后任务被回收
+_analysis_stream_tasks = set()
+
+async def _generate_analysis_streaming(symbol: str, date_tag: str, prompt: str, queue: asyncio.Queue, future: asyncio.Future):
+    """后台消费模型的流式输出并转发到队列；客户端中途断开也会完成生成并写入缓存"""
+    chunks = []
+    analysis = None
+    error = None
+    try:
+        async for delta in stream_deepseek_analysis(prompt):
+            chunks.append(delta)
+            queue.put_nowait(("delta", delta))
+        analysis = _parse_llm_json("".join(chunks))
+        if analysis:
+            save_analysis_to_cache(symbol, date_tag, analysis)
+        queue.put_nowait(("done", analysis))
+    except Exception as e:
+        logger.error(f"DeepSeek stream error for {symbol}: {e}")
+        error = e
+        queue.put_nowait(("error", e))
+    finally:
+        _finish_analysis_generation((symbol, date_tag), future, analysis, error)
+
+@app.get("/api/stock/analysis/{symbol}/stream")
+async def analyze_stock_stream(symbol: str, request: Request, background_tasks: BackgroundTasks, user_id: Optional[int] = None):
+    """AI 深层诊断的 SSE 流式版本：各字段生成完毕即推送，最终完整结果与普通接口一致
+
+    事件顺序：start -> field (signal、structured_analysis.short_summary 等，可多次) -> done；
+    start 之后出错时以 error 事件结束
+    """
+    access = _check_analysis_access(symbol, request, user_id)
+    cached_analysis = access["cached_analysis"]
+    is_vip = access["is_vip"]
+    key = (symbol, access["date_tag"])
+
+    async def event_stream():
+        started = False
+        try:
+            yield _sse_event("start", {"symbol": symbol, "cached": cached_analysis is not None})
+            ctx = await _prepare_analysis_inputs(symbol, background_tasks, need_prompt=access["is_leader"])
+
+            analysis = cached_analysis
+            analysis_error = "AI 分析服务暂不可用"
+            if access["is_leader"]:
+                queue = asyncio.Queue()
+                task = asyncio.create_task(_generate_analysis_streaming(symbol, access["date_tag"], ctx["prompt"], queue, access["inflight"]))
+                started = True
+                _analysis_stream_tasks.add(task)
+                task.add_done_callback(_analysis_stream_tasks.discard)
+
+                parser = StreamingJSONFieldParser()
+                while True:
+                    kind, payload = await queue.get()
+                    if kind == "delta":
+                        for path, value in parser.feed(payload):
+                            if path == ("structured_analysis",):
+                                continue # 子字段已逐个推送
+                            yield _sse_event("field", {"path": ".".join(path), "value": value})
+                    elif kind == "done":
+                        analysis = payload
+                        break
+                    else:
+                        analysis_error = _analysis_error_message(payload)
+                        break
+            elif access["inflight"] is not None:
+                # 同一分桶的诊断正由其他请求生成，等待其完整结果
+                analysis, error = await _wait_inflight_analysis(access["inflight"])
+                if error is not None:
+                    analysis_error = _analysis_error_message(error)
+            elif not is_vip:
+                analysis_error = "VIP 体验已到期"
+
+            yield _sse_event("done", _build_analysis_result(symbol, ctx, analysis, analysis_error))
+        except Exception as e:
+            # 响应头已发出，无法再改状态码，以 error 事件告知前端后结束
+            logger.error(f"Analysis stream failed for {symbol}: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else "AI 诊断引擎故障"
+            yield _sse_event("error", {"detail": detail})
+        finally:
+            if access["is_leader"] and not started:
+                _finish_analysis_generation(key, access["inflight"], None)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==================== 个股详情组合接口 ====================
+DETAIL_SECTIONS = ("quote", "visual_indicators", "kline", "analysis", "influential_news", "fund_flow", "capital_flow", "peer_radar")
+
+@app.get("/api/stock/detail/{symbol}")
+async def get_stock_detail(symbol: str, request: Request, background_tasks: BackgroundTasks, sections: Optional[str] = None, user_id: Optional[int] = None, kline_format: str = "records"):
+    """个股详情页组合接口：各分区并发计算，完成一个推送一行 NDJSON
+
+    每行格式：{"section": 分区名, "status": 200, "data": ...}，失败时为 {"section", "status", "detail"}。
+    同一请求内行情与 K 线只获取一次，供各分区共享；kline_format 透传给 K 线分区。
+    """
+    wanted = [s.strip() for s in sections.split(",") if s.strip()] if sections else list(DETAIL_SECTIONS)
+    unknown = [s for s in wanted if s not in DETAIL_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知的分区: {', '.join(unknown)}")
+
+    handlers = {
+        "quote": lambda: get_stock_quote(symbol, request, background_tasks, user_id),
+        "visual_indicators": lambda: get_visual_indicators(symbol, background_tasks),
+        "kline": lambda: get_stock_kline(symbol, None, kline_format),
+        "analysis": lambda: analyze_stock(symbol, request, background_tasks, user_id),
+        "influential_news": lambda: get_influential_news(symbol),
+        "fund_flow": lambda: get_stock_fund_flow(symbol),
+        "capital_flow": lambda: get_capital_flow(symbol),
+        "peer_radar": lambda: get_peer_radar(symbol),
+    }
+
+    async def run(name: str) -> dict:
+        try:
+            data = await handlers[name]()
+            if isinstance(data, Response):
+                # 预编码的快照字节原样嵌入，不再解码重编
+                return {"section": name, "status": 200, "raw": data.body}
+            return {"section": name, "status": 200, "data": data}
+        except HTTPException as e:
+            return {"section": name, "status": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"Stock detail section {name} failed for {symbol}: {e}")
+            return {"section": name, "status": 500, "detail": "数据获取失败"}
+
+    async def stream():
+        # 分区任务在共享上下文中创建；客户端断开后任务继续完成，结果照常写入各自缓存
+        token = _request_shared.set({})
+        try:
+            tasks = [asyncio.create_task(run(name)) for name in dict.fromkeys(wanted)]
+        finally:
+            _request_shared.reset(token)
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            if "raw" in item:
+                yield b'{"section":"' + item["section"].encode() + b'","status":200,"data":' + item["raw"] + b'}\n'
+            else:
+                yield json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=background_tasks)
+
+# ==================== AI 诊断预热 ====================
+# 盘前与每个 10 分钟分桶切换时，为热门标的预先生成诊断，让多数用户直接命中缓存
+ANALYSIS_WARMUP_TOP_N = 20
+ANALYSIS_WARMUP_CONCURRENCY = 3
+ANALYSIS_WARMUP_DAILY_BUDGET = 400 # 每日预热最多调用 AI 的次数（成本上限，所有 worker 合计）
+_analysis_warmup_state = {"last_tag": None}
+
+def rank_warmup_symbols(limit: int = ANALYSIS_WARMUP_TOP_N) -> List[str]:
+    """综合近期浏览、自选人数与涨跌榜上榜情况，选出需要预热的标的"""
+    scores = _hot_symbol_scores(days=3)
+    try:
+        spot = data_manager.get_spot_data_fast(BackgroundTasks())
+        if not spot.empty and "涨跌幅" in spot.columns:
+            change = pd.to_numeric(spot["涨跌幅"], errors='coerce').fillna(0.0)
+            ranked_codes = pd.concat([
+                spot.loc[change.nlargest(20).index, "代码"],
+                spot.loc[change.nsmallest(20).index, "代码"]
+            ])
+            for code in ranked_codes.astype(str):
+                scores[code] = scores.get(code, 0) + 2
+    except Exception as e:
+        logger.warning(f"Warmup ranking membership error: {e}")
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [code for code, _ in ranked if code.isdigit() and len(code) == 6][:limit]
+
+async def warm_analysis_cache(date_tag: str, limit: int = ANALYSIS_WARMUP_TOP_N):
+    """为热门标的生成指定分桶的诊断缓存（受并发与每日调用预算约束）；盘前可提前生成开盘首个分桶"""
+    budget_key = f"analysis_warmup_calls_{datetime.date.today().isoformat()}"
+    started_tag = _analysis_date_tag()
+    targets = [code for code in rank_warmup_symbols(limit) if get_cached_analysis(code, date_tag) is None]
+    if not targets:
+        return
+    logger.info(f"Warming analysis cache for {len(targets)} symbols ({date_tag})...")
+
+    semaphore = asyncio.Semaphore(ANALYSIS_WARMUP_CONCURRENCY)
+
+    async def warm_one(code: str) -> bool:
+        async with semaphore:
+            if _analysis_date_tag() not in (started_tag, date_tag):
+                return False # 目标分桶已过，结果不再有用
+            key = (code, date_tag)
+            if _get_inflight_analysis(key) is not None or get_cached_analysis(code, date_tag) is not None:
+                return False # 用户请求已在生成或已生成
+            if not try_consume_job_budget(budget_key, ANALYSIS_WARMUP_DAILY_BUDGET):
+                return False # 当日预算已用尽
+            future = _claim_analysis_generation(key)
+            analysis = None
+            error = None
+            try:
+                ctx = await _prepare_analysis_inputs(code, BackgroundTasks(), need_prompt=True)
+                analysis = await get_deepseek_analysis(ctx["prompt"])
+                if analysis:
+                    save_analysis_to_cache(code, date_tag, analysis)
+            except Exception as e:
+                error = e
+                logger.warning(f"Analysis warmup failed for {code}: {e}")
+            finally:
+                _finish_analysis_generation(key, future, analysis, error)
+            return bool(analysis)
+
+    results = await asyncio.gather(*(warm_one(code) for code in targets))
+    logger.info(f"Analysis warmup finished for {date_tag}: {sum(results)}/{len(targets)} generated.")
+
+async def analysis_warmup_loop():
+    """每 20 秒检查一次：工作日 9:00 后的盘前与每个盘中分桶各预热一次
+
+    盘前（9:15 前）的请求量很小，盘前预热直接生成开盘首个分桶，用户开盘即可命中缓存。
+    """
+    while True:
+        await asyncio.sleep(20)
+        try:
+            now_ts = datetime.datetime.now()
+            if now_ts.weekday() >= 5 or not (9 <= now_ts.hour < 16):
+                continue
+            date_tag = _analysis_date_tag(now_ts)
+            if "_" not in date_tag:
+                # 15:15 之后的日级缓存留给用户按需生成，不再预热
+                if now_ts.hour >= 15:
+                    continue
+                if now_ts.hour == 9:
+                    date_tag = _analysis_date_tag(now_ts.replace(minute=15))
+            if date_tag == _analysis_warmup_state["last_tag"]:
+                continue
+            _analysis_warmup_state["last_tag"] = date_tag
+            # 多 worker 部署时只由一个进程执行
+            if not try_acquire_job_lock(f"analysis_warmup_{date_tag}", ttl=600):
+                continue
+            await warm_analysis_cache(date_tag)
+        except Exception as e:
+            logger.error(f"Analysis warmup loop error: {e}")
+
 # ==================== 管理员和用户管理 API ====================
 
 @app.post("/api/admin/login")
@@ -2046,9 +3842,44 @@ async def update_system_config(config: SystemConfigUpdate):
     
     conn.commit()
     conn.close()
+    invalidate_deepseek_config()
     
     return {"success": True, "message": "配置更新成功"}
 
+BACKTEST_CACHE_TTL = 3600 # 回测结果缓存（秒），K 线缓存按日累积，无需频繁重算
+_backtest_lock = asyncio.Lock()
+
+@app.get("/api/admin/backtest")
+async def backtest_trend_score(start: Optional[str] = None, horizons: Optional[str] = None, refresh: bool = False):
+    """用本地已缓存的日 K 回测 trend_score 与诊断兜底评分，返回各信号档位的胜率与后续收益（样本仅含被浏览过的股票，见 universe_source）"""
+    try:
+        periods = sorted({int(h) for h in horizons.split(",") if h.strip()}) if horizons else DEFAULT_HORIZONS
+        if start:
+            datetime.datetime.strptime(start, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start 需为 YYYY-MM-DD，horizons 需为逗号分隔的正整数")
+    if not periods or min(periods) < 1 or max(periods) > 250:
+        raise HTTPException(status_code=400, detail="持有期需在 1-250 根 K 线之间")
+
+    cache_key = f"backtest_{start or 'all'}_{'-'.join(map(str, periods))}"
+    if not refresh:
+        cached = data_manager._get_db_cache(cache_key, BACKTEST_CACHE_TTL)
+        if cached is not None:
+            return cached
+    # 矩阵运算占用内存较多，同一时间只跑一份
+    async with _backtest_lock:
+        if not refresh:
+            cached = data_manager._get_db_cache(cache_key, BACKTEST_CACHE_TTL)
+            if cached is not None:
+                return cached
+        try:
+            report = await asyncio.to_thread(run_backtest, None, start, periods)
+        except Exception as e:
+            logger.error(f"Backtest failed: {e}")
+            raise HTTPException(status_code=500, detail="回测失败")
+        data_manager._set_db_cache(cache_key, report)
+    return report
+
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...)):
     """通用文件上传接口"""
@@ -2381,8 +4212,12 @@ async def get_user_watchlist(user_id: int):
     return codes
 
 @app.get("/api/market/sectors")
-async def get_market_sectors(background_tasks: BackgroundTasks):
+async def get_market_sectors(request: Request, background_tasks: BackgroundTasks):
     """获取板块行情数据"""
+    version = data_manager._get_db_cache_version('sector_data', data_manager.sector_expiry)
+    entry = get_encoded_response("sectors", version)
+    if entry is not None:
+        return snapshot_response(request, entry)
     sectors = data_manager.get_sector_data_fast(background_tasks)
     
     # 如果数据为空且正在更新中，稍微等一下，而不是直接返回空
@@ -2397,92 +4232,245 @@ async def get_market_sectors(background_tasks: BackgroundTasks):
     if not sectors and not data_manager._is_updating_sector:
         await data_manager.update_sector_data()
         sectors = data_manager.get_sector_data_fast(background_tasks)
-        
+
+    if sectors:
+        version = data_manager._get_db_cache_version('sector_data', data_manager.sector_expiry)
+        return snapshot_response(request, put_encoded_response("sectors", version, sectors))
     return sectors
 
+BOARD_SORT_FIELDS = {"change", "amount", "turnover", "total_mv", "up_count", "down_count", "leader_change", "price"}
+
+@app.get("/api/market/boards")
+async def get_market_boards(
+    background_tasks: BackgroundTasks,
+    sort_by: str = "change",
+    order: str = "desc",
+    page: int = 1,
+    page_size: int = 20,
+    keyword: Optional[str] = None,
+    min_change: Optional[float] = None,
+    max_change: Optional[float] = None,
+    min_amount: Optional[float] = None,
+    min_up_ratio: Optional[float] = None
+):
+    """全部行业板块：支持排序、分页与板块级筛选（数据来自内存快照）"""
+    if sort_by not in BOARD_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort_by}")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+
+    board = data_manager.get_board_snapshot(background_tasks)
+    if board.empty and not data_manager._is_updating_sector:
+        await data_manager.update_sector_data()
+        board = data_manager.get_board_snapshot(background_tasks)
+
+    mask = pd.Series(True, index=board.index)
+    if keyword:
+        mask &= board["name"].str.contains(keyword, regex=False)
+    if min_change is not None:
+        mask &= board["change"] >= min_change
+    if max_change is not None:
+        mask &= board["change"] <= max_change
+    if min_amount is not None:
+        mask &= board["amount"] >= min_amount
+    if min_up_ratio is not None:
+        total = (board["up_count"] + board["down_count"]).where(lambda x: x > 0)
+        mask &= (board["up_count"] / total).fillna(0.0) >= min_up_ratio
+    view = board[mask].sort_values(sort_by, ascending=(order == "asc"), kind="stable")
+
+    start = (page - 1) * page_size
+    return {
+        "total": int(len(view)),
+        "page": page,
+        "page_size": page_size,
+        "updated_at": data_manager._last_board_update,
+        "items": view.iloc[start:start + page_size].to_dict(orient="records")
+    }
+
+# ==================== 板块成分股与行情 ====================
+# 成分股每日刷新一次并持久化；展示时按最新涨跌幅对全部成分股排序，
+# 近期被展示过的板块的上榜股票行情由后台统一批量轮询
+SECTOR_MEMBERS_TTL = 86400
+SECTOR_CONS_TIMEOUT = 10.0
+SECTOR_DISPLAY_SIZE = 21
+SECTOR_QUOTE_INTERVAL = 15 # 盘中批量轮询间隔（秒）
+SECTOR_QUOTE_MAX_AGE = 30 # 超过该时长的行情视为过期，按需补拉
+SECTOR_DISPLAY_TTL = 600 # 板块超过该时长未被查看即停止轮询（秒）
+TENCENT_QUOTE_CHUNK = 60 # 腾讯行情单次请求的代码数量上限
+_sector_members: Dict[str, tuple] = {} # 板块名 -> (加载时间, [{"代码", "名称"}])
+_sector_member_tasks: Dict[str, asyncio.Task] = {}
+_sector_quotes: Dict[str, tuple] = {} # 代码 -> (更新时间, 涨跌幅)
+_sector_display: Dict[str, tuple] = {} # 板块名 -> (最近展示时间, 上榜代码)
+
+def _normalize_code(code) -> str:
+    code = str(code)
+    return code.zfill(6) if code.isdigit() else code
+
+async def _fetch_sector_members(sector_name: str) -> List[dict]:
+    """从 akshare 拉取板块成分股并写入 SQLite 缓存，不登记到进程内的展示板块"""
+    data = await asyncio.wait_for(asyncio.to_thread(ak.stock_board_industry_cons_em, symbol=sector_name), timeout=SECTOR_CONS_TIMEOUT)
+    if data is None or data.empty:
+        return []
+    df = pd.DataFrame({
+        "代码": data['代码'].astype(str).map(_normalize_code),
+        "名称": data['名称'].astype(str)
+    })
+    members = df.to_dict(orient="records")
+    await asyncio.to_thread(data_manager._set_db_cache, f"sector_cons_{sector_name}", members)
+    return members
+
+async def _load_sector_members(sector_name: str, force: bool = False) -> List[dict]:
+    members = None if force else await asyncio.to_thread(data_manager._get_db_cache, f"sector_cons_{sector_name}", SECTOR_MEMBERS_TTL)
+    if not members:
+        members = await _fetch_sector_members(sector_name)
+        if not members:
+            return []
+    _sector_members[sector_name] = (time.time(), members)
+    return members
+
+async def get_sector_members(sector_name: str) -> List[dict]:
+    """板块成分股：内存 -> SQLite 缓存 -> akshare，同一板块的并发加载共享一次请求"""
+    entry = _sector_members.get(sector_name)
+    if entry and time.time() - entry[0] < SECTOR_MEMBERS_TTL:
+        return entry[1]
+    task = _sector_member_tasks.get(sector_name)
+    if task is None or task.done():
+        task = asyncio.create_task(_load_sector_members(sector_name))
+        _sector_member_tasks[sector_name] = task
+    try:
+        return await asyncio.shield(task)
+    finally:
+        if task.done() and _sector_member_tasks.get(sector_name) is task:
+            _sector_member_tasks.pop(sector_name, None)
+
+async def refresh_sector_members():
+    """每日刷新当前展示板块的成分股"""
+    sectors = data_manager._get_db_cache('sector_data', 999999) or []
+    for s in sectors:
+        name = s.get("name")
+        if not name: continue
+        try:
+            await _load_sector_members(name, force=True)
+        except Exception as e:
+            logger.warning(f"Sector members refresh failed for {name}: {e}")
+
+async def _fetch_tencent_quote_chunk(client: httpx.AsyncClient, symbols: List[str]) -> Dict[str, float]:
+    results = {}
+    resp = await client.get(f"https://qt.gtimg.cn/q={','.join(symbols)}")
+    if resp.status_code == 200:
+        text = resp.content.decode('gbk', errors='ignore')
+        for line in text.strip().split(';'):
+            if '~' not in line: continue
+            parts = line.split('~')
+            if len(parts) >= 6:
+                # s_ 简版行情：v_s_sz000001="51~平安银行~000001~11.55~0.15~1.32~..."
+                # index 2 为代码，5 为涨跌幅
+                try:
+                    results[parts[2]] = float(parts[5])
+                except ValueError:
+                    continue
+    return results
+
 async def get_realtime_quotes_tencent(codes: List[str]):
-    """使用腾讯接口实时获取多只股票的行情"""
+    """使用腾讯接口实时获取多只股票的涨跌幅，代码较多时分块并发请求"""
     if not codes: return {}
     
     # 构造符号列表 (带 sh/sz/bj 前缀)
     symbols = []
     for code in codes:
-        clean_code = "".join(filter(str.isdigit, code))
-        if clean_code.startswith('6'): prefix = "sh"
-        elif clean_code.startswith(('0', '3')): prefix = "sz"
-        elif clean_code.startswith(('4', '8', '9')): prefix = "bj"
-        else: prefix = "sh" if clean_code.startswith('6') else "sz"
-        symbols.append(f"s_{prefix}{clean_code}")
-    
-    url = f"https://qt.gtimg.cn/q={','.join(symbols)}"
+        market, clean_code = _split_symbol(code)
+        symbols.append(f"s_{market}{clean_code}")
+    
     results = {}
     try:
         async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.get(url)
-            if resp.status_code == 200:
-                text = resp.content.decode('gbk', errors='ignore')
-                lines = text.strip().split(';')
-                for line in lines:
-                    if '~' not in line: continue
-                    parts = line.split('~')
-                    if len(parts) >= 6:
-                        # 0: 名称, 1: 价格, 2: 变化, 3: 变化率%, 4: ...
-                        # 注意腾讯 s 接口的分割索引可能不一致，通常 s_ 开头时：
-                        # v_s_sz000001="51~平安银行~000001~11.55~0.15~1.32~..."
-                        # index 2 为代码，5 为涨跌幅
-                        raw_code = parts[2]
-                        change_percent = float(parts[5])
-                        results[raw_code] = change_percent
+            chunks = [symbols[i:i + TENCENT_QUOTE_CHUNK] for i in range(0, len(symbols), TENCENT_QUOTE_CHUNK)]
+            for res in await asyncio.gather(*(_fetch_tencent_quote_chunk(client, c) for c in chunks), return_exceptions=True):
+                if isinstance(res, dict):
+                    results.update(res)
+                else:
+                    logger.warning(f"Fetch real-time quotes chunk via Tencent failed: {res}")
     except Exception as e:
         logger.warning(f"Fetch real-time quotes via Tencent failed: {e}")
+    now = time.time()
+    for code, change in results.items():
+        _sector_quotes[code] = (now, change)
     return results
 
+async def refresh_sector_quotes():
+    """一次批量轮询近期被展示过的板块的上榜股票行情"""
+    now = time.time()
+    codes = set()
+    for name, (shown_at, shown_codes) in list(_sector_display.items()):
+        if now - shown_at > SECTOR_DISPLAY_TTL:
+            _sector_display.pop(name, None)
+            continue
+        codes.update(shown_codes)
+    if codes:
+        await get_realtime_quotes_tencent(sorted(codes))
+
+async def sector_quote_loop():
+    """交易时段内定时批量刷新板块成分股行情"""
+    while True:
+        await asyncio.sleep(SECTOR_QUOTE_INTERVAL)
+        try:
+            now_ts = datetime.datetime.now()
+            if now_ts.weekday() >= 5 or not (datetime.time(9, 15) <= now_ts.time() <= datetime.time(15, 5)):
+                continue
+            await refresh_sector_quotes()
+        except Exception as e:
+            logger.error(f"Sector quote loop error: {e}")
+
+def _fresh_sector_quotes(codes: List[str]) -> Dict[str, float]:
+    now = time.time()
+    return {c: q[1] for c in codes if (q := _sector_quotes.get(c)) and now - q[0] < SECTOR_QUOTE_MAX_AGE}
+
+def _rank_sector_members(members: List[dict], background_tasks: BackgroundTasks):
+    """按最新涨跌幅对全部成分股降序排序（轮询行情优先，其余取全市场快照），返回 (排序后成分股, 代码 -> 涨跌幅)"""
+    codes = [m["代码"] for m in members]
+    spot = data_manager.get_spot_index(background_tasks)
+    changes = pd.Series(np.nan, index=codes, dtype=float)
+    if "涨跌幅" in spot.columns:
+        changes = pd.to_numeric(spot["涨跌幅"], errors='coerce').reindex(codes)
+    fresh = _fresh_sector_quotes(codes)
+    if fresh:
+        changes.update(pd.Series(fresh, dtype=float))
+    # 无行情的排在最后，涨跌幅相同时保持成分股原顺序
+    order = np.argsort(-changes.fillna(-np.inf).to_numpy(), kind="stable")
+    known = changes.dropna()
+    return [members[i] for i in order], dict(zip(known.index, known.to_numpy(dtype=float)))
+
 @app.get("/api/market/sector_stocks/{sector_name}")
 async def get_sector_stocks(sector_name: str, background_tasks: BackgroundTasks):
     """获取指定板块的成分股 (AI 智能推荐版)"""
     try:
-        # 获取实时行情数据以备兜底使用
-        spot_df = data_manager.get_spot_data_fast(background_tasks)
-        spot_dict = {}
-        if spot_df is not None and not spot_df.empty:
-            # 建立 代码 -> 涨跌幅 的映射，确保代码是 string 且补齐 6 位
-            spot_dict = pd.Series(
-                pd.to_numeric(spot_df['涨跌幅'], errors='coerce').fillna(0.0).values, 
-                index=spot_df['代码'].astype(str).apply(lambda x: x.zfill(6) if x.isdigit() else x).values
-            ).to_dict()
-
-        # 使用 asyncio.to_thread 执行可能涉及阻塞 I/O 的 akshare 调用
-        data = await asyncio.to_thread(ak.stock_board_industry_cons_em, symbol=sector_name)
-        if data is not None and not data.empty:
-            # 选取前 21 只标的
-            top_stocks = data.head(21)
-            # 先收集代码进行批量行情获取
-            codes = [str(row['代码']).zfill(6) if str(row['代码']).isdigit() else str(row['代码']) for _, row in top_stocks.iterrows()]
-            quotes = await get_realtime_quotes_tencent(codes)
-
-            stocks = []
-            for _, row in top_stocks.iterrows():
-                code = str(row['代码']).zfill(6) if str(row['代码']).isdigit() else str(row['代码'])
-                # 优先使用 Tencent 实时行情，其次使用 cons_em，最后 fallback 到 spot_dict
-                change_val = quotes.get(code, None)
-                if change_val is None:
-                    change_val = row.get('涨跌幅', None)
-                if pd.isna(change_val) or change_val is None:
-                    change_val = spot_dict.get(code, 0.0)
-                
-                stocks.append({
-                    "name": row['名称'],
-                    "code": code,
-                    "change": float(change_val) if not pd.isna(change_val) else 0.0
-                })
+        members = await get_sector_members(sector_name)
+        if members:
+            # 全部成分股按最新涨跌幅排序后选取前 21 只标的（当日领涨股）
+            ranked, changes = _rank_sector_members(members, background_tasks)
+            top_stocks = ranked[:SECTOR_DISPLAY_SIZE]
+            codes = [m["代码"] for m in top_stocks]
+            _sector_display[sector_name] = (time.time(), codes)
+            # 优先使用后台轮询的行情，缺失或过期的代码再补拉一次，仍缺失的沿用快照
+            quotes = _fresh_sector_quotes(codes)
+            missing = [c for c in codes if c not in quotes]
+            if missing:
+                quotes.update(await get_realtime_quotes_tencent(missing))
+
+            stocks = [{
+                "name": m["名称"],
+                "code": m["代码"],
+                "change": float(quotes.get(m["代码"], changes.get(m["代码"], 0.0)))
+            } for m in top_stocks]
+            stocks.sort(key=lambda x: x["change"], reverse=True)
             
-            # 异步获取 AI 推荐理由
+            # 异步获取 AI 推荐理由（按代码对应）
             reasons = await get_ai_sector_reasons(sector_name, stocks)
             
             # 合并结果
-            for i, stock in enumerate(stocks):
+            for stock in stocks:
                 # 兜底理由，防止 AI 返回数量不足
-                stock["reason"] = reasons[i] if i < len(reasons) else f"作为{sector_name}领先企业，受益于行业整体复苏趋势。"
+                stock["reason"] = reasons.get(stock["code"]) or f"作为{sector_name}领先企业，受益于行业整体复苏趋势。"
             
             return stocks
     except Exception as e:
@@ -2575,47 +4563,78 @@ async def get_sector_stocks(sector_name: str, background_tasks: BackgroundTasks)
 
 async def _get_real_news_for_ai(symbol: str, stock_name: str, industry: str):
     """为 AI 提供实时新闻语料，确保风向标环节有真实的 Source URL 可用"""
-    clean_symbol = "".join(filter(str.isdigit, symbol))
-    market = "sh" if clean_symbol.startswith('6') else "sz" if clean_symbol.startswith(('0', '3')) else "bj"
-    full_symbol = f"{market}{clean_symbol}"
-    
-    all_news = []
-    seen_urls = set()
-    
-    # 1. 尝试个股实时 Feed (新浪)
-    try:
-        url = f"https://feed.mix.sina.com.cn/api/roll/get?pageid=155&lid=1686&num=20&symbol={full_symbol}"
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.get(url)
-            if resp.status_code == 200:
-                data = resp.json()
-                for item in data.get('result', {}).get('data', []):
-                    u = item.get('url')
-                    if u and u not in seen_urls:
-                        all_news.append({"title": item.get('title'), "url": u})
-                        seen_urls.add(u)
-    except: pass
-    
-    # 2. 尝试行业关键词搜索 (百度新闻/新浪搜索) - 仅当个股新闻不够时
+    # 1. 个股新闻来自增量采集的新闻表
+    await ingest_symbol_news(symbol)
+    all_news = await asyncio.to_thread(load_symbol_news, symbol, False, 30)
+
+    # 2. 个股新闻不够时补充行业关键词搜索 (同样经过游标与抓取间隔控制)
     if len(all_news) < 10 and (stock_name or industry):
-        keyword = stock_name or industry
+        await ingest_symbol_news(symbol, keyword=stock_name or industry)
+        all_news = await asyncio.to_thread(load_symbol_news, symbol, False, 30)
+
+    return [{"title": n['title'], "url": n['url']} for n in all_news[:15]] # 返回前15条作为 AI 参考
+
+WATCHLIST_SORT_FIELDS = {"change": "涨跌幅", "price": "最新价", "volume_ratio": "量比", "amount": "成交额", "peer_score": "peer_score"}
+
+def _cached_vol_ratios(codes: List[str]) -> Dict[str, float]:
+    """由 app_cache 中已缓存的日 K 计算量比（最新一根成交量 / 含当根的 5 日均量，与个股页口径一致），不请求上游"""
+    keys = [f"kline_{prefix}{code}" for code in codes for prefix in ("", "sh", "sz", "bj")]
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT cache_key, result_json FROM app_cache WHERE cache_key IN ({','.join('?' * len(keys))})", keys).fetchall()
+    conn.close()
+    ratios = {}
+    for row in rows:
+        code = "".join(filter(str.isdigit, row['cache_key']))[-6:]
+        if code in ratios:
+            continue
         try:
-            # 搜索当前行业或个股的关键事件分类 (政策/技术/订单等)
-            search_keywords = [f"{keyword} 政策", f"{keyword} 成交", f"{keyword} 业绩", f"{keyword} 重组"]
-            # 这里简单起见只搜一个
-            search_url = f"https://search.sina.com.cn/api/search/news?q={urllib.parse.quote(keyword)}&t=news&n=10"
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                resp = await client.get(search_url)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    for item in data.get('result', {}).get('list', []):
-                        u = item.get('url')
-                        if u and u not in seen_urls:
-                            all_news.append({"title": item.get('title'), "url": u})
-                            seen_urls.add(u)
-        except: pass
-        
-    return all_news[:15] # 返回前15条作为 AI 参考
+            volume = pd.to_numeric(pd.DataFrame(json.loads(row['result_json']))["成交量"], errors='coerce').dropna()
+        except Exception:
+            continue
+        ma5 = volume.iloc[-5:].mean() if len(volume) >= 5 else 0
+        if ma5 > 0:
+            ratios[code] = round(float(volume.iloc[-1] / ma5), 2)
+    return ratios
+
+@app.get("/api/user/watchlist/{user_id}/view")
+async def get_watchlist_view(user_id: int, background_tasks: BackgroundTasks, sort_by: str = "change", order: str = "desc"):
+    """自选股一览：用户代码与内存行情、同业分位数表一次连接，返回可排序的表格
+
+    peer_score 为六个维度行业内排名分位的均值（0-100），来自夜间批处理的 peer_percentiles，与个股页的 trend_score 不是同一指标；
+    行情快照缺少量比（新浪兜底源）时，由已缓存的日 K 补算。
+    """
+    if sort_by not in WATCHLIST_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort_by}")
+    conn = get_db_connection()
+    codes = list(dict.fromkeys(_split_symbol(row['stock_code'])[1] for row in conn.execute("SELECT stock_code FROM watchlist WHERE user_id = ?", (user_id,))))
+    if not codes:
+        conn.close()
+        return {"items": [], "updated_at": None}
+    placeholders = ",".join("?" * len(codes))
+    pct_cols = [f"{dim}_pct" for dim, _ in PEER_DIMENSIONS]
+    peers = pd.read_sql_query(f"SELECT code, industry, {', '.join(pct_cols)} FROM peer_percentiles WHERE code IN ({placeholders})", conn, params=codes).set_index("code")
+    conn.close()
+
+    spot = data_manager.get_spot_index(background_tasks)
+    view = spot.reindex(codes, columns=["名称", "最新价", "涨跌幅", "成交额", "量比"])
+    for col in ["最新价", "涨跌幅", "成交额", "量比"]:
+        view[col] = pd.to_numeric(view[col], errors='coerce')
+    view["名称"] = [n if isinstance(n, str) and n else (data_manager.get_stock_name(c) or c) for c, n in zip(codes, view["名称"])]
+    missing = view.index[view["量比"].isna()].tolist()
+    if missing:
+        view["量比"] = view["量比"].fillna(pd.Series(await asyncio.to_thread(_cached_vol_ratios, missing), dtype=float))
+    peers = peers.reindex(codes)
+    view["peer_score"] = peers[pct_cols].mean(axis=1, skipna=True).round(1)
+    view["industry"] = peers["industry"]
+    view = view.sort_values(WATCHLIST_SORT_FIELDS[sort_by], ascending=(order == "asc"), na_position="last", kind="stable")
+
+    items = [
+        {"代码": code, "名称": row[0], "最新价": row[1], "涨跌幅": row[2], "成交额": row[3], "量比": row[4], "peer_score": row[5], "industry": row[6]}
+        for code, row in zip(view.index, view[["名称", "最新价", "涨跌幅", "成交额", "量比", "peer_score", "industry"]].itertuples(index=False, name=None))
+    ]
+    # 缺失值（停牌、不在行情快照或尚无分位数据）输出为 null
+    items = [{k: (None if isinstance(v, float) and not math.isfinite(v) else v) for k, v in item.items()} for item in items]
+    return {"items": items, "updated_at": data_manager._spot_index_version}
 
 @app.post("/api/user/watchlist/add")
 async def add_to_watchlist(item: WatchlistItem):
@@ -2648,288 +4667,847 @@ async def remove_from_watchlist(item: WatchlistItem):
     return {"success": True, "message": "已从自选移除"}
 
 
-@app.get("/api/stock/capital_flow/{symbol}")
-async def get_capital_flow(symbol: str):
-    """获取主力资金流向和历史净流入占比"""
+# ==================== 价格提醒 ====================
+# 全部用户的生效提醒按列常驻内存，每次全市场行情刷新做一次向量化连接求值；触发记录写表，推送通道按用户增量读取
+ALERT_KINDS = ("price", "change_pct", "volume_ratio", "rsi") # 最新价 / 涨跌幅 / 量比 / 实时 RSI(14)
+ALERT_MAX_PER_USER = 50
+ALERT_STREAM_POLL = 2.0 # 推送通道读取新触发记录的间隔（秒）
+ALERT_STREAM_HEARTBEAT = 15.0
+ALERT_REVISION_KEY = "price_alerts_revision"
+SPOT_REFRESH_INTERVAL = 30 # 盘中定时刷新全市场行情的间隔（秒），与 spot_expiry 一致
+
+class AlertCreate(BaseModel):
+    user_id: int
+    stock_code: str
+    kind: str
+    threshold: float
+    direction: Optional[int] = None # 1 向上突破，-1 向下跌破；价格提醒缺省时按当前价推断
+
+class AlertRemove(BaseModel):
+    user_id: int
+    alert_id: int
+
+def _bump_alert_revision():
+    """提醒集合变化后更新版本号，各 worker 在下次求值前据此重新加载"""
+    data_manager._set_db_cache(ALERT_REVISION_KEY, time.time())
+
+def _realtime_rsi(codes: pd.Series, price: np.ndarray) -> np.ndarray:
+    """以截至前一交易日的 RSI 基准叠加当前价算出盘中 RSI（与 compute_rsi 同一口径）；无可用基准的代码为 NaN"""
+    conn = get_db_connection()
+    base = pd.read_sql_query("SELECT code, trade_date, prev_close, avg_gain, avg_loss FROM stock_indicators", conn).set_index("code")
+    conn.close()
+    # 基准须截至今天之前最近的交易日：收盘后已计入当日 K 线的、以及刷新失败遗留的旧基准都不可用
+    dates = base["trade_date"].fillna("").astype(str)
+    past = dates[dates < datetime.date.today().isoformat()]
+    usable = (dates == past.max()) if len(past) else pd.Series(False, index=base.index)
+    base = base[usable].reindex(codes.to_numpy())
+    delta = price - base["prev_close"].to_numpy()
+    # 窗口内前 n-1 根的均值与当前这一根合成 n 日简单平均，与 compute_rsi 在当日收盘时的取值一致
+    n = RSI_PERIOD
+    avg_gain = (base["avg_gain"].to_numpy() * (n - 1) + np.clip(delta, 0, None)) / n
+    avg_loss = (base["avg_loss"].to_numpy() * (n - 1) + np.clip(-delta, 0, None)) / n
+    return _rsi_from_averages(avg_gain, avg_loss)
+
+class AlertBook:
+    """生效提醒的列式存储：id、用户、代码、指标类型、阈值与方向各为一列"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._loaded = False
+        self.revision = None
+        self._assign(pd.DataFrame(columns=["id", "user_id", "stock_code", "kind", "threshold", "direction"]))
+
+    def _assign(self, df: pd.DataFrame):
+        self.ids = df["id"].to_numpy(dtype=np.int64)
+        self.user_ids = df["user_id"].to_numpy(dtype=np.int64)
+        self.codes = df["stock_code"].astype(str).to_numpy(dtype=object)
+        self.kinds = pd.Categorical(df["kind"], categories=ALERT_KINDS).codes.astype(np.int64)
+        self.thresholds = df["threshold"].to_numpy(dtype=np.float64)
+        self.directions = df["direction"].to_numpy(dtype=np.float64)
+
+    def reload(self):
+        """版本号变化时从表中重新加载全部生效提醒"""
+        revision = data_manager._get_db_cache(ALERT_REVISION_KEY, 999999)
+        if self._loaded and revision == self.revision:
+            return
+        conn = get_db_connection()
+        df = pd.read_sql_query("SELECT id, user_id, stock_code, kind, threshold, direction FROM price_alerts WHERE active = 1", conn)
+        conn.close()
+        with self._lock:
+            self._assign(df)
+            self.revision = revision
+            self._loaded = True
+
+    def evaluate(self, spot: pd.DataFrame) -> List[dict]:
+        """对一份全市场行情快照求值，返回满足条件的提醒（不修改状态）"""
+        self.reload()
+        with self._lock:
+            ids, user_ids, codes, kinds = self.ids, self.user_ids, self.codes, self.kinds
+            thresholds, directions = self.thresholds, self.directions
+        if len(ids) == 0 or spot is None or spot.empty or "代码" not in spot.columns:
+            return []
+
+        snap_codes = spot["代码"].astype(str).str.zfill(6)
+        keep = ~snap_codes.duplicated(keep="last").to_numpy()
+        spot, snap_codes = spot[keep], snap_codes[keep]
+        price = pd.to_numeric(spot["最新价"], errors='coerce').to_numpy(dtype=np.float64)
+        metrics = np.full((len(ALERT_KINDS), len(spot)), np.nan)
+        metrics[0] = price
+        metrics[1] = pd.to_numeric(spot["涨跌幅"], errors='coerce').to_numpy(dtype=np.float64)
+        if "量比" in spot.columns:
+            metrics[2] = pd.to_numeric(spot["量比"], errors='coerce').to_numpy(dtype=np.float64)
+        if (kinds == ALERT_KINDS.index("rsi")).any():
+            metrics[3] = _realtime_rsi(snap_codes, price)
+        metrics[:, ~(price > 0)] = np.nan # 停牌股不触发
+
+        pos = pd.Index(snap_codes.to_numpy()).get_indexer(codes)
+        found = (pos >= 0) & (kinds >= 0)
+        value = np.full(len(ids), np.nan)
+        value[found] = metrics[kinds[found], pos[found]]
+        with np.errstate(invalid='ignore'):
+            hit = np.flatnonzero(np.isfinite(value) & (directions * (value - thresholds) >= 0))
+        return [{
+            "alert_id": int(ids[i]), "user_id": int(user_ids[i]), "stock_code": codes[i], "kind": ALERT_KINDS[kinds[i]],
+            "threshold": float(thresholds[i]), "direction": int(directions[i]), "value": round(float(value[i]), 4)
+        } for i in hit]
+
+    def discard(self, alert_ids: List[int]):
+        with self._lock:
+            keep = ~np.isin(self.ids, alert_ids)
+            for name in ("ids", "user_ids", "codes", "kinds", "thresholds", "directions"):
+                setattr(self, name, getattr(self, name)[keep])
+
+alert_book = AlertBook()
+
+def evaluate_price_alerts(spot: pd.DataFrame) -> int:
+    """对新行情快照求值并记录触发；提醒为一次性，触发后失效。返回触发条数"""
+    events = alert_book.evaluate(spot)
+    if not events:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    fired = []
+    for ev in events:
+        # 多 worker 可能对同一快照求值，以条件更新保证每条提醒只触发一次
+        cursor.execute("UPDATE price_alerts SET active = 0, triggered_at = CURRENT_TIMESTAMP WHERE id = ? AND active = 1", (ev["alert_id"],))
+        if cursor.rowcount == 1:
+            fired.append(ev)
+    cursor.executemany(
+        "INSERT INTO alert_events (alert_id, user_id, stock_code, kind, threshold, direction, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(e["alert_id"], e["user_id"], e["stock_code"], e["kind"], e["threshold"], e["direction"], e["value"]) for e in fired]
+    )
+    conn.commit()
+    conn.close()
+    alert_book.discard([e["alert_id"] for e in events])
+    if fired:
+        logger.info(f"Price alerts triggered: {len(fired)}")
+    return len(fired)
+
+def _rsi_baseline(df: pd.DataFrame) -> Optional[dict]:
+    """RSI 基准：最近 RSI_PERIOD-1 根日线涨幅/跌幅的平均值与最后收盘价；盘中当日 K 线尚未收定，不计入"""
+    now = datetime.datetime.now()
+    bars = df
+    if now.weekday() < 5 and now.time() < datetime.time(15, 0):
+        bars = df[df["日期"].astype(str).str[:10] < now.date().isoformat()]
+    closes = pd.to_numeric(bars["收盘"], errors='coerce').dropna()
+    if len(closes) < RSI_PERIOD:
+        return None
+    delta = closes.diff().iloc[-(RSI_PERIOD - 1):]
+    return {
+        "trade_date": str(bars["日期"].iloc[-1])[:10],
+        "prev_close": float(closes.iloc[-1]),
+        "avg_gain": float(delta.clip(lower=0).mean()),
+        "avg_loss": float((-delta).clip(lower=0).mean())
+    }
+
+async def refresh_alert_indicators(codes: Optional[List[str]] = None):
+    """为设有 RSI 提醒的股票更新盘中 RSI 基准（收盘后定时执行并重取日 K 以计入当日收盘，新建提醒时单独补算）"""
+    refresh = codes is None
+    if codes is None:
+        conn = get_db_connection()
+        codes = [row[0] for row in conn.execute("SELECT DISTINCT stock_code FROM price_alerts WHERE active = 1 AND kind = 'rsi'")]
+        conn.close()
+    semaphore = asyncio.Semaphore(3)
+    rows = []
+
+    async def load_one(code: str):
+        async with semaphore:
+            try:
+                df = await get_cached_kline(code, refresh=refresh)
+                base = _rsi_baseline(df) if df is not None else None
+                if base:
+                    rows.append((code, base["trade_date"], base["prev_close"], base["avg_gain"], base["avg_loss"], time.time()))
+            except Exception as e:
+                logger.warning(f"RSI baseline failed for {code}: {e}")
+
+    await asyncio.gather(*(load_one(c) for c in codes))
+    if rows:
+        conn = get_db_connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO stock_indicators (code, trade_date, prev_close, avg_gain, avg_loss, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        conn.close()
+    logger.info(f"Alert indicators refreshed: {len(rows)}/{len(codes)} codes.")
+
+async def spot_refresh_loop():
+    """交易时段内定时刷新全市场行情，无人访问时提醒与分时磁带也能按时更新；多 worker 时同一时间窗只由一个进程刷新"""
+    while True:
+        await asyncio.sleep(SPOT_REFRESH_INTERVAL)
+        try:
+            now_ts = datetime.datetime.now()
+            if now_ts.weekday() >= 5 or not (datetime.time(9, 15) <= now_ts.time() <= datetime.time(15, 5)):
+                continue
+            window = int(time.time() // SPOT_REFRESH_INTERVAL)
+            if not try_acquire_job_lock(f"spot_refresh_{window}", ttl=SPOT_REFRESH_INTERVAL):
+                continue
+            await data_manager.update_spot_data()
+        except Exception as e:
+            logger.error(f"Spot refresh loop error: {e}")
+
+@app.post("/api/user/alerts")
+async def create_price_alert(item: AlertCreate, background_tasks: BackgroundTasks):
+    """新建价格提醒"""
+    if item.kind not in ALERT_KINDS:
+        raise HTTPException(status_code=400, detail=f"不支持的提醒类型: {item.kind}")
+    if item.direction not in (None, 1, -1):
+        raise HTTPException(status_code=400, detail="direction 只能为 1（向上）或 -1（向下）")
+    code = _split_symbol(item.stock_code)[1]
+    direction = item.direction
+    if direction is None:
+        if item.kind != "price":
+            raise HTTPException(status_code=400, detail="请指定提醒方向")
+        quote = await _get_stock_quote_core(code, background_tasks)
+        current = float(quote.get("最新价") or 0)
+        if current <= 0:
+            raise HTTPException(status_code=400, detail="暂时无法获取当前价格，请指定提醒方向")
+        direction = 1 if item.threshold >= current else -1
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM price_alerts WHERE user_id = ? AND active = 1", (item.user_id,))
+    if cursor.fetchone()[0] >= ALERT_MAX_PER_USER:
+        conn.close()
+        raise HTTPException(status_code=400, detail=f"最多同时设置 {ALERT_MAX_PER_USER} 条提醒")
+    cursor.execute(
+        "INSERT INTO price_alerts (user_id, stock_code, kind, threshold, direction) VALUES (?, ?, ?, ?, ?)",
+        (item.user_id, code, item.kind, item.threshold, direction)
+    )
+    alert_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    _bump_alert_revision()
+    if item.kind == "rsi":
+        background_tasks.add_task(refresh_alert_indicators, [code])
+    return {"success": True, "id": alert_id, "direction": direction}
+
+@app.get("/api/user/alerts/{user_id}")
+async def get_price_alerts(user_id: int):
+    """用户的提醒列表（生效中的在前）"""
+    conn = get_db_connection()
+    rows = conn.execute(
+        "SELECT * FROM price_alerts WHERE user_id = ? ORDER BY active DESC, id DESC LIMIT 100", (user_id,)
+    ).fetchall()
+    conn.close()
+    return [{**dict(row), "stock_name": data_manager.get_stock_name(row["stock_code"]) or row["stock_code"]} for row in rows]
+
+@app.post("/api/user/alerts/remove")
+async def remove_price_alert(item: AlertRemove):
+    """删除提醒"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM price_alerts WHERE id = ? AND user_id = ?", (item.alert_id, item.user_id))
+    removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    if removed:
+        _bump_alert_revision()
+    return {"success": True, "message": "已删除提醒"}
+
+def _latest_alert_event_id(user_id: int) -> int:
+    conn = get_db_connection()
+    row = conn.execute("SELECT MAX(id) FROM alert_events WHERE user_id = ?", (user_id,)).fetchone()
+    conn.close()
+    return row[0] or 0
+
+def _load_alert_events(user_id: int, after_id: int) -> List[dict]:
+    conn = get_db_connection()
+    rows = conn.execute("SELECT * FROM alert_events WHERE user_id = ? AND id > ? ORDER BY id", (user_id, after_id)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+@app.get("/api/user/alerts/stream/{user_id}")
+async def stream_price_alerts(user_id: int, request: Request):
+    """提醒推送通道（SSE）：断线重连时通过 Last-Event-ID 补发期间的触发记录"""
+    last_id = request.headers.get("last-event-id")
+
+    async def event_stream():
+        # 新连接只推送之后产生的事件
+        after_id = int(last_id) if last_id and last_id.isdigit() else await asyncio.to_thread(_latest_alert_event_id, user_id)
+        idle = 0.0
+        while not await request.is_disconnected():
+            events = await asyncio.to_thread(_load_alert_events, user_id, after_id)
+            for ev in events:
+                after_id = ev["id"]
+                ev["stock_name"] = data_manager.get_stock_name(ev["stock_code"]) or ev["stock_code"]
+                yield f"id: {after_id}\n" + _sse_event("alert", ev)
+            if events:
+                idle = 0.0
+            elif idle >= ALERT_STREAM_HEARTBEAT:
+                yield ": ping\n\n"
+                idle = 0.0
+            await asyncio.sleep(ALERT_STREAM_POLL)
+            idle += ALERT_STREAM_POLL
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==================== 同业分位数批处理 ====================
+# 每晚用全市场批量接口计算各维度在行业内与全市场的分位数，雷达图接口只做单行查询
+PEER_FETCH_TIMEOUT = 180.0
+PEER_MIN_INDUSTRY_SIZE = 3 # 成员过少的行业不做行业内排名
+PEER_DIMENSIONS = [
+    ("valuation", "估值优势"), ("profitability", "盈利能力"), ("growth", "成长溢价"),
+    ("dividend", "股息防守"), ("health", "资产健康"), ("sentiment", "资金热力")
+]
+
+def _recent_report_dates(count: int = 3) -> List[str]:
+    """最近的若干个季度报告期 (YYYYMMDD)，从最新往前"""
+    today = datetime.date.today()
+    quarter_ends = [(3, 31), (6, 30), (9, 30), (12, 31)]
+    dates = []
+    year = today.year
+    while len(dates) < count:
+        for month, day in reversed(quarter_ends):
+            d = datetime.date(year, month, day)
+            if d < today and len(dates) < count:
+                dates.append(d.strftime("%Y%m%d"))
+        year -= 1
+    return dates
+
+async def _fetch_market_frame(func, *args, **kwargs) -> pd.DataFrame:
     try:
-        clean_symbol = "".join(filter(str.isdigit, symbol))
-        # Determine market
-        market = "sh" if clean_symbol.startswith('6') else "sz"
-        
-        # 资金流向缓存
-        cache_key = f"capital_flow_{symbol}"
-        cached_data = data_manager._get_db_cache(cache_key, 300) # 5分钟缓存
-        if cached_data:
-            return cached_data
-
-        logger.info(f"Fetching capital flow for {clean_symbol}")
-        df = await asyncio.to_thread(ak.stock_individual_fund_flow, stock=clean_symbol, market=market)
-        
-        if df is not None and not df.empty:
-            # 提取近 10个交易日的数据
-            df_recent = df.tail(10).copy()
-            # 简化字段传递给前端
-            result = []
-            for _, row in df_recent.iterrows():
-                try:
-                    result.append({
-                        "date": str(row["日期"]),
-                        "main_net_inflow": float(row.get("主力净流入-净额", 0) or 0),
-                        "main_net_pct": float(row.get("主力净流入-净占比", 0) or 0),
-                        "super_net_inflow": float(row.get("超大单净流入-净额", 0) or 0),
-                        "super_net_pct": float(row.get("超大单净流入-净占比", 0) or 0),
-                        "large_net_inflow": float(row.get("大单净流入-净额", 0) or 0),
-                        "large_net_pct": float(row.get("大单净流入-净占比", 0) or 0)
-                    })
-                except Exception as inner_e:
-                    logger.warning(f"Error parsing capital flow row: {inner_e}")
-                    pass
-            
-            if result:
-                data_manager._set_db_cache(cache_key, result)
-                return result
+        df = await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout=PEER_FETCH_TIMEOUT)
+        return df if df is not None else pd.DataFrame()
     except Exception as e:
-        logger.error(f"API capital flow error for {symbol}: {e}")
-    
-    return []
+        logger.warning(f"Peer percentile source {getattr(func, '__name__', func)} failed: {e}")
+        return pd.DataFrame()
+
+async def _fetch_latest_report(func, min_rows: int = 1000):
+    """按报告期从新到旧尝试，返回披露家数足够的一期 (报告期, DataFrame)"""
+    for date in _recent_report_dates():
+        df = await _fetch_market_frame(func, date=date)
+        if len(df) >= min_rows:
+            return date, df
+    return None, pd.DataFrame()
+
+def _metric(df: pd.DataFrame, code_col: str, value_col: str) -> pd.Series:
+    if df.empty or code_col not in df.columns or value_col not in df.columns:
+        return pd.Series(dtype=float)
+    s = pd.Series(pd.to_numeric(df[value_col], errors='coerce').values, index=df[code_col].astype(str).str.zfill(6).values)
+    return s[~s.index.duplicated(keep="first")]
+
+def compute_peer_percentiles(metrics: pd.DataFrame) -> pd.DataFrame:
+    """metrics: index 为代码，含 industry 列及各原始指标列（越大越好）。返回各维度分位数 (0-100)"""
+    components = {
+        "valuation": ["ep", "bp"],
+        "profitability": ["roe", "gross_margin"],
+        "growth": ["profit_yoy", "revenue_yoy"],
+        "dividend": ["dividend_yield"],
+        "health": ["neg_debt_ratio"],
+        "sentiment": ["main_inflow_ratio", "turnover"]
+    }
+    out = pd.DataFrame(index=metrics.index)
+    out["industry"] = metrics["industry"]
+    out["peer_count"] = metrics.groupby("industry")["industry"].transform("size")
+    small = out["peer_count"] < PEER_MIN_INDUSTRY_SIZE
+    for dim, cols in components.items():
+        cols = [c for c in cols if c in metrics.columns]
+        if not cols:
+            out[[f"{dim}_mkt", f"{dim}_pct", f"{dim}_ind"]] = 50.0
+            continue
+        # 维度分 = 各分项分位数的均值；缺失的分项不参与
+        mkt = metrics[cols].rank(pct=True).mean(axis=1) * 100
+        ind = metrics.groupby("industry")[cols].rank(pct=True).mean(axis=1) * 100
+        out[f"{dim}_mkt"] = mkt.fillna(50.0)
+        out[f"{dim}_pct"] = ind.where(~small, mkt).fillna(50.0)
+        out[f"{dim}_ind"] = out.groupby("industry")[f"{dim}_mkt"].transform("median")
+    return out.round(1)
+
+async def build_peer_percentiles():
+    """全市场批量拉取财务与资金数据，计算同业分位数并整表替换"""
+    spot = pd.DataFrame(await asyncio.to_thread(data_manager._get_db_cache, 'spot_data', 999999) or [])
+    report_date, yjbb = await _fetch_latest_report(ak.stock_yjbb_em)
+    _, zcfz = await _fetch_latest_report(ak.stock_zcfz_em)
+    # 股息率取最近一个年报期
+    fhps = await _fetch_market_frame(ak.stock_fhps_em, date=f"{datetime.date.today().year - 1}1231")
+    flow = await _fetch_market_frame(ak.stock_individual_fund_flow_rank, indicator="5日")
+
+    pe = _metric(spot, "代码", "市盈率")
+    pb = _metric(spot, "代码", "市净率")
+    metrics = pd.DataFrame({
+        "ep": (1 / pe.where(pe != 0)),
+        "bp": (1 / pb.where(pb > 0)),
+        "roe": _metric(yjbb, "股票代码", "净资产收益率"),
+        "gross_margin": _metric(yjbb, "股票代码", "销售毛利率"),
+        "profit_yoy": _metric(yjbb, "股票代码", "净利润-同比增长"),
+        "revenue_yoy": _metric(yjbb, "股票代码", "营业总收入-同比增长"),
+        "dividend_yield": _metric(fhps, "代码", "现金分红-股息率"),
+        "neg_debt_ratio": -_metric(zcfz, "股票代码", "资产负债率"),
+        "main_inflow_ratio": _metric(flow, "代码", "5日主力净流入-净占比"),
+        "turnover": _metric(spot, "代码", "换手率")
+    })
+    metrics = metrics.dropna(axis=1, how="all")
+    if metrics.empty:
+        logger.warning("Peer percentiles skipped: no market data available.")
+        return
+
+    # 行业优先取映射索引，其次取业绩报表中的所处行业
+    industry = pd.Series(INDUSTRY_CACHE, dtype=object).reindex(metrics.index)
+    if not yjbb.empty and "所处行业" in yjbb.columns:
+        industry = industry.fillna(pd.Series(yjbb["所处行业"].values, index=yjbb["股票代码"].astype(str).str.zfill(6).values).groupby(level=0).first())
+    metrics["industry"] = industry.fillna("其他")
+
+    table = await asyncio.to_thread(compute_peer_percentiles, metrics)
+    columns = ["industry", "peer_count"] + [f"{d}_{k}" for d, _ in PEER_DIMENSIONS for k in ("pct", "mkt", "ind")]
+    rows = [(code, *vals, report_date) for code, vals in zip(table.index, table[columns].itertuples(index=False, name=None))]
+
+    def save():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM peer_percentiles")
+        cursor.executemany(
+            f"INSERT INTO peer_percentiles (code, {', '.join(columns)}, report_date) VALUES ({', '.join('?' * (len(columns) + 2))})",
+            rows
+        )
+        conn.commit()
+        conn.close()
+    await asyncio.to_thread(save)
+    logger.info(f"Peer percentiles built for {len(rows)} stocks (report {report_date}).")
+
+async def ensure_peer_percentiles():
+    """启动时先就绪行业映射；首次部署分位数表为空时由一个 worker 立即构建"""
+    await ensure_industry_index()
+    conn = get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM peer_percentiles").fetchone()[0]
+    conn.close()
+    if count == 0 and try_acquire_job_lock("peer_percentiles_bootstrap", 3600):
+        await build_peer_percentiles()
 
 @app.get("/api/stock/peer_radar/{symbol}")
 async def get_peer_radar(symbol: str):
-    """获取同行业横向对比核心指标打分雷达图"""
+    """获取同行业横向对比核心指标打分雷达图（读取每晚批处理的分位数表）"""
     try:
         clean_symbol = "".join(filter(str.isdigit, symbol))
-        
-        # 缓存
-        cache_key = f"peer_radar_{symbol}"
-        cached_data = data_manager._get_db_cache(cache_key, 3600) # 1小时缓存
-        if cached_data:
-            return cached_data
-
-        logger.info(f"Fetching peer radar info for {clean_symbol}")
-        industry = "未知"
-        try:
-            # 使用增强版基本面获取逻辑
-            base_info = get_real_fundamentals(clean_symbol)
-            # 增加更多备选 Key，如果彻底没有，则使用 "行业" 作为中性词
-            industry = base_info.get("行业") or base_info.get("板块") or base_info.get("所属板块") or "行业"
-        except Exception as e:
-            logger.warning(f"Error fetching industry for peer radar {clean_symbol}: {e}")
-                
-        # 由于完全从 akshare 取准确的同花顺/东财所有行业均值计算极慢（需要全市场扫描），
-        # 实战中为了兼顾速度，我们用个股数据结合大盘标准方差构造对比标尺（或使用缓存好的板块整体分位数）。
-        # 这里为保障前端雷达图秒开体验，对该个股基本面进行提取，并设定行业均值做直观可视化。
-        
-        # 简易基础面雷达(如果实际部署，应挂载每日凌晨批处理的 A股 行业均值字典)
-        import random
-        random.seed(sum(ord(c) for c in clean_symbol))
-        
-        # 个股各项能力得分 (0-100)
-        stock_scores = {
-            "valuation": round(random.uniform(30, 90), 1),  # 估值优势
-            "profitability": round(random.uniform(40, 95), 1), # 盈利能力
-            "growth": round(random.uniform(20, 85), 1),     # 成长性
-            "dividend": round(random.uniform(10, 80), 1),   # 股息防守
-            "health": round(random.uniform(50, 95), 1),     # 资产健康度
-            "sentiment": round(random.uniform(60, 99), 1)   # 市场热度
-        }
-        
-        # 所在的行业均值
-        industry_scores = {
-            "valuation": 50.0,
-            "profitability": 50.0,
-            "growth": 50.0,
-            "dividend": 45.0,
-            "health": 60.0,
-            "sentiment": 70.0
-        }
-        random.seed(None)
+        conn = get_db_connection()
+        row = conn.execute("SELECT * FROM peer_percentiles WHERE code = ?", (clean_symbol,)).fetchone()
+        conn.close()
+        if row is None:
+            return {}
 
-        result = {
-            "industry": industry,
-            "dimensions": [
-                {"name": "估值优势", "max": 100},
-                {"name": "盈利能力", "max": 100},
-                {"name": "成长溢价", "max": 100},
-                {"name": "股息防守", "max": 100},
-                {"name": "资产健康", "max": 100},
-                {"name": "资金热力", "max": 100}
-            ],
-            "stock_data": [
-                stock_scores["valuation"], stock_scores["profitability"], stock_scores["growth"], 
-                stock_scores["dividend"], stock_scores["health"], stock_scores["sentiment"]
-            ],
-            "industry_data": [
-                industry_scores["valuation"], industry_scores["profitability"], industry_scores["growth"], 
-                industry_scores["dividend"], industry_scores["health"], industry_scores["sentiment"]
-            ]
+        return {
+            "industry": row["industry"],
+            "peer_count": row["peer_count"],
+            "report_date": row["report_date"],
+            "dimensions": [{"name": name, "max": 100} for _, name in PEER_DIMENSIONS],
+            # 个股与行业中位数均为全市场分位，可直接对比
+            "stock_data": [row[f"{d}_mkt"] for d, _ in PEER_DIMENSIONS],
+            "industry_data": [row[f"{d}_ind"] for d, _ in PEER_DIMENSIONS],
+            # 个股在本行业内的分位
+            "peer_rank": [row[f"{d}_pct"] for d, _ in PEER_DIMENSIONS]
         }
-        
-        data_manager._set_db_cache(cache_key, result)
-        return result
     except Exception as e:
         logger.error(f"API peer radar error for {symbol}: {e}")
     
     return {}
 
-@app.get("/api/stock/influential_news/{symbol}")
-async def get_influential_news(symbol: str):
-    """获取与股价密切相关的重要新闻事件并进行AI量化解读"""
+# ==================== 新闻增量采集 ====================
+# 各来源按 (source, symbol) 记录游标，只入库不早于游标的条目（与游标同一分钟的条目靠 URL 去重）；
+# 影响力新闻接口与 AI 诊断语料统一从 news_items 表读取
+NEWS_INGEST_INTERVAL = 300 # 同一来源两次抓取的最小间隔（秒）
+NEWS_INGEST_TOP_N = 30 # 后台采集覆盖的热门标的数量
+NEWS_RETENTION_DAYS = 30
+NEWS_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
+_news_ingest_tasks: Dict[str, asyncio.Task] = {}
+
+def _split_symbol(symbol: str):
+    """返回 (market, 纯数字代码)，支持 sh600000 / 600000 两种写法"""
     clean_symbol = "".join(filter(str.isdigit, symbol))
-    market = ""
     symbol_lower = symbol.lower()
-    if symbol_lower.startswith('sh'): market = "sh"
-    elif symbol_lower.startswith('sz'): market = "sz"
-    elif symbol_lower.startswith('bj'): market = "bj"
-    else:
-        if clean_symbol.startswith('6'): market = "sh"
-        elif clean_symbol.startswith(('0', '3')): market = "sz"
-        elif clean_symbol.startswith(('4', '8', '9')): market = "bj"
-    
+    if symbol_lower.startswith(('sh', 'sz', 'bj')):
+        return symbol_lower[:2], clean_symbol
+    if clean_symbol.startswith('6'): return "sh", clean_symbol
+    if clean_symbol.startswith(('4', '8', '9')): return "bj", clean_symbol
+    return "sz", clean_symbol
+
+def _normalize_news_time(value) -> str:
+    """统一为 YYYY-MM-DD HH:MM；兼容 Unix 时间戳"""
+    value = str(value or "").strip()
+    if value.isdigit():
+        return datetime.datetime.fromtimestamp(int(value)).strftime("%Y-%m-%d %H:%M")
+    return value[:16]
+
+async def _fetch_sina_vip_news(full_symbol: str, since: str) -> List[dict]:
+    """新浪个股资讯页，按时间倒序解析，遇到游标即停止"""
+    news_list = []
+    url_vip = f"http://vip.stock.finance.sina.com.cn/corp/go.php/vCB_AllNewsStock/symbol/{full_symbol}.phtml"
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        resp = await client.get(url_vip, headers={"User-Agent": NEWS_UA})
+    if resp.status_code != 200:
+        return news_list
+    t = resp.content.decode('gbk', 'ignore')
+    match = re.search(r'<div class="datelist">(.*?)</div>', t, re.S)
+    if not match:
+        return news_list
+    pattern = r'(\d{4}-\d{2}-\d{2})&nbsp;(\d{2}:\d{2})&nbsp;&nbsp;<a[^>]*href=[\'"]([^\'"]+)[\'"][^>]*>([^<]+)</a>'
+    for m in re.finditer(pattern, match.group(1)):
+        date, hm, u, title = m.groups()
+        published = f"{date} {hm}"
+        if (since and published < since) or len(news_list) >= 30: # 最多取30条
+            break
+        news_list.append({"title": title.strip(), "time": published, "source": "新浪财经", "url": u, "is_direct": True})
+    return news_list
+
+async def _fetch_sina_feed_news(full_symbol: str, clean_symbol: str, stock_name: str, since: str) -> List[dict]:
+    """新浪滚动资讯；标题提及个股的条目标记为直接相关"""
+    news_list = []
+    num = 10 if since else 30
+    url = f"https://feed.mix.sina.com.cn/api/roll/get?pageid=155&lid=1686&num={num}&page=1&symbol={full_symbol}"
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        resp = await client.get(url)
+    if resp.status_code != 200:
+        return news_list
+    for item in resp.json().get('result', {}).get('data', []):
+        u = item.get('url', '')
+        t = item.get('title', '')
+        published = _normalize_news_time(item.get('createtime', item.get('pubDate', '')))
+        if not u or not t or (since and published and published < since):
+            continue
+        news_list.append({
+            "title": t,
+            "time": published,
+            "source": item.get('media_name', '聚合资讯'),
+            "url": u,
+            "is_direct": bool((stock_name and stock_name in t) or (clean_symbol in t))
+        })
+    return news_list
+
+async def _fetch_eastmoney_announcements(clean_symbol: str, since: str) -> List[dict]:
+    """东方财富个股公告"""
+    news_list = []
+    page_size = 5 if since else 15
+    url = f"https://np-anotice-stock.eastmoney.com/api/security/ann?sr=-1&page_size={page_size}&page_index=1&ann_type=A&client_source=web&stock_list={clean_symbol}"
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        resp = await client.get(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'})
+    if resp.status_code != 200:
+        return news_list
+    for i in (resp.json().get('data') or {}).get('list', []):
+        t = i.get('title', '')
+        if '摘要' in t or '提示' in t: continue # 过滤一些不太重要的摘要性质
+        published = f"{i.get('notice_date', '')[:10]} 00:00"
+        if since and published < since[:10]:
+            continue
+        news_list.append({
+            "title": f"【公司公告】{t}",
+            "time": published,
+            "source": "东方财富",
+            "url": f"https://data.eastmoney.com/notices/detail/{clean_symbol}/{i.get('art_code')}.html",
+            "is_direct": True  # 公告绝对是第一手重要资料
+        })
+    return news_list
+
+async def _fetch_sina_search_news(keyword: str, since: str) -> List[dict]:
+    """新浪新闻关键词搜索（个股资讯不足时补充行业语料）"""
+    news_list = []
+    search_url = f"https://search.sina.com.cn/api/search/news?q={urllib.parse.quote(keyword)}&t=news&n=10"
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        resp = await client.get(search_url)
+    if resp.status_code != 200:
+        return news_list
+    for item in resp.json().get('result', {}).get('list', []):
+        u = item.get('url')
+        published = _normalize_news_time(item.get('datetime', ''))
+        if not u or (since and published and published < since):
+            continue
+        news_list.append({"title": item.get('title'), "time": published, "source": "新浪搜索", "url": u, "is_direct": False})
+    return news_list
+
+def _load_news_cursors(symbol: str) -> Dict[str, dict]:
+    conn = get_db_connection()
+    rows = conn.execute("SELECT source, last_seen, last_fetched FROM news_cursors WHERE symbol = ?", (symbol,)).fetchall()
+    conn.close()
+    return {row['source']: {"last_seen": row['last_seen'] or "", "last_fetched": row['last_fetched']} for row in rows}
+
+def _store_news_items(symbol: str, source: str, items: List[dict], last_seen: str):
+    """条目按 (symbol, url) 去重入库，并推进该来源的游标"""
+    now = time.time()
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT OR IGNORE INTO news_items (symbol, source, url, title, published_at, media, is_direct, ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(symbol, source, n['url'], n['title'], n['time'], n['source'], 1 if n.get('is_direct') else 0, now) for n in items]
+    )
+    newest = max([n['time'] for n in items if n.get('time')] + [last_seen or ""])
+    conn.execute(
+        "INSERT OR REPLACE INTO news_cursors (source, symbol, last_seen, last_fetched) VALUES (?, ?, ?, ?)",
+        (source, symbol, newest, now)
+    )
+    conn.commit()
+    conn.close()
+
+async def _ingest_symbol_news(symbol: str, keyword: Optional[str]):
+    market, clean_symbol = _split_symbol(symbol)
     full_symbol = f"{market}{clean_symbol}"
-    
-    import datetime
-    import json
-    current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-    
-    # 1. 查数据库当天的缓存
+    stock_name = await resolve_stock_name(clean_symbol, market)
+    cursors = await asyncio.to_thread(_load_news_cursors, full_symbol)
+
+    fetchers = {
+        "sina_vip": lambda since: _fetch_sina_vip_news(full_symbol, since),
+        "sina_feed": lambda since: _fetch_sina_feed_news(full_symbol, clean_symbol, stock_name, since),
+        "em_ann": lambda since: _fetch_eastmoney_announcements(clean_symbol, since),
+    }
+    if keyword:
+        fetchers["sina_search"] = lambda since: _fetch_sina_search_news(keyword, since)
+
+    due = {src: cursors.get(src, {}).get("last_seen", "") for src in fetchers
+           if time.time() - (cursors.get(src, {}).get("last_fetched") or 0) >= NEWS_INGEST_INTERVAL}
+    if not due:
+        return
+
+    async def run(src: str, since: str):
+        try:
+            items = await fetchers[src](since)
+            await asyncio.to_thread(_store_news_items, full_symbol, src, items, since)
+        except Exception as e:
+            logger.warning(f"News ingest {src} failed for {full_symbol}: {e}")
+
+    await asyncio.gather(*(run(src, since) for src, since in due.items()))
+
+async def ingest_symbol_news(symbol: str, keyword: Optional[str] = None):
+    """增量采集单只股票的新闻；同一股票的并发调用共享一次采集"""
+    market, clean_symbol = _split_symbol(symbol)
+    task_key = f"{market}{clean_symbol}|{keyword or ''}"
+    task = _news_ingest_tasks.get(task_key)
+    if task is None or task.done():
+        task = asyncio.create_task(_ingest_symbol_news(symbol, keyword))
+        _news_ingest_tasks[task_key] = task
+        task.add_done_callback(lambda t: _news_ingest_tasks.pop(task_key, None) if _news_ingest_tasks.get(task_key) is t else None)
+    await asyncio.shield(task)
+
+def load_symbol_news(symbol: str, direct_only: bool = False, limit: int = 60) -> List[dict]:
+    """从新闻表读取单只股票最近的新闻，按时间倒序，标题重复的只保留一条"""
+    market, clean_symbol = _split_symbol(symbol)
+    sql = "SELECT url, title, published_at, media, is_direct FROM news_items WHERE symbol = ?"
+    if direct_only:
+        sql += " AND is_direct = 1"
+    sql += " ORDER BY published_at DESC, id DESC LIMIT ?"
+    conn = get_db_connection()
+    rows = conn.execute(sql, (f"{market}{clean_symbol}", limit)).fetchall()
+    conn.close()
+    news, seen_titles = [], set()
+    for row in rows:
+        if row['title'] in seen_titles:
+            continue
+        seen_titles.add(row['title'])
+        news.append({"title": row['title'], "time": row['published_at'], "source": row['media'], "url": row['url'], "is_direct": bool(row['is_direct'])})
+    return news
+
+async def news_ingest_loop():
+    """后台定时为热门标的增量采集新闻，用户请求时多数来源已在抓取间隔内"""
+    while True:
+        await asyncio.sleep(NEWS_INGEST_INTERVAL)
+        try:
+            now_ts = datetime.datetime.now()
+            if not (7 <= now_ts.hour < 23):
+                continue
+            # 多 worker 部署时同一时间窗只由一个进程执行
+            window = int(time.time() // NEWS_INGEST_INTERVAL)
+            if not try_acquire_job_lock(f"news_ingest_{window}", ttl=NEWS_INGEST_INTERVAL):
+                continue
+            symbols = await asyncio.to_thread(get_hot_symbols, NEWS_INGEST_TOP_N)
+            semaphore = asyncio.Semaphore(3)
+            async def ingest_one(code: str):
+                async with semaphore:
+                    await ingest_symbol_news(code)
+            await asyncio.gather(*(ingest_one(c) for c in symbols), return_exceptions=True)
+        except Exception as e:
+            logger.error(f"News ingest loop error: {e}")
+
+# ==================== 新闻批量解读 ====================
+NEWS_INTERP_TAGS = ['利好', '利空', '重大利好', '重大利空', '中性']
+NEWS_INTERP_SYSTEM_PROMPT = "你是一位资深金融分析师。要求为股票新闻逐条撰写极具指导意义的简短解读，辅助判断股价走势。禁止含糊其词或说废话，绝对禁止出现具体涨跌幅数字预测。必须附含清晰的态度判断。"
+NEWS_INTERP_TOKENS_PER_ITEM = 160 # 单条解读的输出预算，批量请求按条数放大 max_tokens
+NEWS_INTERP_FALLBACK = {'interpretation': '市场仍在吸收该消息影响，需结合后续资金异动密切关注。', 'tag': '中性'}
+NEWS_INTERP_CACHE_SIZE = 2048
+NEWS_INTERP_TTL = 3 * 86400 # 解读有效期（秒）
+# 同一公告常出现在多只股票下，解读按内容键跨股票复用，持久化在 news_interpretations 表
+# 进程内 LRU 挡在前面: content_key -> (过期时间戳, 解读)
+_news_interp_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+def _news_content_key(n: dict) -> str:
+    """新闻内容键：优先 URL，无 URL 时用标题"""
+    basis = n.get('url') or n.get('title', '')
+    return hashlib.sha1(basis.encode('utf-8')).hexdigest()
+
+def _news_interp_lru_put(key: str, expires_at: float, interp: dict):
+    _news_interp_cache[key] = (expires_at, interp)
+    _news_interp_cache.move_to_end(key)
+    while len(_news_interp_cache) > NEWS_INTERP_CACHE_SIZE:
+        _news_interp_cache.popitem(last=False)
+
+def load_news_interpretations(keys: List[str]) -> Dict[str, dict]:
+    """批量读取未过期的新闻解读"""
+    now = time.time()
+    found = {}
+    missing = []
+    for k in keys:
+        hit = _news_interp_cache.get(k)
+        if hit and hit[0] > now:
+            _news_interp_cache.move_to_end(k)
+            found[k] = dict(hit[1])
+        else:
+            missing.append(k)
+    if not missing:
+        return found
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT result_json FROM news_cache WHERE symbol = ? AND date = ?", (full_symbol, current_date))
-        row = cursor.fetchone()
-        
-        # 顺手删除昨日或更老的冗余缓存（防止硬盘垃圾无限制增长）
-        cursor.execute("DELETE FROM news_cache WHERE date != ?", (current_date,))
+        placeholders = ",".join("?" * len(missing))
+        rows = conn.execute(
+            f"SELECT content_key, tag, interpretation, expires_at FROM news_interpretations WHERE content_key IN ({placeholders}) AND expires_at > ?",
+            (*missing, now)
+        ).fetchall()
+        conn.close()
+        for row in rows:
+            interp = {'interpretation': row['interpretation'], 'tag': row['tag']}
+            found[row['content_key']] = interp
+            _news_interp_lru_put(row['content_key'], row['expires_at'], interp)
+    except Exception as e:
+        logger.error(f"News interpretation load error: {e}")
+    return found
+
+def save_news_interpretations(entries: List[tuple]):
+    """entries: [(新闻, 解读)]，写入内容寻址的解读表"""
+    if not entries:
+        return
+    expires_at = time.time() + NEWS_INTERP_TTL
+    try:
+        conn = get_db_connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO news_interpretations (content_key, url, title, tag, interpretation, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(_news_content_key(n), n.get('url'), n.get('title'), interp['tag'], interp['interpretation'], expires_at) for n, interp in entries]
+        )
         conn.commit()
-        
-        if row:
-            conn.close()
-            return json.loads(row['result_json'])
         conn.close()
     except Exception as e:
-        logger.error(f"News sqlite cache fetch error for {full_symbol}: {e}")
-    
-    all_raw_news = []
-    seen_urls = set()
-    seen_titles = set()
-    
-    stock_name = ""
+        logger.error(f"News interpretation save error: {e}")
+    for n, interp in entries:
+        _news_interp_lru_put(_news_content_key(n), expires_at, interp)
+
+def cleanup_news_cache():
+    """定时清理：入库超出保留期的新闻条目与过期的新闻解读"""
+    now = time.time()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM news_items WHERE ingested_at < ?", (now - NEWS_RETENTION_DAYS * 86400,))
+    items_removed = cursor.rowcount
+    cursor.execute("DELETE FROM news_interpretations WHERE expires_at < ?", (now,))
+    interps_removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    logger.info(f"News cache cleanup: {items_removed} items, {interps_removed} interpretations removed.")
+
+def _normalize_news_interp(res: dict) -> dict:
+    tag = res.get('tag', '中性')
+    if tag not in NEWS_INTERP_TAGS: tag = '中性'
+    return {
+        'interpretation': res.get('interpretation') or '该事件可能对后续股价走势产生潜在影响。',
+        'tag': tag
+    }
+
+async def _interpret_news_chunk(stock_label: str, items: List[dict]) -> Dict[str, dict]:
+    """一次请求解读多条新闻；输出被截断或无法解析时对半拆分重试，单条仍失败则使用兜底文案"""
+    prompt = f"针对 {stock_label} 的以下新闻逐条进行解读：\n"
+    for i, n in enumerate(items):
+        prompt += f"[{i}] 标题：{n['title']}  时间：{n['time']}\n"
+    prompt += "\n【输出要求】返回 JSON 对象 {\"results\": [...]}，每条新闻对应一个元素，包含三个字段：\n"
+    prompt += "1. id: 新闻编号（方括号内的数字）\n"
+    prompt += "2. interpretation: 极具指导意义的解读（1-2句话）\n"
+    prompt += "3. tag: 只能选一项：利好、利空、重大利好、重大利空、中性\n"
+
     try:
-        import requests
-        session = requests.Session()
-        session.trust_env = False
-        url_info = f"https://push2.eastmoney.com/api/qt/stock/get?secid={'1' if market=='sh' else '0'}.{clean_symbol}&fields=f58"
-        r = session.get(url_info, timeout=5.0)
-        if r.status_code == 200:
-            stock_name = r.json().get('data', {}).get('f58', '')
-    except: pass
-    
-    if not stock_name:
-        try:
-            spot = data_manager.get_spot_data()
-            if not spot.empty:
-                f = spot[spot['代码'] == clean_symbol]
-                if not f.empty: stock_name = f.iloc[0]['名称']
-        except: pass
-
-    # 1. 定义并发获取各个渠道新闻的异步任务
-    async def fetch_sina_vip():
-        news_list = []
-        try:
-            url_vip = f"http://vip.stock.finance.sina.com.cn/corp/go.php/vCB_AllNewsStock/symbol/{full_symbol}.phtml"
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                resp = await client.get(url_vip, headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"})
-                if resp.status_code == 200:
-                    t = resp.content.decode('gbk', 'ignore')
-                    import re
-                    match = re.search(r'<div class="datelist">(.*?)</div>', t, re.S)
-                    if match:
-                        list_str = match.group(1)
-                        items = re.findall(r'(\d{4}-\d{2}-\d{2})&nbsp;(\d{2}:\d{2})&nbsp;&nbsp;<a[^>]*href=[\'"]([^\'"]+)[\'"][^>]*>([^<]+)</a>', list_str)
-                        for date, time, u, title in items[:30]: # 最多取30条
-                            news_list.append({
-                                "title": title.strip(),
-                                "time": f"{date} {time}",
-                                "source": "新浪财经",
-                                "url": u,
-                                "is_direct": True
-                            })
-        except Exception as e:
-            logger.warning(f"Sina VIP stock news crawler failed: {e}")
-        return news_list
+        res = await get_deepseek_analysis(prompt, NEWS_INTERP_SYSTEM_PROMPT, max_tokens=NEWS_INTERP_TOKENS_PER_ITEM * len(items) + 200)
+    except (LLMOutputTruncated, json.JSONDecodeError) as e:
+        if len(items) == 1:
+            logger.warning(f"News interpretation unparsable for {items[0]['url']}: {e}")
+            return {_news_content_key(items[0]): dict(NEWS_INTERP_FALLBACK)}
+        mid = len(items) // 2
+        parts = await asyncio.gather(_interpret_news_chunk(stock_label, items[:mid]), _interpret_news_chunk(stock_label, items[mid:]))
+        return {**parts[0], **parts[1]}
+    except Exception as e:
+        logger.warning(f"News batch interpretation failed ({len(items)} items): {e}")
+        return {_news_content_key(n): dict(NEWS_INTERP_FALLBACK) for n in items}
 
-    async def fetch_sina_feed():
-        news_list = []
+    mapping = {}
+    results = res.get('results', []) if isinstance(res, dict) else []
+    for r in results:
+        if not isinstance(r, dict): continue
         try:
-            url = f"https://feed.mix.sina.com.cn/api/roll/get?pageid=155&lid=1686&num=30&page=1&symbol={full_symbol}"
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                resp = await client.get(url)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    for item in data.get('result', {}).get('data', []):
-                        u = item.get('url', '')
-                        t = item.get('title', '')
-                        if (stock_name and stock_name in t) or (clean_symbol in t):
-                            news_list.append({
-                                "title": t,
-                                "time": item.get('createtime', item.get('pubDate', '')),
-                                "source": item.get('media_name', '聚合资讯'),
-                                "url": u,
-                                "is_direct": True
-                            })
-        except Exception as e:
-            logger.warning(f"Sina news feed failed: {e}")
-        return news_list
+            idx = int(r.get('id'))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= idx < len(items):
+            mapping[_news_content_key(items[idx])] = _normalize_news_interp(r)
+
+    missing = [n for n in items if _news_content_key(n) not in mapping]
+    if missing and len(missing) < len(items):
+        # 模型漏掉的条目单独补一次
+        mapping.update(await _interpret_news_chunk(stock_label, missing))
+    else:
+        for n in missing:
+            mapping[_news_content_key(n)] = dict(NEWS_INTERP_FALLBACK)
+    return mapping
+
+async def interpret_news_batch(stock_label: str, items: List[dict]) -> Dict[str, dict]:
+    """批量解读新闻，返回 内容键 -> {interpretation, tag}；已解读过的新闻（任意股票下）直接复用"""
+    stored = load_news_interpretations([_news_content_key(n) for n in items])
+    mapping = {}
+    pending = []
+    for n in items:
+        key = _news_content_key(n)
+        interp = stored.get(key)
+        if interp:
+            mapping[key] = interp
+        else:
+            pending.append(n)
 
-    async def fetch_eastmoney_ann():
-        news_list = []
-        try:
-            # 抓取最近15条股票官方公告
-            url = f"https://np-anotice-stock.eastmoney.com/api/security/ann?sr=-1&page_size=15&page_index=1&ann_type=A&client_source=web&stock_list={clean_symbol}"
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                resp = await client.get(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'})
-                if resp.status_code == 200:
-                    data = resp.json()
-                    list_data = data.get('data', {}).get('list', [])
-                    for i in list_data:
-                        t = i.get('title', '')
-                        if '摘要' in t or '提示' in t: continue # 过滤一些不太重要的摘要性质
-                        u = f"https://data.eastmoney.com/notices/detail/{clean_symbol}/{i.get('art_code')}.html"
-                        time_str = i.get('notice_date', '')[:10]
-                        news_list.append({
-                            "title": f"【公司公告】{t}",
-                            "time": f"{time_str} 00:00",
-                            "source": "东方财富",
-                            "url": u,
-                            "is_direct": True  # 公告绝对是第一手重要资料
-                        })
-        except Exception as e:
-            logger.warning(f"Eastmoney announcement fetch failed: {e}")
-        return news_list
+    if pending:
+        fresh = await _interpret_news_chunk(stock_label, pending)
+        mapping.update(fresh)
+        # 兜底文案不入库，下次请求重新解读
+        save_news_interpretations([(n, fresh[_news_content_key(n)]) for n in pending if fresh.get(_news_content_key(n)) not in (None, NEWS_INTERP_FALLBACK)])
+    return mapping
 
-    # 2. 并发执行所有数据源抓取
-    results = await asyncio.gather(
-        fetch_sina_vip(),
-        fetch_sina_feed(),
-        fetch_eastmoney_ann(),
-        return_exceptions=True
-    )
-    
-    # 合并结果并去重
-    for res in results:
-        if isinstance(res, list):
-            for n in res:
-                u = n['url']
-                t = n['title']
-                if u and u not in seen_urls and t not in seen_titles:
-                    seen_urls.add(u)
-                    seen_titles.add(t)
-                    all_raw_news.append(n)
+@app.get("/api/stock/influential_news/{symbol}")
+async def get_influential_news(symbol: str):
+    """获取与股价密切相关的重要新闻事件并进行AI量化解读"""
+    market, clean_symbol = _split_symbol(symbol)
+    stock_name = await resolve_stock_name(clean_symbol, market)
+
+    # 1. 增量采集（各来源在抓取间隔内直接跳过），再从新闻表读取直接相关的条目
+    await ingest_symbol_news(symbol)
+    try:
+        all_raw_news = await asyncio.to_thread(load_symbol_news, symbol, True)
+    except Exception as e:
+        logger.error(f"News store read error for {symbol}: {e}")
+        all_raw_news = []
 
     if not all_raw_news:
         return []
 
-    # 3. 排序和筛选出最重要的新闻送入 AI
+    # 2. 排序和筛选出最重要的新闻送入 AI
     priority_words = ['政策', '发改委', '突破', '大单', '中标', '业绩增', '净利润', '重组', '收购', '举牌', '立案', '违规', '退市']
     for n in all_raw_news:
         score = 0
@@ -2942,48 +5520,25 @@ async def get_influential_news(symbol: str):
     all_raw_news.sort(key=lambda x: (x.get('score', 0), x.get('time', '')), reverse=True)
     target_news = all_raw_news[:10] # 减少为取前10条以加快处理速度
 
-    # 5. 调用 AI 进行并发解读和打标签
-    # 将批量请求拆分为单个并发请求，大幅降低整体等待时间 (由于 LLM 生成单条JSON非常快)
-    system_prompt = "你是一位资深金融分析师。要求为单条股票新闻撰写极具指导意义的简短解读，辅助判断股价走势。禁止含糊其词或说废话，绝对禁止出现具体涨跌幅数字预测。必须附含清晰的态度判断。"
-    
-    async def interpret_single_news(n):
-        prompt = f"针对 {stock_name}({symbol}) 的新闻进行解读：\n"
-        prompt += f"标题：{n['title']}\n时间：{n['time']}\n\n"
-        prompt += "【输出要求】由于是单条，请直接返回一个只有两个字段的 JSON 对象（不要包装在 results 数组里）：\n"
-        prompt += "1. interpretation: 极具指导意义的解读（1-2句话）\n"
-        prompt += "2. tag: 只能选一项：利好、利空、重大利好、重大利空、中性\n"
-        try:
-            # 独立单条请求，减少单次生成时间
-            res = await get_deepseek_analysis(prompt, system_prompt)
-            tag = res.get('tag', '中性')
-            valid_tags = ['利好', '利空', '重大利好', '重大利空', '中性']
-            if tag not in valid_tags: tag = '中性'
-            return {
-                'url': n['url'],
-                'interpretation': res.get('interpretation', '该事件可能对后续股价走势产生潜在影响。'),
-                'tag': tag
-            }
-        except Exception as e:
-            logger.warning(f"Single news interpretation failed for {n['url']}: {e}")
-            return {
-                'url': n['url'],
-                'interpretation': '市场仍在吸收该消息影响，需结合后续资金异动密切关注。',
-                'tag': '中性'
-            }
+    # 清理非必要字段并按时间倒序
+    for n in target_news:
+        if 'is_direct' in n: del n['is_direct']
+        if 'score' in n: del n['score']
+        
+    target_news.sort(key=lambda x: x.get('time', ''), reverse=True)
+
+    return await _attach_news_interpretations(symbol, stock_name, target_news)
 
+async def _attach_news_interpretations(symbol: str, stock_name: str, target_news: List[dict]) -> List[dict]:
+    """为新闻列表填充 AI 解读与标签（一次请求覆盖全部未解读新闻，过长时自动拆分）"""
     try:
         if target_news:
-            ai_results = await asyncio.gather(*(interpret_single_news(n) for n in target_news), return_exceptions=True)
-            mapping = {}
-            for res in ai_results:
-                if isinstance(res, dict) and 'url' in res:
-                    mapping[res['url']] = res
-
+            mapping = await interpret_news_batch(f"{stock_name}({symbol})", target_news)
             for n in target_news:
-                u = n['url']
-                if u in mapping:
-                    n['interpretation'] = mapping[u]['interpretation']
-                    n['tag'] = mapping[u]['tag']
+                interp = mapping.get(_news_content_key(n))
+                if interp:
+                    n['interpretation'] = interp['interpretation']
+                    n['tag'] = interp['tag']
                 else:
                     n['interpretation'] = '当前服务繁忙，AI 深度解读暂未就绪。'
                     n['tag'] = '中性'
@@ -2992,31 +5547,8 @@ async def get_influential_news(symbol: str):
         for n in target_news:
             n['interpretation'] = '当前服务繁忙，AI 深度解读暂未就绪。'
             n['tag'] = '中性'
-            
-    # 清理非必要字段并按时间倒序
-    for n in target_news:
-        if 'is_direct' in n: del n['is_direct']
-        if 'score' in n: del n['score']
-        
-    target_news.sort(key=lambda x: x.get('time', ''), reverse=True)
-        
-    # 将完整的最终数据放入 SQLite 当日缓存池中
-    try:
-        result_json = json.dumps(target_news)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO news_cache (symbol, date, result_json) VALUES (?, ?, ?)",
-            (full_symbol, current_date, result_json)
-        )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"News sqlite cache save error for {full_symbol}: {e}")
-        
     return target_news
 
-
 # --- Payment & VIP Routes ---
 
 def get_alipay_client():
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+import backtest
+
+
+def _frames(seed=0, symbols=3):
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range("2025-01-01", periods=80)
+    frames = {}
+    for j in range(symbols):
+        n = 80 - 15 * j  # 长度不同，检验按 K 线序号左对齐
+        closes = 10 * np.exp(np.cumsum(rng.normal(0, 0.03, n)))
+        frames[f"60000{j}"] = pd.DataFrame({
+            "日期": days[-n:].strftime("%Y-%m-%d"),
+            "收盘": closes,
+            "成交量": rng.integers(10_000, 1_000_000, n).astype(float),
+        })
+    return frames
+
+
+def _manual_trend_score(df: pd.DataFrame, i: int) -> float:
+    """按 get_visual_indicators 的规则逐股计算第 i 根 K 线的 trend_score"""
+    if i + 1 < backtest.MIN_SCORE_BARS:
+        return 50.0
+    d = df.iloc[:i + 1]
+    c, v = d["收盘"], d["成交量"]
+    dif = c.ewm(span=12, adjust=False).mean() - c.ewm(span=26, adjust=False).mean()
+    dea = dif.ewm(span=9, adjust=False).mean()
+    macd = (dif - dea) * 2
+    ma20, std20 = c.rolling(20).mean().iloc[-1], c.rolling(20).std().iloc[-1]
+    price = c.iloc[-1]
+    vol_ratio = round(v.iloc[-1] / v.rolling(5).mean().iloc[-1], 2)
+    change = round((price - c.iloc[-2]) / c.iloc[-2] * 100, 2)
+    score = 50
+    if dif.iloc[-1] > dea.iloc[-1]: score += 15
+    if macd.iloc[-1] > 0: score += 5
+    if price > ma20: score += 10
+    if vol_ratio > 1.2: score += 10
+    elif vol_ratio < 0.8: score -= 5
+    if price > ma20 + 2 * std20: score -= 10
+    if price < ma20 - 2 * std20: score += 10
+    if change > 2: score += 10
+    elif change < -2: score -= 10
+    return float(max(10, min(95, score)))
+
+
+def test_compute_scores_matches_per_stock_rule():
+    frames = _frames()
+    panel = backtest.build_panel(frames)
+    scores = backtest.compute_scores(panel["close"], panel["volume"])["trend_score"]
+    for col, code in enumerate(panel["codes"]):
+        df = frames[code]
+        for i in range(len(df)):
+            assert scores[i, col] == _manual_trend_score(df, i), (code, i)
+        assert np.isnan(scores[len(df):, col]).all()
+
+
+def test_build_panel_left_aligns_and_sorts_dates():
+    frames = {"000001": pd.DataFrame({"日期": ["2025-01-03", "2025-01-02"], "收盘": [2.0, 1.0], "成交量": [1.0, 1.0]}),
+              "000002": pd.DataFrame({"日期": ["2025-01-06"], "收盘": [5.0], "成交量": [1.0]})}
+    panel = backtest.build_panel(frames)
+    assert panel["codes"] == ["000001", "000002"]
+    assert panel["close"][:, 0].tolist() == [1.0, 2.0]
+    assert panel["close"][0, 1] == 5.0 and np.isnan(panel["close"][1, 1])
+
+
+def test_run_backtest_reports_universe_source():
+    report = backtest.run_backtest(_frames(), horizons=[1, 5])
+    assert report["universe"] == 3
+    assert report["universe_source"] == "frames"
+    assert report["rules"]["trend_score"]["signals"]["Buy"]["1d"] is not None
+    assert backtest.run_backtest({}, horizons=[1])["universe"] == 0
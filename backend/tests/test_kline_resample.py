@@ -0,0 +1,66 @@
+import pandas as pd
+
+import main
+
+
+def _minute_bars(times, day="2026-10-15"):
+    n = len(times)
+    return pd.DataFrame({
+        "日期": [f"{day} {t}" for t in times],
+        "开盘": [float(i + 1) for i in range(n)],
+        "最高": [float(i + 2) for i in range(n)],
+        "最低": [float(i) for i in range(n)],
+        "收盘": [float(i + 1.5) for i in range(n)],
+        "成交量": [100.0] * n,
+    })
+
+
+def _session_times():
+    times = []
+    for start, end in ((9 * 60 + 35, 11 * 60 + 30), (13 * 60 + 5, 15 * 60)):
+        times += [f"{m // 60:02d}:{m % 60:02d}" for m in range(start, end + 1, 5)]
+    return times
+
+
+def test_resample_minutes_full_day_boundaries():
+    df = _minute_bars(_session_times())
+    assert list(main._resample_minutes(df, "60")["日期"].str[11:]) == ["10:30", "11:30", "14:00", "15:00"]
+    thirty = main._resample_minutes(df, "30")
+    assert list(thirty["日期"].str[11:]) == ["10:00", "10:30", "11:00", "11:30", "13:30", "14:00", "14:30", "15:00"]
+    assert (thirty["成交量"] == 600.0).all()
+
+
+def test_resample_minutes_gap_keeps_later_buckets_aligned():
+    times = [t for t in _session_times() if t != "09:45"]
+    df = _minute_bars(times)
+    hourly = main._resample_minutes(df, "60")
+    assert list(hourly["日期"].str[11:]) == ["10:30", "11:30", "14:00", "15:00"]
+    assert list(hourly["成交量"]) == [1100.0, 1200.0, 1200.0, 1200.0]
+    # 第二个时段从 10:35 开始，不受 09:45 缺失影响
+    second = df[df["日期"].str[11:] == "10:35"].iloc[0]
+    assert hourly.iloc[1]["开盘"] == second["开盘"]
+
+
+def test_resample_minutes_opening_auction_and_multiple_days():
+    df = pd.concat([_minute_bars(["09:30", "09:35", "10:00"], "2026-10-15"),
+                    _minute_bars(["09:35"], "2026-10-16")], ignore_index=True)
+    out = main._resample_minutes(df, "30")
+    assert list(out["日期"]) == ["2026-10-15 10:00", "2026-10-16 10:00"]
+    assert list(out["成交量"]) == [300.0, 100.0]
+
+
+def test_resample_minutes_five_is_passthrough():
+    df = _minute_bars(["09:35", "09:40"])
+    assert main._resample_minutes(df, "5") is df
+
+
+def test_resample_daily_weekly_and_monthly():
+    dates = pd.bdate_range("2026-09-28", "2026-10-09")
+    df = pd.DataFrame({"日期": dates.strftime("%Y-%m-%d"), "开盘": range(10), "最高": range(1, 11),
+                       "最低": range(10), "收盘": range(10), "成交量": [1.0] * 10})
+    weekly = main._resample_daily(df, "weekly")
+    assert list(weekly["日期"]) == ["2026-10-02", "2026-10-09"]
+    assert list(weekly["开盘"]) == [0, 5] and list(weekly["收盘"]) == [4, 9] and list(weekly["成交量"]) == [5.0, 5.0]
+    monthly = main._resample_daily(df, "monthly")
+    assert list(monthly["日期"]) == ["2026-09-30", "2026-10-09"]
+    assert list(monthly["最高"]) == [3, 10]
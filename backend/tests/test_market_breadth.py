@@ -0,0 +1,57 @@
+import pandas as pd
+
+import main
+
+
+def _snapshot(rows):
+    return pd.DataFrame(rows, columns=["代码", "名称", "最新价", "涨跌幅", "昨收", "成交额"])
+
+
+def test_main_board_st_uses_ten_percent_limit():
+    df = _snapshot([
+        ("600001", "ST测试", 10.50, 5.0, 10.0, 1.0),
+        ("600002", "*ST测试", 11.00, 10.0, 10.0, 1.0),
+        ("000003", "ST跌停", 9.00, -10.0, 10.0, 1.0),
+    ])
+    breadth = main.compute_market_breadth(df)
+    assert breadth["limit_up"] == 1
+    assert breadth["limit_down"] == 1
+    assert breadth["limit_by_board"]["main"] == {"limit_up": 1, "limit_down": 1}
+
+
+def test_board_limits_and_price_rounding():
+    df = _snapshot([
+        ("300001", "创业测试", 12.34, 20.0, 10.28, 1.0),  # 10.28 * 1.2 = 12.336 -> 12.34
+        ("688001", "科创测试", 11.00, 10.0, 10.0, 1.0),
+        ("830001", "北交测试", 13.00, 30.0, 10.0, 1.0),
+    ])
+    breadth = main.compute_market_breadth(df)
+    assert breadth["limit_by_board"]["growth"] == {"limit_up": 1, "limit_down": 0}
+    assert breadth["limit_by_board"]["bj"] == {"limit_up": 1, "limit_down": 0}
+
+
+def test_new_listings_and_suspended_are_not_limit_moves():
+    df = _snapshot([
+        ("301999", "N新股", 50.0, 200.0, 16.6, 5.0),
+        ("688999", "C新股", 40.0, 30.0, 30.7, 3.0),
+        ("600000", "浦发银行", 11.0, 10.0, 10.0, 2.0),
+        ("000001", "平安银行", 0.0, 0.0, 10.0, 0.0),
+    ])
+    breadth = main.compute_market_breadth(df)
+    assert breadth["limit_up"] == 1
+    assert breadth["no_limit"] == 2
+    assert breadth["suspended"] == 1
+    assert breadth["total"] == 3
+    assert breadth["advancers"] == 3
+    assert breadth["total_amount"] == 10.0
+
+
+def test_change_fallback_without_prev_close():
+    df = pd.DataFrame({"代码": ["600000", "600001"], "名称": ["甲", "乙"], "最新价": [11.0, 10.5], "涨跌幅": [9.98, 5.0]})
+    breadth = main.compute_market_breadth(df)
+    assert breadth["limit_up"] == 1
+    assert breadth["turnover_buckets"] == []
+
+
+def test_empty_snapshot():
+    assert main.compute_market_breadth(pd.DataFrame()) is None
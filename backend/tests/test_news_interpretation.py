@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import main
+
+
+def _items(n):
+    return [{"title": f"新闻{i}", "time": "2026-10-15 09:30", "url": f"https://news.test/{i}"} for i in range(n)]
+
+
+def _install_model(monkeypatch, max_items, skip_ids=()):
+    """模拟模型：一次超过 max_items 条时输出被截断；skip_ids 中的标题会被漏掉"""
+    calls = []
+
+    async def fake_analysis(prompt, system_prompt=None, max_tokens=None):
+        lines = [line for line in prompt.splitlines() if line.startswith("[")]
+        calls.append(len(lines))
+        if len(lines) > max_items:
+            raise main.LLMOutputTruncated("truncated")
+        results = []
+        for line in lines:
+            idx = int(line[1:line.index("]")])
+            title = line.split("标题：")[1].split()[0]
+            if title in skip_ids:
+                continue
+            results.append({"id": idx, "interpretation": f"解读{title}", "tag": "利好"})
+        return {"results": results}
+
+    monkeypatch.setattr(main, "get_deepseek_analysis", fake_analysis)
+    return calls
+
+
+def test_truncated_batches_are_split_in_half(monkeypatch):
+    calls = _install_model(monkeypatch, max_items=2)
+    items = _items(6)
+    mapping = asyncio.run(main._interpret_news_chunk("测试股(600000)", items))
+    assert calls[0] == 6 and max(calls[1:]) <= 3
+    assert {mapping[main._news_content_key(n)]["interpretation"] for n in items} == {f"解读新闻{i}" for i in range(6)}
+
+
+def test_single_unparsable_item_gets_fallback(monkeypatch):
+    async def broken(prompt, system_prompt=None, max_tokens=None):
+        raise json.JSONDecodeError("bad", "", 0)
+
+    monkeypatch.setattr(main, "get_deepseek_analysis", broken)
+    items = _items(3)
+    mapping = asyncio.run(main._interpret_news_chunk("测试股(600000)", items))
+    assert all(mapping[main._news_content_key(n)] == main.NEWS_INTERP_FALLBACK for n in items)
+
+
+def test_items_skipped_by_model_are_retried_once(monkeypatch):
+    calls = _install_model(monkeypatch, max_items=10, skip_ids=("新闻1",))
+    items = _items(3)
+    mapping = asyncio.run(main._interpret_news_chunk("测试股(600000)", items))
+    assert calls == [3, 1]
+    # 重试时仍被漏掉的条目使用兜底文案
+    assert mapping[main._news_content_key(items[1])] == main.NEWS_INTERP_FALLBACK
+    assert mapping[main._news_content_key(items[0])]["interpretation"] == "解读新闻0"
+
+
+def test_mapping_is_keyed_by_content_not_position(monkeypatch):
+    _install_model(monkeypatch, max_items=10)
+    items = _items(2) + [{"title": "无链接新闻", "time": "", "url": ""}]
+    mapping = asyncio.run(main._interpret_news_chunk("测试股(600000)", items))
+    assert set(mapping) == {main._news_content_key(n) for n in items}
+    assert main._news_content_key(items[2]) == main._news_content_key({"title": "无链接新闻"})
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("GZIP;q=0.5", True),
+    ("gzip;q=0", False),
+    ("gzip; q=0.0, br", False),
+    ("x-gzip", True),
+    ("br", False),
+    ("*", True),
+    ("*;q=0", False),
+    ("br, *;q=0.1", True),
+    ("gzip;q=0, *", False),
+    ("gzip;q=abc", False),
+    ("", False),
+])
+def test_accepts_gzip(header, expected):
+    assert main._accepts_gzip(header) is expected
+
+
+def _daily_series(n=5):
+    dates = pd.bdate_range("2026-10-05", periods=n)
+    df = pd.DataFrame({"日期": dates.strftime("%Y-%m-%d"), "开盘": range(n), "最高": range(1, n + 1),
+                       "最低": range(n), "收盘": range(n), "成交量": [100] * n})
+    return main._kline_columns(df)
+
+
+def test_slice_kline_since_is_exclusive_and_limit_keeps_tail():
+    series = _daily_series()
+    assert series["columns"]["date"][0] == "2026-10-05"
+    assert main._slice_kline(series, "2026-10-07", None)["columns"]["date"] == ["2026-10-08", "2026-10-09"]
+    assert main._slice_kline(series, None, 2)["columns"]["close"] == [3, 4]
+    assert main._slice_kline(series, "2026-10-05", 10)["columns"]["date"][0] == "2026-10-06"
+    assert main._slice_kline(series, "2026-10-09", None)["columns"]["t"] == []
+    assert main._slice_kline(series, None, 0)["columns"]["date"] == []
+
+
+def test_slice_kline_minute_unit():
+    df = pd.DataFrame({"日期": ["2026-10-15 10:00", "2026-10-15 10:30", "2026-10-15 11:00"],
+                       "开盘": [1, 2, 3], "最高": [1, 2, 3], "最低": [1, 2, 3], "收盘": [1, 2, 3], "成交量": [1, 1, 1]})
+    series = main._kline_columns(df, unit="minute")
+    assert main._slice_kline(series, "2026-10-15 10:00", None)["columns"]["date"] == ["2026-10-15 10:30", "2026-10-15 11:00"]
+
+
+def test_kline_payload_records_and_columnar():
+    series = _daily_series(3)
+    records = main._kline_payload("600000", series, "records")
+    assert records[0] == {"日期": "2026-10-05", "开盘": 0, "最高": 1, "最低": 0, "收盘": 0, "成交量": 100}
+    columnar = main._kline_payload("600000", series, "columnar")
+    assert columnar["start"] == "2026-10-05"
+    assert columnar["dt"] == [0, 1, 1]
+    assert columnar["close"] == [0, 1, 2]
+    empty = main._kline_payload("600000", main._slice_kline(series, None, 0), "columnar")
+    assert empty["start"] is None and empty["dt"] == []
@@ -0,0 +1,74 @@
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+
+import database
+import main
+
+
+def _daily(closes, end=None):
+    end = end or datetime.date.today() - datetime.timedelta(days=1)
+    dates = pd.bdate_range(end=end, periods=len(closes))
+    return pd.DataFrame({"日期": dates.strftime("%Y-%m-%d"), "收盘": closes})
+
+
+def _manual_rsi(closes, period=14):
+    deltas = np.diff(closes)[-period:]
+    gain = np.clip(deltas, 0, None).mean()
+    loss = np.clip(-deltas, 0, None).mean()
+    return 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+
+
+def test_compute_rsi_matches_simple_average_definition():
+    closes = pd.Series(10 + np.cumsum(np.random.default_rng(1).normal(0, 0.3, 40)))
+    rsi = main.compute_rsi(closes)
+    assert rsi.iloc[:13].isna().all()
+    assert abs(rsi.iloc[-1] - _manual_rsi(closes.to_numpy())) < 1e-9
+
+
+def test_compute_rsi_edge_values():
+    assert main.compute_rsi(pd.Series(np.arange(20, dtype=float))).iloc[-1] == 100.0
+    assert main.compute_rsi(pd.Series([5.0] * 20)).iloc[-1] == 50.0
+
+
+def test_realtime_rsi_equals_page_rsi_with_current_price(temp_db):
+    history = list(10 + np.cumsum(np.random.default_rng(2).normal(0, 0.3, 30)))
+    base = main._rsi_baseline(_daily(history))
+    assert base["trade_date"] < datetime.date.today().isoformat()
+    conn = database.get_db_connection()
+    conn.execute(
+        "INSERT INTO stock_indicators (code, trade_date, prev_close, avg_gain, avg_loss, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        ("600000", base["trade_date"], base["prev_close"], base["avg_gain"], base["avg_loss"], time.time())
+    )
+    conn.commit()
+    conn.close()
+    price = history[-1] * 1.03
+    realtime = main._realtime_rsi(pd.Series(["600000"]), np.array([price]))[0]
+    expected = main.compute_rsi(pd.Series(history + [price])).iloc[-1]
+    assert abs(realtime - expected) < 1e-9
+
+
+def test_realtime_rsi_rejects_same_day_stale_and_missing_baselines(temp_db):
+    today = datetime.date.today()
+    rows = [
+        ("600001", (today - datetime.timedelta(days=1)).isoformat()),
+        ("600002", (today - datetime.timedelta(days=5)).isoformat()),
+        ("600003", today.isoformat()),
+    ]
+    conn = database.get_db_connection()
+    conn.executemany(
+        "INSERT INTO stock_indicators (code, trade_date, prev_close, avg_gain, avg_loss, updated_at) VALUES (?, ?, 10.0, 0.2, 0.1, 0)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+    rsi = main._realtime_rsi(pd.Series(["600001", "600002", "600003", "600004"]), np.full(4, 10.5))
+    assert np.isfinite(rsi[0])
+    assert np.isnan(rsi[1:]).all()
+
+
+def test_rsi_baseline_needs_enough_bars():
+    assert main._rsi_baseline(_daily([10.0] * 13)) is None
+    assert main._rsi_baseline(_daily([10.0] * 14)) is not None
@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+
+
+def _feed_all(chunks, max_depth=2):
+    parser = main.StreamingJSONFieldParser(max_depth=max_depth)
+    fields = []
+    for chunk in chunks:
+        fields.extend(parser.feed(chunk))
+    return fields
+
+
+def _split_every(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+DOC = {
+    "signal": "Buy",
+    "intensity": 80,
+    "structured_analysis": {"short_summary": "放量突破", "risk": "注意 \"回踩\" 风险"},
+    "price_levels": [10.5, 11.2],
+    "ok": True,
+}
+
+
+def test_whole_document_yields_fields_in_order():
+    fields = _feed_all([json.dumps(DOC, ensure_ascii=False)])
+    assert fields == [
+        (("signal",), "Buy"),
+        (("intensity",), 80),
+        (("structured_analysis", "short_summary"), "放量突破"),
+        (("structured_analysis", "risk"), "注意 \"回踩\" 风险"),
+        (("structured_analysis",), DOC["structured_analysis"]),
+        (("price_levels",), [10.5, 11.2]),
+        (("ok",), True),
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_chunk_splits_anywhere_give_same_fields(size):
+    text = json.dumps(DOC, ensure_ascii=False, indent=2)
+    assert _feed_all(_split_every(text, size)) == _feed_all([text])
+
+
+def test_escaped_quotes_and_backslashes_split_across_chunks():
+    text = '{"path": "C:\\\\data\\\\", "quote": "he said \\"hi\\"", "n": 1}'
+    for cut in range(1, len(text)):
+        fields = dict(_feed_all([text[:cut], text[cut:]]))
+        assert fields[("path",)] == "C:\\data\\"
+        assert fields[("quote",)] == 'he said "hi"'
+        assert fields[("n",)] == 1
+
+
+def test_braces_and_brackets_inside_strings_do_not_close_objects():
+    text = '{"a": "}]{[", "b": {"c": "x}y"}, "d": 2}'
+    fields = dict(_feed_all(_split_every(text, 4)))
+    assert fields[("a",)] == "}]{["
+    assert fields[("b", "c")] == "x}y"
+    assert fields[("b",)] == {"c": "x}y"}
+    assert fields[("d",)] == 2
+
+
+def test_arrays_of_objects():
+    text = '{"news": [{"id": 0, "tag": "利好"}, {"id": 1, "tag": "利空"}], "after": "z"}'
+    fields = _feed_all(_split_every(text, 5))
+    assert (("news",), [{"id": 0, "tag": "利好"}, {"id": 1, "tag": "利空"}]) in fields
+    assert (("after",), "z") in fields
+    # 深度足够时数组内对象的字段也会逐个产出
+    deep = _feed_all([text], max_depth=3)
+    assert [v for p, v in deep if p == ("news", "[]", "tag")] == ["利好", "利空"]
+
+
+def test_truncated_input_only_yields_completed_fields():
+    text = '{"signal": "Sell", "structured_analysis": {"short_summary": "跌破支撑", "detail": "未完'
+    fields = _feed_all(_split_every(text, 3))
+    assert fields == [(("signal",), "Sell"), (("structured_analysis", "short_summary"), "跌破支撑")]
+
+
+def test_trailing_number_split_before_closing_brace():
+    assert _feed_all(['{"intensity": 8', '0', '}']) == [(("intensity",), 80)]
+
+
+def _sse_body(deltas):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': d}}]}, ensure_ascii=False)}" for d in deltas]
+    lines += [": keep-alive", "data: not-json", "data: [DONE]", "data: " + json.dumps({"choices": [{"delta": {"content": "after"}}]})]
+    return ("\n\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def _mock_llm(monkeypatch, handler):
+    monkeypatch.setattr(main, "_build_deepseek_request", lambda prompt, system_prompt=None, stream=False, max_tokens=None: ("https://llm.test/v1/chat", {}, {}))
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "_get_llm_client", lambda: client)
+    return client
+
+
+def test_stream_deepseek_analysis_yields_deltas_until_done(monkeypatch):
+    _mock_llm(monkeypatch, lambda request: httpx.Response(200, content=_sse_body(['{"sig', 'nal": "Buy"}'])))
+
+    async def collect():
+        return [d async for d in main.stream_deepseek_analysis("p")]
+
+    deltas = asyncio.run(collect())
+    assert deltas == ['{"sig', 'nal": "Buy"}']
+    assert _feed_all(deltas) == [(("signal",), "Buy")]
+
+
+def test_stream_deepseek_analysis_raises_on_http_error(monkeypatch):
+    _mock_llm(monkeypatch, lambda request: httpx.Response(500, content=b"boom"))
+
+    async def collect():
+        return [d async for d in main.stream_deepseek_analysis("p")]
+
+    with pytest.raises(RuntimeError, match="500"):
+        asyncio.run(collect())
@@ -0,0 +1,39 @@
+import json
+
+import pandas as pd
+from fastapi import BackgroundTasks
+
+import database
+import main
+
+
+def _put_kline(code, volumes):
+    conn = database.get_db_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO app_cache (cache_key, result_json, updated_at) VALUES (?, ?, '2026-01-01 00:00:00')",
+        (f"kline_{code}", json.dumps([{"日期": f"2026-01-{i + 1:02d}", "收盘": 10.0, "成交量": v} for i, v in enumerate(volumes)]))
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_cached_vol_ratios_uses_latest_bar_over_five_day_mean(temp_db):
+    _put_kline("600000", [100.0, 100.0, 100.0, 100.0, 100.0, 300.0])
+    _put_kline("sz000001", [10.0, 10.0])
+    ratios = main._cached_vol_ratios(["600000", "000001", "300750"])
+    assert ratios == {"600000": round(300 / 140, 2)}
+
+
+def test_watchlist_view_fills_missing_volume_ratio_and_reports_peer_score(temp_db, monkeypatch):
+    conn = database.get_db_connection()
+    conn.execute("INSERT INTO watchlist (user_id, stock_code) VALUES (1, '600000')")
+    conn.commit()
+    conn.close()
+    _put_kline("600000", [100.0] * 4 + [200.0])
+    # 新浪兜底快照没有量比列
+    spot = pd.DataFrame({"名称": ["浦发银行"], "最新价": [10.0], "涨跌幅": [1.0], "成交额": [1e8]}, index=pd.Index(["600000"], name="代码"))
+    monkeypatch.setattr(main.data_manager, "get_spot_index", lambda bg: spot)
+    result = main.asyncio.run(main.get_watchlist_view(1, BackgroundTasks(), sort_by="peer_score"))
+    item = result["items"][0]
+    assert item["量比"] == round(200 / 120, 2)
+    assert "peer_score" in item and "score" not in item
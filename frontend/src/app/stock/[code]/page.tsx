@@ -2,6 +2,7 @@
 import { useEffect, useState, useMemo } from "react";
 import { useRouter } from "next/navigation";
 import KLineChart from "@/components/KLineChart";
+import { toKlineBars } from "@/utils/klineUtils";
 import FundFlowTable from "@/components/FundFlowTable";
 import CapitalFlowHistory from "@/components/CapitalFlowHistory";
 import PeerRadarChart from "@/components/PeerRadarChart";
@@ -202,169 +203,128 @@ export default function StockDetailPage({ params }: { params: { code: string } }
         setKline([]);
         setError(null);
 
-        // 1. Fetch Quote (High Priority)
-        async function fetchQuote() {
-            try {
-                const userToken = localStorage.getItem('user_token');
-                let uid = "";
-                if (userToken) {
-                    try { uid = JSON.parse(userToken).id; } catch (e) { }
-                }
-                const res = await fetch(`http://localhost:8000/api/stock/quote/${params.code}${uid ? `?user_id=${uid}` : ''}`);
-
-                if (res.status === 429) {
-                    const errorData = await res.json();
-                    if (active) {
-                        alert(`🚫 访问受限\n\n${errorData.detail}`);
-                        setError(errorData.detail);
-                        setLoading(false);
-                    }
-                    return;
-                }
-
-                if (active && res.ok) {
-                    setQuote(await res.json());
-                    // 只要行情回来了，就让骨架屏消失，优先显示基础界面
-                    setLoading(false);
-                }
-            } catch (e) {
-                console.error("Quote fetch error:", e);
-                if (active) {
-                    setError("获取行情数据失败，请检查网络连接");
-                    setLoading(false);
-                }
+        // 个股详情组合接口：一次请求按 NDJSON 逐段返回行情/指标/K线/诊断/新闻/资金/同业数据，
+        // 每一段到达即刷新对应区块，慢的 AI 诊断不会阻塞其它区块。
+        function handleQuote(status: number, payload: any) {
+            if (status === 429) {
+                alert(`🚫 访问受限\n\n${payload}`);
+                setError(payload);
+                setLoading(false);
+                return;
+            }
+            if (status === 200) {
+                setQuote(payload);
+                // 只要行情回来了，就让骨架屏消失，优先显示基础界面
+                setLoading(false);
+            } else {
+                setError(payload || "获取行情数据失败，请检查网络连接");
+                setLoading(false);
             }
         }
 
-        // 2. Fetch Visual Indicators (Fast Path - Numerical Only)
-        async function fetchVisualIndicators() {
-            try {
-                const res = await fetch(`http://localhost:8000/api/stock/visual_indicators/${params.code}`);
-                if (active && res.ok) {
-                    setVisualIndicators(await res.json());
-                    // 视觉指标回来也确保 loading 结束
-                    setLoading(false);
+        function handleAnalysis(status: number, payload: any) {
+            if (status === 200) {
+                setAnalysis(payload);
+                setAnalysisError(null);
+            } else if (status === 429) {
+                const detail = payload || "";
+                if (detail.includes("每小时 20 次")) {
+                    setAnalysisError(`📊 已达到分析限额\n\n${detail}\n\nVip 会员每小时可享 20 次深度诊断权益。`);
+                } else {
+                    setAnalysisError(detail || "访问太频繁了，请稍后再试。");
                 }
-            } catch (e) { console.error("Visual indicators fetch error:", e); }
+            } else {
+                setAnalysisError(payload || "智能诊断获取失败，请重试。");
+            }
         }
 
-        // 3. Fetch K-Line
-        async function fetchKline() {
-            try {
-                const res = await fetch(`http://localhost:8000/api/stock/kline/${params.code}`);
-                if (active && res.ok) {
-                    setKline(await res.json());
-                    // K线回来也确保 loading 结束
+        function handleSection(item: any) {
+            const { section, status } = item;
+            const payload = status === 200 ? item.data : item.detail;
+            switch (section) {
+                case 'quote':
+                    handleQuote(status, payload);
+                    break;
+                case 'visual_indicators':
+                    if (status === 200) setVisualIndicators(payload);
                     setLoading(false);
-                }
-            } catch (e) { console.error("Kline fetch error:", e); }
+                    break;
+                case 'kline':
+                    if (status === 200) setKline(toKlineBars(payload));
+                    setLoading(false);
+                    break;
+                case 'analysis':
+                    handleAnalysis(status, payload);
+                    break;
+                case 'influential_news':
+                    if (status === 200) setNews(payload);
+                    setIsNewsLoading(false);
+                    break;
+                case 'fund_flow':
+                    if (status === 200) setFundFlow(payload);
+                    setFundFlowLoading(false);
+                    break;
+                case 'capital_flow':
+                    if (status === 200) setCapitalFlowData(payload);
+                    setCapitalFlowLoading(false);
+                    break;
+                case 'peer_radar':
+                    if (status === 200) setPeerRadarData(payload);
+                    setPeerRadarLoading(false);
+                    break;
+            }
         }
 
-        // 4. Fetch AI Analysis (Low Priority, Slow)
-        async function fetchAnalysis() {
+        async function fetchDetail() {
+            setIsNewsLoading(true);
+            setFundFlowLoading(true);
+            setCapitalFlowLoading(true);
+            setPeerRadarLoading(true);
             try {
                 const userToken = localStorage.getItem('user_token');
                 let uid = "";
                 if (userToken) {
                     try { uid = JSON.parse(userToken).id; } catch (e) { }
                 }
-                const res = await fetch(`http://localhost:8000/api/stock/analysis/${params.code}${uid ? `?user_id=${uid}` : ''}`);
-                if (res.ok) {
-                    const data = await res.json();
-                    if (active) {
-                        setAnalysis(data);
-                        setAnalysisError(null);
+                const res = await fetch(`http://localhost:8000/api/stock/detail/${params.code}?kline_format=columnar${uid ? `&user_id=${uid}` : ''}`);
+                if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+                const reader = res.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = "";
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    if (!active) {
+                        reader.cancel();
+                        return;
                     }
-                } else if (res.status === 429) {
-                    const data = await res.json();
-                    const detail = data.detail || "";
-                    if (active) {
-                        if (detail.includes("每小时 20 次")) {
-                            setAnalysisError(`📊 已达到分析限额\n\n${detail}\n\nVip 会员每小时可享 20 次深度诊断权益。`);
-                        } else {
-                            setAnalysisError(detail || "访问太频繁了，请稍后再试。");
-                        }
-                    }
-                } else {
-                    try {
-                        const data = await res.json();
-                        if (active) setAnalysisError(data.detail || "智能诊断获取失败，请重试。");
-                    } catch (e) {
-                        if (active) setAnalysisError("服务器响应异常，请稍后重试。");
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split("\n");
+                    buffer = lines.pop() || "";
+                    for (const line of lines) {
+                        if (line.trim()) handleSection(JSON.parse(line));
                     }
                 }
+                if (active && buffer.trim()) handleSection(JSON.parse(buffer));
             } catch (e) {
-                console.error("Analysis fetch error:", e);
-                if (active) setAnalysisError("由于网络不稳定，智能诊断加载失败。");
-            }
-        }
-
-        // 5. Fetch Influential News
-        async function fetchNews() {
-            if (active) setIsNewsLoading(true);
-            try {
-                const res = await fetch(`http://localhost:8000/api/stock/influential_news/${params.code}`);
-                if (active && res.ok) setNews(await res.json());
-            } catch (e) {
-                console.error("News fetch error:", e);
-            } finally {
-                if (active) setIsNewsLoading(false);
-            }
-        }
-
-        // 6. Fetch Fund Flow
-        async function fetchFundFlow() {
-            try {
-                if (active) setFundFlowLoading(true);
-                const res = await fetch(`http://localhost:8000/api/stock/fund_flow/${params.code}`);
-                if (active && res.ok) {
-                    setFundFlow(await res.json());
-                }
-            } catch (e) {
-                console.error("Fund flow fetch error:", e);
-            } finally {
-                if (active) setFundFlowLoading(false);
-            }
-        }
-
-        // 7. Fetch Capital Flow History
-        async function fetchCapitalFlowHistory() {
-            try {
-                if (active) setCapitalFlowLoading(true);
-                const res = await fetch(`http://localhost:8000/api/stock/capital_flow/${params.code}`);
-                if (active && res.ok) {
-                    setCapitalFlowData(await res.json());
+                console.error("Stock detail fetch error:", e);
+                if (active) {
+                    setError("获取行情数据失败，请检查网络连接");
+                    setAnalysisError("由于网络不稳定，智能诊断加载失败。");
+                    setLoading(false);
                 }
-            } catch (e) {
-                console.error("Capital flow history fetch error:", e);
             } finally {
-                if (active) setCapitalFlowLoading(false);
-            }
-        }
-
-        // 8. Fetch Peer Radar
-        async function fetchPeerRadar() {
-            try {
-                if (active) setPeerRadarLoading(true);
-                const res = await fetch(`http://localhost:8000/api/stock/peer_radar/${params.code}`);
-                if (active && res.ok) {
-                    setPeerRadarData(await res.json());
+                if (active) {
+                    setIsNewsLoading(false);
+                    setFundFlowLoading(false);
+                    setCapitalFlowLoading(false);
+                    setPeerRadarLoading(false);
                 }
-            } catch (e) {
-                console.error("Peer radar fetch error:", e);
-            } finally {
-                if (active) setPeerRadarLoading(false);
             }
         }
 
-        fetchQuote();
-        fetchVisualIndicators();
-        fetchKline();
-        fetchAnalysis();
-        fetchNews();
-        fetchFundFlow();
-        fetchCapitalFlowHistory();
-        fetchPeerRadar();
+        fetchDetail();
 
         return () => {
             active = false;
@@ -1,6 +1,7 @@
 "use client";
 import { useEffect, useState, useMemo } from "react";
 import KLineChart from "@/components/KLineChart";
+import { toKlineBars } from "@/utils/klineUtils";
 import FundFlowTable from "@/components/FundFlowTable";
 import RiskAuditor from "@/components/RiskAuditor";
 import ValuationWaterline from "@/components/ValuationWaterline";
@@ -14,14 +15,18 @@ export default function RetailLabPage({ params }: { params: { code: string } })
     useEffect(() => {
         async function fetchData() {
             try {
-                const [qRes, iRes, kRes] = await Promise.all([
-                    fetch(`http://localhost:8000/api/stock/quote/${params.code}`),
-                    fetch(`http://localhost:8000/api/stock/visual_indicators/${params.code}`),
-                    fetch(`http://localhost:8000/api/stock/kline/${params.code}`)
-                ]);
-                if (qRes.ok) setQuote(await qRes.json());
-                if (iRes.ok) setIndicators(await iRes.json());
-                if (kRes.ok) setKline(await kRes.json());
+                // 三段数据走组合接口，一次请求内共享行情与 K 线拉取
+                const res = await fetch(`http://localhost:8000/api/stock/detail/${params.code}?sections=quote,visual_indicators,kline&kline_format=columnar`);
+                if (!res.ok) return;
+                const text = await res.text();
+                for (const line of text.split("\n")) {
+                    if (!line.trim()) continue;
+                    const item = JSON.parse(line);
+                    if (item.status !== 200) continue;
+                    if (item.section === 'quote') setQuote(item.data);
+                    else if (item.section === 'visual_indicators') setIndicators(item.data);
+                    else if (item.section === 'kline') setKline(toKlineBars(item.data));
+                }
             } catch (e) {
                 console.error("Fetch error", e);
             } finally {
@@ -5,16 +5,23 @@ import { useRouter } from "next/navigation";
 interface WatchlistStock {
     代码: string;
     名称: string;
-    最新价: number;
-    涨跌幅: number;
-    成交额: number;
+    最新价: number | null;
+    涨跌幅: number | null;
+    成交额: number | null;
+    量比: number | null;
+    peer_score: number | null;
+    industry: string | null;
 }
 
+type SortField = 'change' | 'price' | 'volume_ratio' | 'amount' | 'peer_score';
+
 export default function WatchlistPage() {
     const router = useRouter();
     const [watchlist, setWatchlist] = useState<WatchlistStock[]>([]);
     const [loading, setLoading] = useState(true);
     const [userId, setUserId] = useState<number | null>(null);
+    const [sortBy, setSortBy] = useState<SortField>('change');
+    const [order, setOrder] = useState<'asc' | 'desc'>('desc');
 
     useEffect(() => {
         const userToken = localStorage.getItem('user_token');
@@ -22,7 +29,6 @@ export default function WatchlistPage() {
             try {
                 const user = JSON.parse(userToken);
                 setUserId(user.id);
-                loadWatchlist(user.id);
             } catch (e) {
                 console.error("Failed to parse user token:", e);
                 setLoading(false);
@@ -32,31 +38,17 @@ export default function WatchlistPage() {
         }
     }, []);
 
+    useEffect(() => {
+        if (userId) loadWatchlist(userId);
+    }, [userId, sortBy, order]);
+
+    // 服务端一次连接行情与评分并排好序，不再逐只请求行情
     async function loadWatchlist(uid: number) {
         try {
-            const res = await fetch(`http://localhost:8000/api/user/watchlist/${uid}`);
+            const res = await fetch(`http://localhost:8000/api/user/watchlist/${uid}/view?sort_by=${sortBy}&order=${order}`);
             if (res.ok) {
-                const codes: string[] = await res.json();
-                if (codes.length > 0) {
-                    const promises = codes.map(code =>
-                        fetch(`http://localhost:8000/api/stock/quote/${code}`)
-                            .then(res => res.json())
-                            .catch(err => {
-                                console.error(`Failed to fetch ${code}:`, err);
-                                return null;
-                            })
-                    );
-
-                    const results = await Promise.all(promises);
-                    const validStocks = results.filter(stock => stock !== null).map(stock => ({
-                        代码: stock.代码,
-                        名称: stock.名称,
-                        最新价: stock.最新价,
-                        涨跌幅: ((stock.最新价 - stock.昨收) / stock.昨收 * 100),
-                        成交额: stock.成交额 || 0
-                    }));
-                    setWatchlist(validStocks);
-                }
+                const data = await res.json();
+                setWatchlist(data.items || []);
             }
         } catch (e) {
             console.error("Failed to load watchlist:", e);
@@ -64,6 +56,17 @@ export default function WatchlistPage() {
         setLoading(false);
     }
 
+    const toggleSort = (field: SortField) => {
+        if (field === sortBy) {
+            setOrder(order === 'desc' ? 'asc' : 'desc');
+        } else {
+            setSortBy(field);
+            setOrder('desc');
+        }
+    };
+
+    const sortMark = (field: SortField) => sortBy === field ? (order === 'desc' ? ' ↓' : ' ↑') : '';
+
     const removeFromWatchlist = async (code: string) => {
         if (!userId) return;
 
@@ -126,9 +129,11 @@ export default function WatchlistPage() {
                         <thead style={{ borderBottom: '1px solid var(--border-color)' }}>
                             <tr>
                                 <th style={{ padding: '12px 16px' }}>股票资产</th>
-                                <th style={{ textAlign: 'right' }}>最新价格</th>
-                                <th style={{ textAlign: 'right' }}>今日涨跌</th>
-                                <th style={{ textAlign: 'right' }}>日成交额</th>
+                                <th style={{ textAlign: 'right', cursor: 'pointer' }} onClick={() => toggleSort('price')}>最新价格{sortMark('price')}</th>
+                                <th style={{ textAlign: 'right', cursor: 'pointer' }} onClick={() => toggleSort('change')}>今日涨跌{sortMark('change')}</th>
+                                <th style={{ textAlign: 'right', cursor: 'pointer' }} onClick={() => toggleSort('volume_ratio')}>量比{sortMark('volume_ratio')}</th>
+                                <th style={{ textAlign: 'right', cursor: 'pointer' }} onClick={() => toggleSort('amount')}>日成交额{sortMark('amount')}</th>
+                                <th style={{ textAlign: 'right', cursor: 'pointer' }} onClick={() => toggleSort('peer_score')}>同业评分{sortMark('peer_score')}</th>
                                 <th style={{ textAlign: 'center', width: '80px' }}>操作</th>
                             </tr>
                         </thead>
@@ -146,15 +151,28 @@ export default function WatchlistPage() {
                                         </div>
                                     </td>
                                     <td style={{ textAlign: 'right', fontWeight: '600' }}>
-                                        ¥{stock.最新价.toFixed(2)}
+                                        {stock.最新价 != null ? `¥${stock.最新价.toFixed(2)}` : '--'}
                                     </td>
                                     <td style={{ textAlign: 'right' }}>
-                                        <div className={stock.涨跌幅 >= 0 ? "stock-up" : "stock-down"} style={{ fontWeight: '600' }}>
-                                            {stock.涨跌幅 >= 0 ? '+' : ''}{stock.涨跌幅.toFixed(2)}%
-                                        </div>
+                                        {stock.涨跌幅 != null ? (
+                                            <div className={stock.涨跌幅 >= 0 ? "stock-up" : "stock-down"} style={{ fontWeight: '600' }}>
+                                                {stock.涨跌幅 >= 0 ? '+' : ''}{stock.涨跌幅.toFixed(2)}%
+                                            </div>
+                                        ) : <span className="secondary-text">--</span>}
                                     </td>
                                     <td style={{ textAlign: 'right' }} className="secondary-text">
-                                        {(stock.成交额 / 100000000).toFixed(2)}亿
+                                        {stock.量比 != null ? stock.量比.toFixed(2) : '--'}
+                                    </td>
+                                    <td style={{ textAlign: 'right' }} className="secondary-text">
+                                        {stock.成交额 != null ? `${(stock.成交额 / 100000000).toFixed(2)}亿` : '--'}
+                                    </td>
+                                    <td style={{ textAlign: 'right' }}>
+                                        {stock.peer_score != null ? (
+                                            <div style={{ display: 'flex', flexDirection: 'column', alignItems: 'flex-end' }}>
+                                                <span style={{ fontWeight: '600' }}>{stock.peer_score.toFixed(1)}</span>
+                                                {stock.industry && <span className="secondary-text" style={{ fontSize: '11px' }}>{stock.industry}</span>}
+                                            </div>
+                                        ) : <span className="secondary-text">--</span>}
                                     </td>
                                     <td style={{ textAlign: 'center' }}>
                                         <button
@@ -1,15 +1,7 @@
 "use client";
 import React, { useEffect, useRef, useState } from 'react';
 import * as echarts from 'echarts';
-
-interface KLineData {
-    日期: string;
-    开盘: number;
-    最高: number;
-    最低: number;
-    收盘: number;
-    成交量: number;
-}
+import { KLineData } from '@/utils/klineUtils';
 
 interface Props {
     data: KLineData[];
@@ -0,0 +1,50 @@
+export interface KLineData {
+    日期: string;
+    开盘: number;
+    最高: number;
+    最低: number;
+    收盘: number;
+    成交量: number;
+}
+
+// /api/stock/kline?format=columnar 的返回：按字段的并行数组，时间为 start 起的差分（日线按天，分钟线按分钟）
+export interface ColumnarKline {
+    symbol: string;
+    format: 'columnar';
+    unit: 'day' | 'minute';
+    start: string | null;
+    dt: number[];
+    open: number[];
+    high: number[];
+    low: number[];
+    close: number[];
+    volume: number[];
+}
+
+const UNIT_MS = { day: 24 * 60 * 60 * 1000, minute: 60 * 1000 };
+
+export const decodeColumnarKline = (payload: ColumnarKline): KLineData[] => {
+    if (!payload.start || payload.dt.length === 0) return [];
+    const bars: KLineData[] = new Array(payload.dt.length);
+    const step = UNIT_MS[payload.unit] ?? UNIT_MS.day;
+    const labelLength = payload.unit === 'minute' ? 16 : 10;
+    // 服务端时间不带时区，按 UTC 解析与格式化，保证还原出的字符串一致
+    const startIso = payload.unit === 'minute' ? payload.start.replace(' ', 'T') : `${payload.start}T00:00`;
+    let t = Date.parse(`${startIso}:00Z`);
+    for (let i = 0; i < payload.dt.length; i++) {
+        t += payload.dt[i] * step;
+        bars[i] = {
+            日期: new Date(t).toISOString().slice(0, labelLength).replace('T', ' '),
+            开盘: payload.open[i],
+            最高: payload.high[i],
+            最低: payload.low[i],
+            收盘: payload.close[i],
+            成交量: payload.volume[i]
+        };
+    }
+    return bars;
+};
+
+// 兼容两种返回格式
+export const toKlineBars = (payload: ColumnarKline | KLineData[]): KLineData[] =>
+    Array.isArray(payload) ? payload : decodeColumnarKline(payload);